@@ -0,0 +1,222 @@
+import numpy as np
+from scipy.integrate import solve_ivp
+
+
+class HotAirBalloon:
+    """
+    热气球(AX7-77, Head Balloons)的无量纲非线性模型, 作为和Fopdt并列的过程模型
+    1. 状态 x = (高度, 速度, 球内温度), 输入 u = (燃料阀, 排气阀), 均为无量纲量；
+    2. simulate在每个输入不变的区间上只调用一次solve_ivp, 用稠密输出在要求的时间网格上取值；
+    3. 落地是终止事件: 落地后高度和速度保持为0(只有温度在变化), 直到浮力足以起飞；
+    4. next(u)推进一个采样周期, 可以直接接入SimulationUtils和MPC闭环仿真。
+    """
+
+    # 模型参数
+    ALPHA = 5.098
+    GAMMA = 5.257
+    MU = 0.1961
+    OMEGA = 8.544
+    DELTA = 0.0255
+    BETA = 0.01683
+
+    # 无量纲化使用的参考值: 高度(m), 时间(s), 温度(K), 燃料阀(%), 排气阀(%)
+    HR = 1000
+    TR = 10.10
+    TEMP_R = 288.2
+    FR = 4870
+    PR = 1485
+
+    # 环境温度下的初始状态
+    X_AMBIENT = (0.0, 0.0, 1.0)
+
+    # 中性浮力下的初始状态
+    X_NEUTRAL = (0.0, 0.0, 1.244)
+
+    # 起飞/落地事件的滞环宽度, 避免净加速度接近0时在两种状态之间反复切换
+    EVENT_TOL = 1e-9
+
+    def __init__(self, x0=X_AMBIENT, dt=0.25, rtol=1e-8, atol=1e-10):
+        """
+        构造函数
+        :param x0: tuple. 初始状态(高度, 速度, 温度), 无量纲
+        :param dt: float. next方法的采样周期, 无量纲时间(1 = TR秒)
+        :param rtol: float. solve_ivp的相对误差
+        :param atol: float. solve_ivp的绝对误差
+        """
+        if not dt > 0:
+            raise ValueError("dt需要大于0!")
+        self.x = np.array(x0, dtype=float)
+        self.t = 0.0
+        self.dt = dt
+        self.rtol = rtol
+        self.atol = atol
+
+        # next方法只给出燃料阀开度时使用的排气阀开度
+        self.vent = 0.0
+
+    @staticmethod
+    def derivative(t, x, u0, u1):
+        """
+        飞行状态下的微分方程
+        :param t: float. 时间
+        :param x: np.array. 状态
+        :param u0: float. 燃料阀(无量纲)
+        :param u1: float. 排气阀(无量纲)
+        :return: np.array. dx/dt
+        """
+        b = HotAirBalloon
+        ths = 1 - b.DELTA * x[0]
+        return np.array([
+            x[1],
+            b.ALPHA * b.MU * ths ** (b.GAMMA - 1) * (1 - ths / x[2]) - b.MU - b.OMEGA * x[1] * np.abs(x[1]),
+            -(x[2] - ths) * (b.BETA + u1) + u0
+        ])
+
+    @staticmethod
+    def ground_derivative(t, x, u0, u1):
+        """
+        停在地面时的微分方程: 高度和速度不变, 只有温度变化
+        """
+        return np.array([0.0, 0.0, -(x[2] - 1) * (HotAirBalloon.BETA + u1) + u0])
+
+    @staticmethod
+    def lift(x):
+        """
+        :param x: np.array. 状态
+        :return: float. 速度为0时的净加速度(浮力 - 重力), 大于0时可以起飞
+        """
+        b = HotAirBalloon
+        ths = 1 - b.DELTA * x[0]
+        return b.ALPHA * b.MU * ths ** (b.GAMMA - 1) * (1 - ths / x[2]) - b.MU
+
+    @staticmethod
+    def on_ground(x):
+        """
+        :param x: np.array. 状态
+        :return: bool. 是否停在地面上
+        """
+        return x[0] <= 0 and x[1] <= 0 and HotAirBalloon.lift(x) <= 0
+
+    def _integrate(self, x, t_start, t_end, u, t_eval):
+        """
+        输入不变的区间上的积分: 每次飞行/地面状态切换时重新启动一次solve_ivp
+        :param x: np.array. 区间起点的状态
+        :param t_start: float. 区间起点
+        :param t_end: float. 区间终点
+        :param u: tuple. (燃料阀, 排气阀)
+        :param t_eval: np.array. 需要取值的时刻, 在(t_start, t_end]内, 升序
+        :return: (x_end, values). values.shape = (len(t_eval), 3)
+        """
+        values = np.empty((len(t_eval), 3))
+        done = 0
+        flying = not HotAirBalloon.on_ground(x)
+        while True:
+            if flying:
+                fun, event = HotAirBalloon.derivative, _landing
+            else:
+                x = np.array([0.0, 0.0, x[2]])
+                fun, event = HotAirBalloon.ground_derivative, _takeoff
+            solution = solve_ivp(fun, (t_start, t_end), x, args=tuple(u), events=event,
+                                 dense_output=True, rtol=self.rtol, atol=self.atol)
+            t_stop = solution.t[-1]
+            stop = done + np.searchsorted(t_eval[done:], t_stop, side='right')
+            if stop > done:
+                values[done:stop] = solution.sol(t_eval[done:stop]).T
+            done = stop
+
+            x = solution.y[:, -1].copy()
+            if solution.status != 1:
+                break
+            # 终止事件: 落地时速度置为0, 起飞时从地面状态切换为飞行状态
+            if flying:
+                x[:2] = 0.0
+                if done and t_eval[done - 1] >= t_stop:
+                    values[done - 1] = x
+                # 落地时浮力已经足够(起飞事件不会再触发)时立即重新起飞, 和on_ground的判断一致
+                flying = HotAirBalloon.lift(x) > HotAirBalloon.EVENT_TOL
+            else:
+                flying = True
+            t_start = t_stop
+
+        # 落地后的取值点高度不能小于0
+        values[:, 0] = np.maximum(values[:, 0], 0.0)
+        return x, values
+
+    def simulate(self, u, dt=None):
+        """
+        在给定的输入序列下仿真, 从当前状态开始并更新当前状态
+        :param u: np.array. 每个采样周期的输入(燃料阀, 排气阀), 无量纲, shape(N, 2)
+        :param dt: float. 采样周期, None表示使用self.dt
+        :return: (t, x). t.shape = (N + 1,), x.shape = (N + 1, 3), 第0行为初始状态
+        """
+        dt = self.dt if dt is None else dt
+        u = np.atleast_2d(np.asarray(u, dtype=float))
+        n = len(u)
+        t = self.t + dt * np.arange(n + 1)
+        x = np.empty((n + 1, 3))
+        x[0] = self.x
+
+        # 相邻的相同输入合并为一个区间
+        changes = np.flatnonzero(np.any(np.diff(u, axis=0) != 0, axis=1)) + 1
+        bounds = np.concatenate(([0], changes, [n]))
+        state = self.x
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            state, x[start + 1:end + 1] = self._integrate(state, t[start], t[end], u[start], t[start + 1:end + 1])
+
+        self.x = state
+        self.t = t[-1]
+        return t, x
+
+    def next(self, u):
+        """
+        推进一个采样周期
+        :param u: float or tuple. 燃料阀开度(无量纲), 或者(燃料阀, 排气阀)
+        :return: float. 下一个采样时刻的高度(无量纲)
+        """
+        if np.ndim(u) == 0:
+            u = (u, self.vent)
+        self.simulate([u])
+        return self.x[0]
+
+    @staticmethod
+    def scale_inputs(fuel, vent):
+        """
+        :param fuel: np.array. 燃料阀开度(%)
+        :param vent: np.array. 排气阀开度(%)
+        :return: np.array. 无量纲输入, shape(N, 2)
+        """
+        return np.column_stack((np.asarray(fuel, dtype=float) / HotAirBalloon.FR,
+                                np.asarray(vent, dtype=float) / HotAirBalloon.PR))
+
+    @staticmethod
+    def scale_outputs(t, x):
+        """
+        :param t: np.array. 无量纲时间
+        :param x: np.array. 无量纲状态, shape(N, 3)
+        :return: (时间(s), 高度(m), 速度(m/s), 温度(°C))
+        """
+        b = HotAirBalloon
+        x = np.asarray(x)
+        return b.TR * np.asarray(t), x[:, 0] * b.HR, x[:, 1] * b.HR / b.TR, x[:, 2] * b.TEMP_R - 273.2
+
+
+def _landing(t, x, u0, u1):
+    """
+    落地事件: 飞行中高度下降到0
+    """
+    return x[0] + HotAirBalloon.EVENT_TOL
+
+
+_landing.terminal = True
+_landing.direction = -1
+
+
+def _takeoff(t, x, u0, u1):
+    """
+    起飞事件: 停在地面上时净加速度由负变正
+    """
+    return HotAirBalloon.lift(x) - HotAirBalloon.EVENT_TOL
+
+
+_takeoff.terminal = True
+_takeoff.direction = 1
@@ -0,0 +1,117 @@
+import threading
+from collections import OrderedDict
+import numpy as np
+
+
+class LruCache:
+    """
+    进程内共享的LRU缓存, 用于离散化系数、动态矩阵、Hessian分解等只和模型参数有关的预计算结果
+    1. key由结果的种类和全部相关参数组成(比如 ('fopdt.discretize', k, tau, dt)), 参数相同的模型共用同一份结果；
+    2. 模型参数变化后key随之变化, 不会读到旧的结果, 也不会影响其他模型的缓存; 旧的结果按LRU被淘汰；
+    3. 记录命中、未命中和淘汰次数; 读写加锁, 可以在多线程中使用。
+    缓存的numpy数组被设为只读, 调用方不能原地修改。
+    """
+
+    def __init__(self, maxsize=4096):
+        """
+        构造函数
+        :param maxsize: int. 最多缓存的结果个数, 0表示不缓存
+        """
+        if maxsize < 0:
+            raise ValueError("maxsize不能小于0! maxsize = %s" % maxsize)
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, factory):
+        """
+        读取缓存的结果, 没有时调用factory()计算并缓存
+        :param key: tuple. 可哈希的key
+        :param factory: callable. 无参数, 返回要缓存的结果
+        :return: 缓存的结果
+        """
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+
+        # 计算放在锁外, 不阻塞其他线程的读取; 并发计算同一个key时保留先写入的结果
+        value = _freeze(factory())
+        with self._lock:
+            if key in self._data:
+                return self._data[key]
+            if self.maxsize:
+                self._data[key] = value
+                while len(self._data) > self.maxsize:
+                    self._data.popitem(last=False)
+                    self.evictions += 1
+        return value
+
+    def invalidate(self, *prefix):
+        """
+        删除key以prefix开头的结果. 比如 invalidate('qp') 删除所有QP矩阵, invalidate() 删除全部结果
+        :param prefix: key的前几个元素
+        :return: int. 删除的结果个数
+        """
+        n = len(prefix)
+        with self._lock:
+            keys = [key for key in self._data if key[:n] == prefix]
+            for key in keys:
+                del self._data[key]
+        return len(keys)
+
+    def clear(self):
+        """
+        删除全部结果并清零计数
+        :return: none
+        """
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def info(self):
+        """
+        :return: dict. hits, misses, evictions, size, maxsize
+        """
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'size': len(self._data), 'maxsize': self.maxsize}
+
+
+def _freeze(value):
+    """
+    把结果中的numpy数组设为只读(递归处理tuple和dict)
+    """
+    if isinstance(value, np.ndarray):
+        value.setflags(write=False)
+    elif isinstance(value, tuple):
+        for item in value:
+            _freeze(item)
+    elif isinstance(value, dict):
+        for item in value.values():
+            _freeze(item)
+    return value
+
+
+def array_key(*arrays):
+    """
+    由数组内容生成可哈希的key, 用于权重、状态空间矩阵等数组参数
+    :param arrays: np.array
+    :return: tuple
+    """
+    return tuple((array.shape, array.dtype.str, array.tobytes())
+                 for array in (np.ascontiguousarray(a) for a in arrays))
+
+
+# 进程内共享的缓存
+CACHE = LruCache()
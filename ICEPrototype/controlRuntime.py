@@ -0,0 +1,264 @@
+import asyncio
+import inspect
+import logging
+import time
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from mpcControl import MpcController
+
+logger = logging.getLogger(__name__)
+
+
+class LoopStats:
+    """
+    单个控制回路的运行统计
+    1. jitter: 每个周期实际开始时刻和计划时刻之差(秒)；
+    2. missed: 求解没有在截止时间前完成(或上一次求解仍在进行)而使用后备策略的周期数；
+    3. failed: 读取cv、求解或写入uv抛出异常的周期数, 这些周期同样使用后备策略；
+    4. skipped: 由于整个周期被推迟(比如事件循环被阻塞)而没有执行的周期数。
+    """
+
+    def __init__(self):
+        self.cycles = 0
+        self.missed = 0
+        self.failed = 0
+        self.skipped = 0
+        self.jitters = []
+        self.solve_times = []
+
+    def summary(self):
+        """
+        :return: dict. cycles, missed, failed, skipped, miss_rate, mean_jitter, max_jitter,
+                 mean_solve_time, max_solve_time
+        """
+        jitters = np.asarray(self.jitters)
+        solve_times = np.asarray(self.solve_times)
+        return {
+            'cycles': self.cycles,
+            'missed': self.missed,
+            'failed': self.failed,
+            'skipped': self.skipped,
+            'miss_rate': self.missed / self.cycles if self.cycles else 0.0,
+            'mean_jitter': float(jitters.mean()) if len(jitters) else 0.0,
+            'max_jitter': float(jitters.max()) if len(jitters) else 0.0,
+            'mean_solve_time': float(solve_times.mean()) if len(solve_times) else 0.0,
+            'max_solve_time': float(solve_times.max()) if len(solve_times) else 0.0,
+        }
+
+
+class ControlLoop:
+    """
+    由ControlRuntime调度的一个控制回路: 读取cv -> 求解 -> 写入uv
+    """
+
+    def __init__(self, name, controller, read_cv, write_uv, cycle, sps=None, deadline=None,
+                 fallback=MpcController.HOLD):
+        """
+        构造函数
+        :param name: 回路的名字
+        :param controller: MpcController. 需要提供solve(cv0, sps), apply(solution, cv0, fallback)和fallback_move
+        :param read_cv: callable. read_cv() -> float, 读取cv的测量值, 可以是协程函数
+        :param write_uv: callable. write_uv(uv), 写入uv, 可以是协程函数
+        :param cycle: float. 扫描周期(秒)
+        :param sps: float, np.array or callable. 设定值; callable时为sps(n) -> 第n个周期的设定值; None表示沿用控制器中的设定值
+        :param deadline: float. 从周期开始到写入uv的最长时间(秒), None表示等于cycle
+        :param fallback: str. 求解超时或失败时的后备策略, MpcController.HOLD 或 MpcController.SHIFT
+        """
+        if not cycle > 0:
+            raise ValueError("扫描周期需要大于0! cycle = %s" % cycle)
+        if fallback not in (MpcController.HOLD, MpcController.SHIFT):
+            raise ValueError("未知的后备策略: %s" % fallback)
+        self.name = name
+        self.controller = controller
+        self.read_cv = read_cv
+        self.write_uv = write_uv
+        self.cycle = cycle
+        self.sps = sps
+        self.deadline = cycle if deadline is None else min(deadline, cycle)
+        self.fallback = fallback
+        self.stats = LoopStats()
+
+        # 超时后仍在执行的求解. 完成前不开始新的求解, 也不修改控制器:
+        # 这段时间内的后备uv直接写入, 对应的apply(每个周期的cv0)在求解完成后按顺序补上
+        self.pending = None
+        self.deferred = []
+
+    def setpoint(self, n):
+        return self.sps(n) if callable(self.sps) else self.sps
+
+
+class LoopClock:
+    """
+    事件循环的时钟, ControlRuntime的默认时钟. 测试时可以替换为提供相同接口的虚拟时钟
+    """
+
+    @staticmethod
+    def time():
+        return asyncio.get_running_loop().time()
+
+    @staticmethod
+    async def sleep(delay):
+        await asyncio.sleep(delay)
+
+
+async def _call(function, *args):
+    """
+    调用普通函数或协程函数
+    """
+    result = function(*args)
+    if inspect.isawaitable(result):
+        result = await result
+    return result
+
+
+def _retrieve_exception(future):
+    """
+    超时后继续执行的求解完成时调用, 取出并记录异常, 避免"exception was never retrieved"
+    """
+    if not future.cancelled() and future.exception() is not None:
+        logger.warning("超时的求解抛出异常: %r", future.exception())
+
+
+class ControlRuntime:
+    """
+    基于asyncio的控制回路运行时
+    1. 每个回路按固定的扫描周期运行, 第n个周期的计划时刻为 t0 + n * cycle, 不随求解耗时累积漂移；
+    2. 求解(CPU密集)放到executor中执行, 事件循环只负责调度和IO, 多个回路可以并发运行；
+    3. 求解超过截止时间或抛出异常时, 按回路的后备策略(保持uv或执行平移后的上一周期计划)写入uv, 超时的结果被丢弃;
+       一个回路的异常不影响这个回路之后的周期, 也不影响其他回路；
+    4. 每个回路记录jitter、超时和失败次数以及求解耗时(LoopStats)。
+    默认的executor为线程池: 控制器的状态保存在当前进程中, 不能放到进程池中求解。
+    """
+
+    def __init__(self, executor=None, max_workers=None, clock=None):
+        """
+        构造函数
+        :param executor: concurrent.futures.Executor. 执行求解的executor, None表示创建线程池
+        :param max_workers: int. 创建线程池时的线程数, None表示使用默认值
+        :param clock: 提供time()和协程sleep(delay)的时钟, None表示使用事件循环的时钟(LoopClock)
+        """
+        self.loops = {}
+        self._own_executor = executor is None
+        self.executor = ThreadPoolExecutor(max_workers) if executor is None else executor
+        self.clock = LoopClock() if clock is None else clock
+
+    def add_loop(self, name, controller, read_cv, write_uv, cycle, **options):
+        """
+        添加一个控制回路, 参数同ControlLoop
+        :return: ControlLoop
+        """
+        if name in self.loops:
+            raise ValueError("回路的名字不能重复: %s" % name)
+        self.loops[name] = ControlLoop(name, controller, read_cv, write_uv, cycle, **options)
+        return self.loops[name]
+
+    def stats(self):
+        """
+        :return: dict. 名字 -> LoopStats.summary()
+        """
+        return {name: loop.stats.summary() for name, loop in self.loops.items()}
+
+    async def run(self, duration=None, n_cycles=None):
+        """
+        并发运行所有回路. 结束时等待仍在执行的求解完成, 并补上推迟的apply
+        :param duration: float. 运行时间(秒), None表示不限制
+        :param n_cycles: int. 每个回路运行的周期数(包括被跳过的周期), None表示不限制
+        :return: dict. 同stats()
+        """
+        if duration is None and n_cycles is None:
+            raise ValueError("duration和n_cycles至少需要给出一个!")
+        start = self.clock.time()
+        end = None if duration is None else start + duration
+        await asyncio.gather(*(self._run_loop(loop, start, end, n_cycles) for loop in self.loops.values()))
+        return self.stats()
+
+    def close(self):
+        """
+        关闭由运行时创建的线程池
+        :return: none
+        """
+        if self._own_executor:
+            self.executor.shutdown(wait=True)
+
+    async def _run_loop(self, loop, start, end, n_cycles):
+        n = 0
+        while n_cycles is None or n < n_cycles:
+            scheduled = start + n * loop.cycle
+            if end is not None and scheduled >= end:
+                break
+            delay = scheduled - self.clock.time()
+            if delay > 0:
+                await self.clock.sleep(delay)
+            now = self.clock.time()
+
+            # 已经错过下一个周期的计划时刻时, 跳过中间的周期, 重新对齐到周期的整数倍
+            late = int((now - scheduled) // loop.cycle)
+            if late > 0:
+                loop.stats.skipped += late
+                n += late
+                scheduled += late * loop.cycle
+            loop.stats.jitters.append(now - scheduled)
+
+            await self._cycle(loop, n, scheduled + loop.deadline)
+            n += 1
+
+        if loop.pending is not None:
+            await asyncio.wait([loop.pending])
+            self._flush(loop)
+
+    def _flush(self, loop):
+        """
+        超时的求解完成后, 按顺序补上期间推迟的apply
+        """
+        loop.pending = None
+        for cv0 in loop.deferred:
+            loop.controller.apply(None, cv0, loop.fallback)
+        loop.deferred = []
+
+    async def _cycle(self, loop, n, deadline):
+        stats = loop.stats
+        stats.cycles += 1
+        if loop.pending is not None and loop.pending.done():
+            self._flush(loop)
+
+        cv0, solution, failed = None, None, False
+        try:
+            cv0 = await _call(loop.read_cv)
+            if loop.pending is None:
+                solution = await self._solve(loop, cv0, loop.setpoint(n), deadline)
+        except Exception:
+            logger.exception("回路%s的第%i个周期失败, 使用后备策略", loop.name, n)
+            failed = True
+
+        if failed:
+            stats.failed += 1
+        elif solution is None:
+            stats.missed += 1
+
+        if loop.pending is not None:
+            # 求解仍在进行: 只写入后备uv, apply在求解完成后补上
+            loop.deferred.append(cv0)
+            uv = loop.controller.fallback_move(loop.fallback, len(loop.deferred))
+        else:
+            uv = loop.controller.apply(solution, cv0, loop.fallback)
+        try:
+            await _call(loop.write_uv, uv)
+        except Exception:
+            logger.exception("回路%s的第%i个周期写入uv失败", loop.name, n)
+            if not failed:
+                stats.failed += 1
+
+    async def _solve(self, loop, cv0, sps, deadline):
+        """
+        在executor中求解, 超过截止时间时返回None, 求解继续在后台进行(loop.pending)
+        """
+        started = time.perf_counter()
+        future = asyncio.get_running_loop().run_in_executor(self.executor, loop.controller.solve, cv0, sps)
+        # 求解完成时才记录耗时, 超时的求解记录的是实际耗时而不是剩余的截止时间
+        future.add_done_callback(lambda _: loop.stats.solve_times.append(time.perf_counter() - started))
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), max(deadline - self.clock.time(), 0))
+        except asyncio.TimeoutError:
+            loop.pending = future
+            future.add_done_callback(_retrieve_exception)
+            return None
@@ -1,9 +1,14 @@
+import os
+import sys
 import numpy as np
 import matplotlib.pyplot as plt
 from scipy.integrate import odeint
 from scipy.optimize import minimize
 from scipy.interpolate import interp1d
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from identificationUtils import FopdtIdentification
+
 # define process model (to generate process data)
 def process(y,t,n,u,Kp,taup):
     # arguments
@@ -41,7 +46,6 @@ def fopdt(y,t,uf,Km,taum,thetam):
         #print('Error with time extrapolation: ' + str(t))
         um = 0
     # calculate derivative
-    print(um)
     dydt = (-y + Km * um)/taum
     return dydt
 
@@ -88,7 +92,7 @@ def sim_model(Km,taum,thetam):
     for i in range(1,ns+1):
         ts = [delta_t*(i-1),delta_t*i]
         y1 = odeint(fopdt,ym[i-1],ts,args=(uf,Km,taum,thetam))
-        ym[i] = y1[-1]
+        ym[i] = y1[-1][0]
     return ym
 
 # calculate model with updated parameters
@@ -99,12 +103,18 @@ thetam2 = 0
 ym = sim_model(Km,taum,thetam)
 ym2 = sim_model(Km,taum,thetam2)
 
+# fit Km, taum and thetam to the process data (analytic simulation, multi-start over thetam)
+fit = FopdtIdentification.fit(u, yp, delta_t)
+print('Km = %.3f, taum = %.3f, thetam = %.3f, rmse = %.4f' % (fit.k, fit.tau, fit.theta, fit.rmse))
+yfit = fit.cv_bias + FopdtIdentification.simulate(u - fit.uv_bias, fit.k, fit.tau, fit.theta, delta_t)
+
 # plot results
 plt.figure()
 plt.subplot(2,1,1)
 plt.plot(t,ym,'r--',linewidth=3,label='Fit FOPDT')
 plt.plot(t,ym2,'b--',linewidth=3,label='Fit FOPDT')
-#plt.plot(t,yp,'kx-',linewidth=2,label='Process Data')
+plt.plot(t,yfit,'g-',linewidth=2,label='Identified FOPDT')
+plt.plot(t,yp,'kx-',linewidth=2,label='Process Data')
 plt.ylabel('Output')
 plt.legend(loc='best')
 plt.subplot(2,1,2)
@@ -0,0 +1,93 @@
+# Benchmark: successive-linearization NMPC (BalloonNMPC) against a naive
+# nonlinear MPC that calls minimize on an odeint-simulated horizon every cycle.
+import os
+import sys
+import time
+import numpy as np
+import matplotlib.pyplot as plt
+from scipy.integrate import odeint
+from scipy.optimize import minimize
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from balloonUtils import HotAirBalloon
+from nmpcControl import BalloonNMPC
+
+n_cycles = 60
+sps = np.where(np.arange(n_cycles) < 40, 1.0, 0.5)  # dimensionless altitude (1 = 1000 m)
+
+# Start from level flight at 500 m: on the ground the naive optimizer sees a flat cost
+# (the ground constraint hides the effect of the burner) and never takes off
+x_start = np.array([0.5, 0.0, 1.2449])
+u_start = np.array([0.00438, 0.00015])
+
+
+def naive_cost(z, x0, u0, sp, controller):
+    # Simulate the horizon with odeint, one restart per control cycle
+    plan = z.reshape(controller.ch, 2) * controller.scale
+    x = np.array(x0)
+    heights = np.zeros(controller.ph)
+    for k in range(controller.ph):
+        u = plan[controller.index[k]]
+        x = odeint(HotAirBalloon.derivative, x, [0, controller.dt], tuple(u), tfirst=True)[-1]
+        if x[0] <= 0:
+            x[:2] = 0
+        heights[k] = x[0]
+    moves = np.diff(np.vstack((u0, plan)), axis=0) / controller.scale
+    return controller.sp_weight*np.sum((heights - sp)**2) + np.sum(controller.move_weight*moves**2)
+
+
+def run(mode):
+    controller = BalloonNMPC()
+    controller.u0 = u_start.copy()
+    plant = HotAirBalloon(x_start, dt=controller.dt)
+    bounds = [(low, high) for low, high in zip(controller.u_low / controller.scale,
+                                                controller.u_high / controller.scale)] * controller.ch
+    heights = np.zeros(n_cycles + 1)
+    heights[0] = x_start[0]
+    fuel = np.zeros(n_cycles)
+    times = np.zeros(n_cycles)
+    costs = np.zeros(n_cycles)
+    plan = np.tile(u_start, (controller.ch, 1))
+    for k in range(n_cycles):
+        start = time.perf_counter()
+        if mode == 'nmpc':
+            u = controller.step(plant.x, sps[k])
+            costs[k] = controller.last_solution.fun
+        else:
+            z0 = (np.vstack((plan[1:], plan[-1:])) / controller.scale).ravel()
+            solution = minimize(naive_cost, z0, args=(plant.x, controller.u0, sps[k], controller),
+                                method='SLSQP', bounds=bounds)
+            plan = solution.x.reshape(controller.ch, 2) * controller.scale
+            controller.u0 = plan[0]
+            u = plan[0]
+            costs[k] = controller.cost(plant.x, controller.u0, plan, sps[k])
+        times[k] = time.perf_counter() - start
+        heights[k + 1] = plant.next(u)
+        fuel[k] = u[0]
+    return heights, fuel, times, costs
+
+
+results = {}
+for mode in ('nmpc', 'naive'):
+    results[mode] = run(mode)
+    heights, fuel, times, costs = results[mode]
+    print('%-6s mean %.1f ms, max %.1f ms per cycle, IAE %.2f' % (
+        mode, 1e3*times.mean(), 1e3*times.max(), np.sum(np.abs(heights[1:] - sps))))
+
+plt.figure(1)
+plt.subplot(3, 1, 1)
+for mode, (heights, fuel, times, costs) in results.items():
+    plt.plot(heights*HotAirBalloon.HR, label=mode)
+plt.step(range(n_cycles), sps*HotAirBalloon.HR, 'k--', where='post', label='sp')
+plt.ylabel('altitude (m)')
+plt.legend()
+plt.subplot(3, 1, 2)
+for mode, (heights, fuel, times, costs) in results.items():
+    plt.step(range(n_cycles), fuel*HotAirBalloon.FR, where='post', label=mode)
+plt.ylabel('fuel valve (%)')
+plt.subplot(3, 1, 3)
+for mode, (heights, fuel, times, costs) in results.items():
+    plt.semilogy(times*1e3, label=mode)
+plt.ylabel('solve time (ms)')
+plt.xlabel('cycle')
+plt.show()
@@ -1,28 +1,11 @@
 # This script simulates a Hot Air Balloon, type AX7-77, Head Balloons
 # Tom Badgwell 06/07/17
+import os
+import sys
 import numpy as np
-from scipy.integrate import odeint
-
-def hab(x,t,alpha,gamma,mu,omega,delta,beta,u0,u1):
-    # This function evaluates the ode right hand side
-    #  for the hot air balloon simulation.
-
-    # Calculate derivatives
-    dxdt = np.zeros(3)
-    Ths = 1 - delta*x[0]
-    dxdt[0] = x[1]
-    dxdt[1] = alpha*mu*(Ths**(gamma-1))*(1-(Ths/x[2])) \
-              - mu -omega*x[1]*np.abs(x[1])
-    dxdt[2] = -(x[2] - Ths)*(beta + u1) + u0
-    return dxdt
-
-# Set hot air balloon parameters
-alpha = 5.098
-gamma = 5.257
-mu    = 0.1961
-omega = 8.544
-delta = 0.0255
-beta  = 0.01683
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from balloonUtils import HotAirBalloon
 
 # Set the variable scaling parameters
 
@@ -39,18 +22,8 @@ tf       = 5000
 dt       = 0.25
 N        = int(round((tf-t0)/dt) + 1)
 # xstart   = [0.0 0.0 1.244] # neutral buoyancy
-xstart   = [0.0,0.0,1.000] # ambient temperature
-tstart   = 0
-fk       = np.zeros(N)
-pk       = np.zeros(N)
-uk       = np.zeros((N,2))
-xk       = np.zeros((N,3))
-yk       = np.zeros((N,3))
-tm       = np.zeros(N)
-xk[0]    = xstart
+xstart   = HotAirBalloon.X_AMBIENT # ambient temperature
 C        = np.eye(3)
-yk[0]    = np.dot(C,xstart)
-tm[0]    = 0
 
 # Initial conditions
 fk = np.zeros(N)
@@ -95,34 +68,17 @@ fk[17000:N] =   0.0
 pk[17000:N] =   5.0
 
 # Make inputs dimensionless
+uk = np.zeros((N,2))
 uk[:,0] = fk/fr
 uk[:,1] = pk/pr
 
-# Run the simulation
-for k in range(N):
-
-    # Output iteration count
-    #print('iteration ' + str(k))
-
-    # Integrate the model for this time step
-    parms = (alpha,gamma,mu,omega,delta,beta,uk[k,0],uk[k,1])
-    tstop   = tstart + dt
-    tspan   = [tstart, tstop]
-    x   = odeint(hab, xstart, tspan, parms)
-
-    # Impose constraints when on the ground
-    if (x[-1,0] <= 0.0):
-        x[-1,0] = 0.0
-        x[-1,1] = 0.0
-
-    # Store solution
-    xk[k] = x[-1]
-    yk[k] = np.dot(C,xk[k])
-    tm[k]   = tr*tstop
-
-    # Set initial state
-    xstart = xk[k]
-    tstart = tstop
+# Run the simulation: one solver call per constant-input segment,
+# ground contact handled as a terminal event
+balloon = HotAirBalloon(xstart, dt)
+t, x = balloon.simulate(uk)
+xk = x[1:]
+yk = np.dot(xk, C.T)
+tm = tr*t[1:]
 
 # Recover dimensional outputs
 
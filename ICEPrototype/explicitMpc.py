@@ -0,0 +1,213 @@
+import itertools
+import numpy as np
+from scipy.linalg import cho_solve
+from scipy.optimize import OptimizeResult
+from scipy.spatial import cKDTree
+from mpcControl import QpMPC
+
+
+class ExplicitMPC:
+    """
+    FOPDT回路的显式MPC(离线预计算的分段仿射控制律)
+    1. 离线: 在参数空间theta = (cv0, uv0, sp)上采样, 用QpMPC求出每个采样点的有效集,
+       对每个有效集解析求出仿射控制律 x = K.dot(theta) + k 和对应的临界区域 P.dot(theta) <= q；
+    2. 在线: 用KD树找到最近的采样点, 检查其所在区域是否包含theta, 命中后只需要一次仿射计算；
+    3. theta不在任何预计算区域内时, 退回到在线求解(QpMPC)。
+    """
+
+    # 判断theta是否在区域内的容差
+    TOL = 1e-7
+
+    # 在线查询时检查的最近采样点个数
+    NEIGHBOURS = 8
+
+    def __init__(self, laws, regions, points, point_regions, lower, upper, index, fallback=None):
+        """
+        构造函数. 一般通过ExplicitMPC.build或ExplicitMPC.load创建
+        :param laws: list. 每个区域的控制律(K, k), K.shape = (ch, 3), k.shape = (ch,)
+        :param regions: list. 每个区域的不等式(P, q), P.dot(theta) <= q
+        :param points: np.array. 采样点, shape(n, 3)
+        :param point_regions: np.array. 每个采样点所在的区域编号, shape(n,)
+        :param lower: np.array. 参数空间的下界, shape(3,)
+        :param upper: np.array. 参数空间的上界, shape(3,)
+        :param index: np.array. 预测区间上每一步对应的决策变量编号, shape(ph,)
+        :param fallback: QpMPC. theta不在预计算区域内时使用的在线求解器
+        """
+        self.laws = laws
+        self.regions = regions
+        self.points = np.asarray(points, dtype=float)
+        self.point_regions = np.asarray(point_regions, dtype=int)
+        self.lower = np.asarray(lower, dtype=float)
+        self.upper = np.asarray(upper, dtype=float)
+        self.index = np.asarray(index, dtype=int)
+        self.fallback = fallback
+
+        # 按参数空间的范围归一化后建立KD树
+        self.scale = np.where(self.upper > self.lower, self.upper - self.lower, 1.0)
+        self.tree = cKDTree(self.points / self.scale)
+
+    @staticmethod
+    def build(arg_dict, cv_range, uv_range, sp_range, n_grid=11, uv_low=None, uv_high=None):
+        """
+        离线构建显式控制律
+        :param arg_dict: dict. mpc配置, 同MPC.cost_function
+        :param cv_range: tuple. cv0的范围(low, high)
+        :param uv_range: tuple. uv0的范围(low, high)
+        :param sp_range: tuple. sp的范围(low, high), 预测区间上的设定值取同一个值
+        :param n_grid: int. 每个参数维度上的采样点个数
+        :param uv_low: float. uv的下限, None表示不限制
+        :param uv_high: float. uv的上限, None表示不限制
+        :return: ExplicitMPC
+        """
+        qp = QpMPC(arg_dict, uv_low, uv_high)
+        if qp.model.theta:
+            raise ValueError("显式MPC的参数空间不包含迟滞的历史uv, 只支持theta = 0的模型!")
+
+        # theta = (cv0, uv0, sp): g = F.dot(theta), b = b0 + E.dot(theta)
+        F = np.column_stack((qp.f_cv, qp.f_uv, -qp.Gt_w.sum(axis=1)))
+        E = np.column_stack((np.zeros_like(qp.b_uv), qp.b_uv, np.zeros_like(qp.b_uv)))
+
+        ranges = (cv_range, uv_range, sp_range)
+        grid = [np.linspace(low, high, n_grid) for low, high in ranges]
+
+        laws, regions, region_ids = [], [], {}
+        points, point_regions = [], []
+        for theta in itertools.product(*grid):
+            theta = np.array(theta)
+            solution = qp.solve(*theta)
+            if not solution.success:
+                continue
+
+            active_set = tuple(sorted(solution.active_set))
+            if active_set not in region_ids:
+                law = ExplicitMPC._critical_region(qp, F, E, list(active_set))
+                if law is None:
+                    continue
+                region_ids[active_set] = len(laws)
+                laws.append(law[0])
+                regions.append(law[1])
+            region = region_ids[active_set]
+
+            P, q = regions[region]
+            if np.all(P.dot(theta) <= q + ExplicitMPC.TOL):
+                points.append(theta)
+                point_regions.append(region)
+
+        lower = [low for low, high in ranges]
+        upper = [high for low, high in ranges]
+        return ExplicitMPC(laws, regions, np.array(points).reshape(-1, 3), point_regions,
+                           lower, upper, qp.index, qp)
+
+    @staticmethod
+    def _critical_region(qp, F, E, active_set):
+        """
+        求有效集对应的仿射控制律和临界区域
+        :param qp: QpMPC.
+        :param F: np.array. 一次项对theta的系数, shape(ch, 3)
+        :param E: np.array. 约束右端项对theta的系数, shape(m, 3)
+        :param active_set: list. 有效约束
+        :return: ((K, k), (P, q)), 有效约束线性相关时返回None
+        """
+        A, b0 = qp.A, qp.b0
+        H_inv_F = cho_solve(qp.H_factor, F)
+        inactive = np.setdiff1d(np.arange(A.shape[0]), active_set)
+
+        if active_set:
+            A_w = A[active_set]
+            H_inv_At = cho_solve(qp.H_factor, A_w.T)
+            S = A_w.dot(H_inv_At)
+            if np.linalg.matrix_rank(S) < len(active_set):
+                return None
+            # 乘子 lam = L.dot(theta) + l
+            L = -np.linalg.solve(S, A_w.dot(H_inv_F) + E[active_set])
+            l = -np.linalg.solve(S, b0[active_set])
+            K = -H_inv_F - H_inv_At.dot(L)
+            k = -H_inv_At.dot(l)
+            # 乘子非负: -L.dot(theta) <= l
+            P, q = [-L], [l]
+        else:
+            K = -H_inv_F
+            k = np.zeros(A.shape[1])
+            P, q = [], []
+
+        # 其余约束满足: (A_i.dot(K) - E_i).dot(theta) <= b0_i - A_i.dot(k)
+        A_i = A[inactive]
+        P.append(A_i.dot(K) - E[inactive])
+        q.append(b0[inactive] - A_i.dot(k))
+        return (K, k), (np.vstack(P).reshape(-1, 3), np.concatenate(q))
+
+    def locate(self, theta):
+        """
+        查找包含theta的区域
+        :param theta: np.array. (cv0, uv0, sp)
+        :return: int. 区域编号, 不在任何预计算区域内时返回-1
+        """
+        if len(self.points) == 0 or np.any(theta < self.lower) or np.any(theta > self.upper):
+            return -1
+        k = min(ExplicitMPC.NEIGHBOURS, len(self.points))
+        _, nearest = self.tree.query(theta / self.scale, k=k)
+        for region in dict.fromkeys(self.point_regions[np.atleast_1d(nearest)]):
+            P, q = self.regions[region]
+            if np.all(P.dot(theta) <= q + ExplicitMPC.TOL):
+                return region
+        return -1
+
+    def solve(self, cv0, uv0, sp):
+        """
+        计算当前周期的最优uvs: 查表 + 一次仿射计算, 不在预计算区域内时使用在线求解器
+        :param cv0: float. cv的初始值
+        :param uv0: float. uv的初始值
+        :param sp: float. 预测区间上的设定值
+        :return: solution: OptimizeResult. 和QpMPC.solve的返回值用法相同, solution.region为区域编号(-1表示在线求解)
+        """
+        theta = np.array([cv0, uv0, sp], dtype=float)
+        region = self.locate(theta)
+        if region >= 0:
+            K, k = self.laws[region]
+            x = K.dot(theta) + k
+            return OptimizeResult(x=x[self.index], success=True, status=0,
+                                  message='Explicit law evaluated', nit=0, region=region)
+
+        if self.fallback is None:
+            return OptimizeResult(x=np.full(len(self.index), float(uv0)), success=False, status=2,
+                                  message='Parameter outside the precomputed regions', nit=0, region=-1)
+        solution = self.fallback.solve(cv0, uv0, sp)
+        solution.region = -1
+        return solution
+
+    def save(self, path):
+        """
+        把显式控制律和区域索引保存到npz文件
+        :param path: str. 文件路径
+        :return: none
+        """
+        ch = self.index.max() + 1
+        rows = [len(q) for P, q in self.regions]
+        np.savez(
+            path,
+            K=np.array([K for K, k in self.laws]).reshape(-1, ch, 3),
+            k=np.array([k for K, k in self.laws]).reshape(-1, ch),
+            P=np.vstack([P for P, q in self.regions]) if self.regions else np.zeros((0, 3)),
+            q=np.concatenate([q for P, q in self.regions]) if self.regions else np.zeros(0),
+            rows=np.array(rows, dtype=int),
+            points=self.points,
+            point_regions=self.point_regions,
+            lower=self.lower,
+            upper=self.upper,
+            index=self.index
+        )
+
+    @staticmethod
+    def load(path, fallback=None):
+        """
+        从npz文件加载显式控制律
+        :param path: str. 文件路径
+        :param fallback: QpMPC. theta不在预计算区域内时使用的在线求解器
+        :return: ExplicitMPC
+        """
+        data = np.load(path)
+        offsets = np.concatenate(([0], np.cumsum(data['rows'])))
+        laws = list(zip(data['K'], data['k']))
+        regions = [(data['P'][start:end], data['q'][start:end]) for start, end in zip(offsets[:-1], offsets[1:])]
+        return ExplicitMPC(laws, regions, data['points'], data['point_regions'],
+                           data['lower'], data['upper'], data['index'], fallback)
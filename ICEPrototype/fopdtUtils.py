@@ -1,52 +1,139 @@
+import copy
 import numpy as np
 from scipy.integrate import odeint
-import random
-from collections import deque
-import warnings
+from scipy.signal import lfilter
+from scipy.linalg import toeplitz
+from noiseUtils import NoiseModel, NoiseStack
+from cacheUtils import CACHE
 
 
 class _UVStore:
     """
-    以栈的形式，储存uv的历史数据，储存元素的上限一般等于dead time
+    以预分配的numpy环形缓冲区储存uv的历史数据，用于实现迟滞(dead time)
+    1. save_uv/pop_uv均为O(1)，不为每个数据点创建对象；
+    2. 支持小数迟滞: theta = lag + frac 时，迟滞后的uv = (1 - frac) * u[n - lag] + frac * u[n - lag - 1]；
+    3. 历史数据可以直接用于向量化的预测区间计算(delayed_inputs)。
     """
 
-    class UVInfo:
+    def __init__(self, theta, init_value=0.0):
         """
-        UV数据的实体类
+        构造函数
+        :param theta: float. 迟滞时间(控制周期的个数), theta >= 0
+        :param init_value: float. 没有历史数据时uv的取值
         """
-        def __init__(self, time, value):
-            self.time = time
-            self.value = value
-
-        def get_value(self):
-            return self.value
-
-        def get_time(self):
-            return self.time
+        if theta < 0:
+            raise ValueError("迟滞时间不能小于0!")
+        self.theta = theta
+        self.lag = int(np.floor(theta))
+        self.frac = float(theta - self.lag)
 
-    def __init__(self, max_len):
-        self.stack = deque(maxlen=max_len)
+        # 最多需要读取lag + 1步之前的数据
+        self.size = self.lag + 2
+        self.values = np.full(self.size, float(init_value))
+        self.times = np.zeros(self.size)
+        self.head = self.size - 1
 
     def save_uv(self, time, value):
-        self.stack.append(self.UVInfo(time, value))
+        """
+        保存一个uv
+        :param time: float. 时间
+        :param value: float. uv
+        :return: none
+        """
+        self.head = (self.head + 1) % self.size
+        self.values[self.head] = value
+        self.times[self.head] = time
 
     def pop_uv(self):
-        if len(self.stack) == 0:
-            warnings.warn('空的UV储存器')
-            return 0
-        else:
-            return self.stack[0].get_value()
+        """
+        读取迟滞后的uv(最近一次保存的uv视为当前时刻的输入)
+        :return: float. 迟滞后的uv
+        """
+        value = self.values[(self.head - self.lag) % self.size]
+        if self.frac:
+            value = (1 - self.frac) * value + self.frac * self.values[(self.head - self.lag - 1) % self.size]
+        return value
+
+    def history(self, n):
+        """
+        最近保存的n个uv
+        :param n: int. 个数, n <= size
+        :return: np.array. 按时间从旧到新排列, shape(n,)
+        """
+        return self.values[(self.head - np.arange(n - 1, -1, -1)) % self.size]
+
+    def delayed_inputs(self, uvs):
+        """
+        把预测区间上的uv序列转换为迟滞后实际作用于过程的uv序列, 迟滞超出部分由历史数据补齐
+        :param uvs: np.array. 从当前时刻开始依次写入的uv, shape(ph,) 或 shape(n, ph)
+        :return: np.array. 迟滞后的uv, shape与uvs相同
+        """
+        uvs = np.asarray(uvs, dtype=float)
+        if self.theta == 0:
+            return uvs
+        ph = uvs.shape[-1]
+        history = np.broadcast_to(self.history(self.lag + 1), uvs.shape[:-1] + (self.lag + 1,))
+        full = np.concatenate((history, uvs), axis=-1)
+        return (1 - self.frac) * full[..., 1:ph + 1] + self.frac * full[..., :ph]
+
+    def delayed_inputs_transpose(self, weights):
+        """
+        delayed_inputs对uvs的雅可比矩阵(即shift_matrix)的转置与weights的乘积
+        :param weights: np.array. shape(ph,)
+        :return: np.array. shape(ph,)
+        """
+        weights = np.asarray(weights, dtype=float)
+        if self.theta == 0:
+            return weights
+        ph = weights.shape[-1]
+        padded = np.concatenate((weights, np.zeros(self.lag + 1)))
+        return (1 - self.frac) * padded[self.lag:self.lag + ph] + self.frac * padded[self.lag + 1:self.lag + 1 + ph]
+
+    def shift_matrix(self, ph):
+        """
+        delayed_inputs对uvs的雅可比矩阵
+        :param ph: int. 预测区间长度
+        :return: np.array. shape(ph, ph)
+        """
+        return (1 - self.frac) * np.eye(ph, k=-self.lag) + self.frac * np.eye(ph, k=-self.lag - 1)
+
+
+def discretize_fopdt(k, tau, dt):
+    """
+    FOPDT在零阶保持下的离散化系数, 从进程内共享的缓存读取
+    :param k: float. process gain
+    :param tau: float. process time constant
+    :param dt: float. 采样周期
+    :return: (a, b). a = exp(-dt/tau), b = (1 - a) * k
+    """
+    def factory():
+        if not tau > 0 or not dt > 0:
+            raise ValueError("tau和采样周期都需要大于0! tau = %s, dt = %s" % (tau, dt))
+        a = float(np.exp(-dt / tau))
+        return a, (1 - a) * k
+
+    return CACHE.get(('fopdt.discretize', float(k), float(tau), float(dt)), factory)
 
 
 class Fopdt:
 
-    def __init__(self, k, tau, y0, dv, theta):
+    # 求解方式: 零阶保持下的解析解(默认)
+    ANALYTIC = 'analytic'
+
+    # 求解方式: odeint数值积分(参考实现，用于和解析解互相校验)
+    ODEINT = 'odeint'
+
+    def __init__(self, k, tau, y0, dv, theta=0, method=ANALYTIC, seed=None, noise=None):
         """
         构造函数
         :param k: float. process gain
         :param tau: float. process time constant
         :param y0: float. t = 0时的cv值
         :param dv: float. 扰动幅度. (eg. dv = 5, 则next方法返回的cv值会上下随机波动5%, dv = 0则无波动)
+        :param theta: float. 迟滞时间(时间步的个数), 可以是小数
+        :param method: str. 求解方式, Fopdt.ANALYTIC 或 Fopdt.ODEINT
+        :param seed: int. 噪声的随机数种子, 相同的seed得到完全相同的仿真结果
+        :param noise: NoiseModel. 测量噪声和不可测扰动, None表示只使用dv的乘性扰动
         """
         # 增益
         self.k = k
@@ -63,12 +150,40 @@ class Fopdt:
         # 当前实例的时间步
         self.t = 0
 
-        # 扰动幅度. float, dv > 0
-        self.dv = dv
+        # 测量噪声和不可测扰动
+        self.noise = NoiseModel(dv=dv, seed=seed) if noise is None else noise
 
         # 历史uv储存器
         self.uv_store = _UVStore(theta)
 
+        # 求解方式
+        self.method = Fopdt._check_method(method)
+
+        # 最近一次离散化的参数和结果
+        self._discretization = None
+
+    @property
+    def dv(self):
+        """
+        :return: float. 扰动幅度(百分比), 保存在噪声模型中
+        """
+        return self.noise.dv
+
+    @dv.setter
+    def dv(self, dv):
+        self.noise.dv = dv
+
+    @staticmethod
+    def _check_method(method):
+        """
+        检查求解方式是否合法
+        :param method: str. 求解方式
+        :return: method: str
+        """
+        if method not in (Fopdt.ANALYTIC, Fopdt.ODEINT):
+            raise ValueError("未知的求解方式: %s" % method)
+        return method
+
     def fopdt(self, y, t, u):
         """
         默认的一阶响应函数，用于简单的调试
@@ -88,12 +203,13 @@ class Fopdt:
         """
         return self.fopdt
 
-    def solve_sequence_fopdt(self, times, uvs, y0):
+    def solve_sequence_fopdt(self, times, uvs, y0, method=None):
         """
         求解多个操作步的输出
         :param times:list. time list, shape(n,)
         :param uvs:list. uv list, shape(n,)
         :param y0: float. cv init condition
+        :param method: str. 求解方式, 默认使用实例的求解方式
         :return: np.array. cv output, shape(n,)
         """
         if len(times) != len(uvs):
@@ -106,18 +222,19 @@ class Fopdt:
                 t = times[i]
                 self.uv_store.save_uv(t, uvs[i])
                 uv = self.uv_store.pop_uv()
-                y = self.solve_step_fopdt(times[i - 1], t, y0, uv)
+                y = self.solve_step_fopdt(times[i - 1], t, y0, uv, method)
                 y_res[i] = y0 = y
             return y_res
 
     @staticmethod
-    def solve_sequence_fopdt(fopdt, times, uvs, y0):
+    def solve_sequence_no_delay(fopdt, times, uvs, y0, method=ANALYTIC):
         """
-        静态方法。求解多个操作步的输出
+        静态方法。不经过迟滞缓冲区(忽略theta), 求解多个操作步的输出
         :param fopdt: class FOPDT
         :param times:list. time list, shape(n,)
         :param uvs:list. uv list, shape(n,)
         :param y0: float. cv init condition
+        :param method: str. 求解方式, Fopdt.ANALYTIC 或 Fopdt.ODEINT
         :return: np.array. cv output, shape(n,)
         """
         if len(times) != len(uvs):
@@ -128,36 +245,290 @@ class Fopdt:
             y_res[0] = y0
             for i in range(1, length):
                 t = times[i]
-                y = odeint(fopdt.get_fopdt_fn(), y0, [times[i - 1], t], args=(uvs[i],))[1][0]
+                y = fopdt.solve_step_fopdt(times[i - 1], t, y0, uvs[i], method)
                 y_res[i] = y0 = y
             return y_res
 
-    def solve_step_fopdt(self, start_t, end_t, init_y, uv):
+    def solve_step_fopdt(self, start_t, end_t, init_y, uv, method=None):
         """
         求解单个操作步的输出
         :param start_t: float. end time
         :param end_t: float. start time
         :param init_y: float. output at time = start_t
         :param uv: float. uv
+        :param method: str. 求解方式, 默认使用实例的求解方式
         :return: y. float. output at time = end_t
         """
         assert end_t > start_t, "end_t 需要大于 start_t!"
-        t = [start_t, end_t]
-        y = odeint(self.fopdt, init_y, t, args=(uv,))
-        return y[1][0]
+        if method is None:
+            method = self.method
+        if Fopdt._check_method(method) == Fopdt.ODEINT:
+            t = [start_t, end_t]
+            y = odeint(self.fopdt, init_y, t, args=(uv,))
+            return y[1][0]
+
+        # uv在[start_t, end_t]内保持不变, 一阶微分方程有精确解:
+        # y(end_t) = k*u + (y(start_t) - k*u) * exp(-(end_t - start_t)/tau)
+        a, b = self.discretize(end_t - start_t)
+        return a * init_y + b * uv
+
+    def discretize(self, dt):
+        """
+        零阶保持下的精确离散化: y[n] = a * y[n-1] + b * u[n], a = exp(-dt/tau), b = (1 - a) * k
+        最近一次的结果保存在实例中, 其他(k, tau, dt)从进程内共享的缓存读取, 参数相同的模型共用同一份结果
+        :param dt: float. 采样周期
+        :return: (a, b)
+        """
+        key = (self.k, self.tau, dt)
+        if self._discretization is None or self._discretization[0] != key:
+            self._discretization = (key, discretize_fopdt(self.k, self.tau, dt))
+        return self._discretization[1]
+
+    def predict_horizon(self, cv0, uvs, dt):
+        """
+        计算整个预测区间上的cv轨迹(零阶保持的解析解, 不含逐步的python循环)
+        y[i] = a * y[i-1] + (1 - a) * k * u[i], a = exp(-dt/tau), y[-1] = cv0
+        其中u为经过迟滞后的uvs, 迟滞超出预测区间的部分取自uv_store中已经写入的历史uv
+        :param cv0: float. 预测区间开始时的cv值
+        :param uvs: np.array. 每个控制周期内保持不变的uv, shape(ph,) 或 shape(n, ph)(一批候选uv序列)
+        :param dt: float. 控制周期
+        :return: np.array. 每个控制周期结束时的cv预测值, shape与uvs相同
+        """
+        uvs = self.uv_store.delayed_inputs(uvs)
+        a, b = self.discretize(dt)
+        zi = np.full(uvs.shape[:-1] + (1,), a * cv0)
+        y, _ = lfilter([b], [1, -a], uvs, axis=-1, zi=zi)
+        return y
+
+    def predict_horizon_transpose(self, weights, dt):
+        """
+        predict_horizon对uvs的灵敏度矩阵的转置与weights的乘积, 即 (G * S)^T * weights
+        G[i][j] = (1 - a) * k * a^(i-j), i >= j, 为阶跃响应系数构成的下三角Toeplitz矩阵, S为迟滞的平移矩阵.
+        用于计算损失函数对uvs的解析梯度
+        :param weights: np.array. 每个控制周期cv预测值的权重, shape(ph,)
+        :param dt: float. 控制周期
+        :return: np.array. d(sum(weights * y))/d(uvs), shape(ph,)
+        """
+        weights = np.asarray(weights, dtype=float)
+        a, b = self.discretize(dt)
+        # G^T是上三角矩阵, 等价于在反向时间上做同样的递推
+        return self.uv_store.delayed_inputs_transpose(lfilter([b], [1, -a], weights[::-1])[::-1])
+
+    def dynamic_matrix(self, ph, dt):
+        """
+        预测区间上的动态矩阵G和自由响应系数phi,
+        满足 predict_horizon(cv0, uvs, dt) = phi * cv0 + G.dot(uvs) + history_response(ph, dt)
+        :param ph: int. 预测区间长度
+        :param dt: float. 控制周期
+        :return: (G, phi). G: np.array, shape(ph, ph), G[i][j] = d(y[i])/d(uvs[j]), 包含迟滞;
+                 phi: np.array, shape(ph,), phi[i] = a^(i+1). 结果从共享缓存读取, 是只读数组
+        """
+        return CACHE.get(('fopdt.dynamic_matrix', self.k, self.tau, self.theta, dt, ph),
+                         lambda: self._dynamic_matrix(ph, dt))
+
+    def _dynamic_matrix(self, ph, dt):
+        a, b = self.discretize(dt)
+        powers = a ** np.arange(ph)
+        G = np.tril(toeplitz(b * powers))
+        if self.theta:
+            G = G.dot(self.uv_store.shift_matrix(ph))
+        return G, a * powers
+
+    @property
+    def cache_key(self):
+        """
+        :return: tuple. 模型参数, 用于缓存由模型得到的预计算结果(比如QpMPC的Hessian)
+        """
+        return 'Fopdt', self.k, self.tau, self.theta
+
+    def history_response(self, ph, dt):
+        """
+        由于迟滞, 已经写入的历史uv在预测区间上引起的cv响应(cv0 = 0, 之后写入的uv都为0)
+        :param ph: int. 预测区间长度
+        :param dt: float. 控制周期
+        :return: np.array. shape(ph,), 没有迟滞时全为0
+        """
+        if not self.theta:
+            return np.zeros(ph)
+        return self.predict_horizon(0, np.zeros(ph), dt)
+
+    def record_uv(self, uv, time=None):
+        """
+        记录写入过程的uv(进入迟滞缓冲区), 不推进模型. 作为MPC的预测模型时由控制器调用
+        :param uv: float. 当前时刻写入的uv
+        :param time: float. 时间, None表示使用当前的时间步
+        :return: none
+        """
+        self.uv_store.save_uv(self.t if time is None else time, uv)
 
     def next(self, uv):
         """
         计算当前实例化对象，下一个时间步的输出
-        :param uv: float. uv
+        :param uv: float. 当前时刻写入的uv, 经过theta个时间步的迟滞后作用于过程
         :return: y. float. 下一个时间步的输出
         """
         t_next = self.t + 1
+        self.uv_store.save_uv(self.t, uv)
+        uv = self.uv_store.pop_uv()
         y = self.solve_step_fopdt(self.t, t_next, self.y0, uv)
         self.y0 = y
         self.t = t_next
+        return self.noise.apply(y)
+
+
+class FopdtBank:
+    """
+    以结构数组(struct-of-arrays)形式保存的一组FOPDT过程, 用于大规模仿真
+    1. N个回路的k, tau, theta, 状态和迟滞缓冲区都保存在numpy数组中, next一次向量化地推进所有回路；
+    2. 每个回路仍然可以通过名字访问；
+    3. 离散化方式和Fopdt的解析解相同(零阶保持), 迟滞支持小数。
+    """
+
+    def __init__(self, names, k, tau, y0, dv=0, theta=0, circle=1, seed=None, noise=None):
+        """
+        构造函数
+        :param names: list. 每个回路的名字, shape(N,)
+        :param k: float or np.array. process gain, 标量或shape(N,)
+        :param tau: float or np.array. process time constant
+        :param y0: float or np.array. t = 0时的cv值
+        :param dv: float or np.array. 扰动幅度(百分比), 同Fopdt
+        :param theta: float or np.array. 迟滞时间(时间步的个数), 可以是小数
+        :param circle: float. 时间步长
+        :param seed: int. 随机数种子, 第i个回路的噪声序列只由seed和i决定, 和回路总数无关
+        :param noise: NoiseModel(n = N)或NoiseStack. 测量噪声和不可测扰动, None表示只使用dv的乘性扰动
+        """
+        self.names = list(names)
+        self.indices = {name: i for i, name in enumerate(self.names)}
+        if len(self.indices) != len(self.names):
+            raise ValueError("回路的名字不能重复!")
+        n = len(self.names)
+
+        self.k = np.array(np.broadcast_to(np.asarray(k, dtype=float), (n,)))
+        self.tau = np.array(np.broadcast_to(np.asarray(tau, dtype=float), (n,)))
+        self.y = np.array(np.broadcast_to(np.asarray(y0, dtype=float), (n,)))
+        self.theta = np.array(np.broadcast_to(np.asarray(theta, dtype=float), (n,)))
+        if np.any(self.tau <= 0) or np.any(self.theta < 0):
+            raise ValueError("tau需要大于0, theta不能小于0!")
+        self.circle = circle
+        self.t = 0
+        self.noise = NoiseModel(n, dv=dv, seed=seed) if noise is None else noise
+        if self.noise.shape != (n,):
+            raise ValueError("噪声模型的通道个数需要和回路个数一致!")
+
+        # 迟滞缓冲区: 所有回路共用同一个写指针, 每个回路按各自的lag读取
+        self.lag = np.floor(self.theta).astype(int)
+        self.frac = self.theta - self.lag
+        self.size = int(self.lag.max(initial=0)) + 2
+        self.buffer = np.zeros((n, self.size))
+        self.head = self.size - 1
+        self.rows = np.arange(n)
+        self.last_uvs = np.zeros(n)
+
+        self.discretize()
 
-        dv = (self.dv * (2 * random.random() - 1))/100
-        return y * (1 + dv)
+    @staticmethod
+    def from_fopdts(fopdts, circle=1, seed=None):
+        """
+        由一组Fopdt实例创建, 带上各实例当前的cv、迟滞缓冲区中的uv历史和噪声模型(副本), 之后的输出和逐个调用Fopdt.next一致
+        :param fopdts: dict. 名字 -> Fopdt, 需要使用解析解(Fopdt.ANALYTIC)
+        :param circle: float. 时间步长
+        :param seed: int. 随机数种子. None表示使用各Fopdt噪声模型的副本; 否则忽略它们, 按dv和seed生成乘性扰动(同构造函数)
+        :return: FopdtBank
+        """
+        items = list(fopdts.values())
+        numeric = [name for name, f in fopdts.items() if f.method != Fopdt.ANALYTIC]
+        if numeric:
+            raise ValueError("FopdtBank只支持解析解, 以下回路使用了%s: %s" % (Fopdt.ODEINT, numeric))
+
+        noise = None
+        if seed is None and any(np.any(f.noise.dv) or f.noise.additive for f in items):
+            noise = NoiseStack([copy.deepcopy(f.noise) for f in items])
+        bank = FopdtBank(
+            list(fopdts.keys()),
+            [f.k for f in items], [f.tau for f in items], [f.y0 for f in items],
+            [f.dv for f in items], [f.theta for f in items], circle, seed, noise
+        )
+
+        # 迟滞缓冲区: 按时间从新到旧对齐到bank的写指针
+        for i, f in enumerate(items):
+            history = f.uv_store.history(f.uv_store.size)
+            bank.buffer[i, (bank.head - np.arange(len(history))) % bank.size] = history[::-1]
+            bank.last_uvs[i] = history[-1]
+        return bank
+
+    @property
+    def dv(self):
+        """
+        :return: np.array. 每个回路的扰动幅度(百分比), 保存在噪声模型中
+        """
+        return self.noise.dv
+
+    def __len__(self):
+        return len(self.names)
+
+    def index(self, name):
+        """
+        :param name: 回路的名字
+        :return: int. 回路在数组中的位置
+        """
+        return self.indices[name]
+
+    def get(self, name):
+        """
+        :param name: 回路的名字
+        :return: float. 该回路当前(不含扰动)的cv值
+        """
+        return self.y[self.indices[name]]
+
+    def discretize(self):
+        """
+        重新计算所有回路的离散化系数, 修改k或tau后需要调用.
+        (k, tau)相同的回路只计算一次, 结果和Fopdt共用同一个缓存
+        :return: none
+        """
+        params, inverse = np.unique(np.stack((self.k, self.tau), axis=1), axis=0, return_inverse=True)
+        coefficients = np.array([discretize_fopdt(k, tau, self.circle) for k, tau in params]).reshape(-1, 2)
+        self.a, self.b = coefficients[inverse.ravel()].T.copy()
+
+    def set_params(self, name, k=None, tau=None):
+        """
+        修改某个回路的模型参数
+        :param name: 回路的名字
+        :param k: float. process gain, None表示不变
+        :param tau: float. process time constant, None表示不变
+        :return: none
+        """
+        i = self.indices[name]
+        if k is not None:
+            self.k[i] = k
+        if tau is not None:
+            if not tau > 0:
+                raise ValueError("tau需要大于0!")
+            self.tau[i] = tau
+        self.a[i], self.b[i] = discretize_fopdt(self.k[i], self.tau[i], self.circle)
+
+    def next(self, uvs):
+        """
+        所有回路同时推进一个时间步
+        :param uvs: np.array or dict. 每个回路当前写入的uv, shape(N,); 也可以是 名字 -> uv 的dict, 没有给出的回路保持上一次的uv
+        :return: np.array. 所有回路下一个时间步的cv测量值, shape(N,)
+        """
+        if isinstance(uvs, dict):
+            values = self.last_uvs.copy()
+            for name, uv in uvs.items():
+                values[self.indices[name]] = uv
+            uvs = values
+        uvs = np.array(uvs, dtype=float)
+        self.last_uvs = uvs
 
+        # 写入迟滞缓冲区, 再按各自的迟滞读取作用于过程的uv
+        self.head = (self.head + 1) % self.size
+        self.buffer[:, self.head] = uvs
+        delayed = self.buffer[self.rows, (self.head - self.lag) % self.size]
+        if np.any(self.frac):
+            older = self.buffer[self.rows, (self.head - self.lag - 1) % self.size]
+            delayed = (1 - self.frac) * delayed + self.frac * older
 
+        self.y = self.a * self.y + self.b * delayed
+        self.t += 1
+        return self.noise.apply(self.y)
@@ -0,0 +1,282 @@
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from scipy.optimize import least_squares, OptimizeResult
+from scipy.signal import lfilter
+from fopdtUtils import Fopdt, _UVStore
+
+
+class FopdtIdentification:
+    """
+    由阶跃测试数据辨识FOPDT模型(k, tau, theta)
+    1. 模型用零阶保持下的解析解仿真(lfilter), 和Fopdt.next的离散化一致, 小数迟滞按线性插值处理；
+    2. 在theta的多个初值上分别用least_squares拟合, 取残差最小的结果, 避免落入迟滞的局部最优；
+    3. 多个位号的数据可以在进程池中并行拟合；
+    4. 返回OptimizeResult, 其中fopdt为可以直接使用的Fopdt实例(偏差变量), 同时给出拟合统计量。
+    """
+
+    # theta的初值个数
+    N_STARTS = 5
+
+    @staticmethod
+    def simulate(uv, k, tau, theta, dt=1.0):
+        """
+        FOPDT模型对输入序列的响应(偏差变量, 初始为稳态)
+        :param uv: np.array. 输入的偏差值, 第i个采样周期内保持不变, shape(N,)
+        :param k: float. process gain
+        :param tau: float. process time constant, 和dt的时间单位相同
+        :param theta: float. 迟滞时间, 和dt的时间单位相同, 可以不是dt的整数倍
+        :param dt: float. 采样周期
+        :return: np.array. 每个采样时刻的输出偏差值, shape(N,), 第0个为0
+        """
+        uv = np.asarray(uv, dtype=float)
+        a = np.exp(-dt / tau)
+        delay = theta / dt
+        lag = int(np.floor(delay))
+        frac = delay - lag
+        # 迟滞后的输入: (1 - frac) * u[n - lag] + frac * u[n - lag - 1], 迟滞之前为稳态(0)
+        shifted = np.concatenate((np.zeros(lag + 1), uv))
+        delayed = (1 - frac) * shifted[1:len(uv) + 1] + frac * shifted[:len(uv)]
+        return lfilter([0.0, (1 - a) * k], [1.0, -a], delayed)
+
+    @staticmethod
+    def fit(uv, cv, dt=1.0, theta_max=None, n_starts=N_STARTS, tau_max=None):
+        """
+        拟合一个位号的FOPDT参数
+        :param uv: np.array. 记录的uv, shape(N,). uv第一次变化之前过程处于稳态
+        :param cv: np.array. 记录的cv, shape(N,)
+        :param dt: float. 采样周期
+        :param theta_max: float. 迟滞时间的上限, None表示数据长度的一半
+        :param n_starts: int. theta的初值个数, 在[0, theta_max]上均匀分布
+        :param tau_max: float. 时间常数的上限, None表示数据长度的10倍
+        :return: result: OptimizeResult.
+                 result.fopdt: Fopdt. 以采样周期为时间单位(tau / dt, theta / dt), 偏差变量(y0 = 0)
+                 result.k, result.tau, result.theta: 拟合的参数(tau, theta和dt的时间单位相同)
+                 result.uv_bias, result.cv_bias: 偏差变量的基准(uv第一次变化之前的稳态)
+                 result.rmse, result.r2: 残差的均方根和决定系数
+                 result.std: 参数(k, tau, theta)的标准差估计
+                 result.success, result.nfev, result.cost: 同least_squares
+        """
+        uv = np.asarray(uv, dtype=float)
+        cv = np.asarray(cv, dtype=float)
+        if uv.shape != cv.shape or uv.ndim != 1:
+            raise ValueError("uv和cv需要是长度相同的一维数组!")
+        n = len(uv)
+        span = dt * (n - 1)
+        theta_max = span / 2 if theta_max is None else theta_max
+        tau_max = 10 * span if tau_max is None else tau_max
+        du = uv - uv[0]
+        if not np.any(du):
+            raise ValueError("uv没有变化, 无法辨识!")
+        # uv第一次变化之前(含变化的时刻)的cv都是稳态, 取平均作为基准以减小噪声的影响
+        first = np.flatnonzero(du)[0]
+        cv_bias = cv[:first + 1].mean()
+        dy = cv - cv_bias
+
+        def residuals(p):
+            return FopdtIdentification.simulate(du, p[0], p[1], p[2], dt) - dy
+
+        # 初值: 时间常数取数据长度的1/5, 增益由该时间常数下的线性最小二乘给出
+        tau0 = max(span / 5, dt)
+        lower = [-np.inf, dt * 1e-3, 0.0]
+        upper = [np.inf, tau_max, theta_max]
+        best, nfev = None, 0
+        for theta0 in np.linspace(0, theta_max, max(n_starts, 1)):
+            unit = FopdtIdentification.simulate(du, 1.0, tau0, theta0, dt)
+            k0 = unit.dot(dy) / unit.dot(unit) if unit.dot(unit) > 0 else 1.0
+            solution = least_squares(residuals, [k0, tau0, theta0], bounds=(lower, upper), x_scale='jac')
+            nfev += solution.nfev
+            if best is None or solution.cost < best.cost:
+                best = solution
+
+        k, tau, theta = best.x
+        residual = best.fun
+        rmse = np.sqrt(np.mean(residual ** 2))
+        total = np.sum((dy - dy.mean()) ** 2)
+        r2 = 1 - np.sum(residual ** 2) / total if total > 0 else 1.0
+        # 参数协方差的估计: s^2 * inv(J'J)
+        dof = max(n - 3, 1)
+        try:
+            cov = np.linalg.inv(best.jac.T.dot(best.jac)) * np.sum(residual ** 2) / dof
+            std = np.sqrt(np.abs(np.diag(cov)))
+        except np.linalg.LinAlgError:
+            std = np.full(3, np.inf)
+
+        return OptimizeResult(
+            fopdt=Fopdt(k, tau / dt, 0.0, 0, theta / dt), k=k, tau=tau, theta=theta,
+            uv_bias=uv[0], cv_bias=cv_bias, rmse=rmse, r2=r2, std=std,
+            success=best.success, status=best.status, message=best.message, nfev=nfev, cost=best.cost
+        )
+
+    @staticmethod
+    def fit_many(tags, dt=1.0, processes=None, **options):
+        """
+        在进程池中并行拟合多个位号
+        :param tags: dict. 位号名 -> (uv, cv)
+        :param dt: float. 采样周期
+        :param processes: int. 进程数, None表示使用cpu个数, 1表示在当前进程中顺序拟合
+        :param options: 传给fit的其他参数(theta_max, n_starts, tau_max)
+        :return: dict. 位号名 -> fit的返回值; 拟合出错的位号为success = False的OptimizeResult
+        """
+        names = list(tags)
+        jobs = [(tags[name][0], tags[name][1], dt, options) for name in names]
+        if processes == 1:
+            results = list(map(_fit_job, jobs))
+        else:
+            with ProcessPoolExecutor(max_workers=processes) as executor:
+                results = list(executor.map(_fit_job, jobs, chunksize=max(1, len(jobs) // 64)))
+        return dict(zip(names, results))
+
+
+class RecursiveFopdtEstimator:
+    """
+    FOPDT参数的在线递推估计
+    1. 在离散化的ARX形式 y[n + 1] = a * y[n] + b * u[n - theta] + c 上做带遗忘因子的递推最小二乘(RLS),
+       每个(uv, cv)样本的计算量为O(1), 迟滞theta保持不变, c吸收工作点的偏置；
+    2. k = b / (1 - a), tau = -dt / ln(a), 只在0 < a < 1时有效；
+    3. 估计值经过限速(每次最多变化max_step)后写回Fopdt, 只有变化超过threshold时才写回并调用on_update,
+       以便控制器只在参数有实质变化时重新生成预计算矩阵。
+    """
+
+    def __init__(self, fopdt, dt=1.0, forgetting=0.995, p0=100.0, threshold=0.05, max_step=0.1,
+                 min_interval=10, min_samples=20, p_max=1e6, on_update=None, k_floor=1e-3):
+        """
+        构造函数
+        :param fopdt: Fopdt. 被估计的模型, 以其k, tau作为初值, 更新后的参数直接写回该实例
+        :param dt: float. 采样周期, 和MPC的控制周期一致
+        :param forgetting: float. 遗忘因子, 0 < forgetting <= 1
+        :param p0: float. 协方差矩阵的初值(对角元)
+        :param threshold: float. 参数的相对变化超过threshold时才写回模型
+        :param max_step: float. 每次写回时参数的最大相对变化
+        :param min_interval: int. 两次写回之间最少的样本数
+        :param min_samples: int. 开始写回之前最少的样本数
+        :param p_max: float. 协方差矩阵的迹的上限, 防止激励不足时协方差发散
+        :param on_update: callable. 写回模型后调用, 参数为fopdt. 比如 lambda model: controller.rebuild()
+        :param k_floor: float. k的限速和变化量使用的最小尺度, 使从k = 0附近出发的模型也能收敛
+        """
+        if not 0 < forgetting <= 1:
+            raise ValueError("forgetting需要在(0, 1]之间!")
+        if not _tau_valid(fopdt.tau) or not dt > 0:
+            raise ValueError("tau和dt需要大于0!")
+        self.fopdt = fopdt
+        self.dt = dt
+        self.forgetting = forgetting
+        self.threshold = threshold
+        self.max_step = max_step
+        self.min_interval = min_interval
+        self.min_samples = min_samples
+        self.p_max = p_max
+        self.on_update = on_update
+        self.k_floor = k_floor
+
+        # 参数向量(a, b, c)和协方差矩阵
+        a = np.exp(-dt / fopdt.tau)
+        self.params = np.array([a, (1 - a) * fopdt.k, 0.0])
+        self.P = np.eye(3) * p0
+
+        # 迟滞缓冲区和上一个样本的回归量
+        self.uv_store = _UVStore(fopdt.theta)
+        self.regressor = None
+
+        # 已处理的样本数, 最近一次写回时的样本数, 写回次数
+        self.n_samples = 0
+        self.last_push = 0
+        self.n_updates = 0
+
+    @staticmethod
+    def for_controller(controller, **options):
+        """
+        为MpcController创建估计器, 模型更新后控制器自动重新生成预计算矩阵
+        :param controller: MpcController.
+        :param options: 传给构造函数的其他参数
+        :return: RecursiveFopdtEstimator
+        """
+        config = controller.config
+        return RecursiveFopdtEstimator(config.model, config.circle, on_update=lambda model: controller.rebuild(),
+                                       **options)
+
+    @property
+    def k(self):
+        """
+        :return: float. 当前的增益估计(未经限速), a不在(0, 1)内时为nan
+        """
+        a, b = self.params[:2]
+        return b / (1 - a) if 0 < a < 1 else np.nan
+
+    @property
+    def tau(self):
+        """
+        :return: float. 当前的时间常数估计(未经限速), a不在(0, 1)内时为nan
+        """
+        a = self.params[0]
+        return -self.dt / np.log(a) if 0 < a < 1 else np.nan
+
+    def update(self, uv, cv):
+        """
+        处理一个新的样本
+        :param uv: float. 当前周期写入的uv
+        :param cv: float. 当前周期开始时的cv测量值(写入uv之前)
+        :return: bool. 本次是否把新的参数写回了模型
+        """
+        if self.regressor is not None:
+            phi = self.regressor
+            P_phi = self.P.dot(phi)
+            gain = P_phi / (self.forgetting + phi.dot(P_phi))
+            self.params = self.params + gain * (cv - phi.dot(self.params))
+            self.P = (self.P - np.outer(gain, P_phi)) / self.forgetting
+            trace = np.trace(self.P)
+            if trace > self.p_max:
+                self.P *= self.p_max / trace
+            self.n_samples += 1
+
+        self.uv_store.save_uv(self.n_samples, uv)
+        self.regressor = np.array([cv, self.uv_store.pop_uv(), 1.0])
+        return self._publish()
+
+    def _publish(self):
+        """
+        限速并检查变化量, 有实质变化时写回模型
+        :return: bool
+        """
+        if self.n_samples < self.min_samples or self.n_samples - self.last_push < self.min_interval:
+            return False
+        k, tau = self.k, self.tau
+        if not (np.isfinite(k) and _tau_valid(tau)):
+            return False
+
+        model = self.fopdt
+        # k的步长相对于当前模型和估计值中较大的一个, 并有绝对下限
+        k_step = self.max_step * max(abs(model.k), abs(k), self.k_floor)
+        k = model.k + np.clip(k - model.k, -k_step, k_step)
+        tau = model.tau * np.clip(tau / model.tau, 1 - self.max_step, 1 + self.max_step)
+        change = max(abs(k - model.k) / max(abs(model.k), self.k_floor), abs(tau - model.tau) / model.tau)
+        if change < self.threshold:
+            return False
+
+        model.k, model.tau = k, tau
+        self.last_push = self.n_samples
+        self.n_updates += 1
+        if self.on_update is not None:
+            self.on_update(model)
+        return True
+
+
+def _tau_valid(tau):
+    """
+    :param tau: float. 时间常数
+    :return: bool. 是否为有限的正数
+    """
+    return bool(np.isfinite(tau) and tau > 0)
+
+
+def _fit_job(job):
+    """
+    进程池中拟合一个位号. 定义在模块级别, 以便在进程池中调用
+    :param job: tuple. (uv, cv, dt, options)
+    :return: OptimizeResult
+    """
+    uv, cv, dt, options = job
+    try:
+        return FopdtIdentification.fit(uv, cv, dt, **options)
+    except Exception as e:
+        # 一个位号的任何错误(数据不合法、least_squares中的LinAlgError等)都不中断其他位号的拟合
+        return OptimizeResult(fopdt=None, success=False, status=-1, message="%s: %s" % (type(e).__name__, e))
@@ -0,0 +1,366 @@
+import bisect
+import functools
+import json
+import threading
+import time
+from fopdtUtils import Fopdt, FopdtBank
+from mpcControl import MPC, MpcConfig, QpMPC, MpcController
+
+
+class Histogram:
+    """
+    固定分桶的直方图, 只保存每个桶的计数, 可以在多个回路/进程之间直接相加
+    """
+
+    # 默认的分桶边界: 1us ~ 10s, 每个数量级4个桶(用于耗时)
+    TIME_EDGES = tuple(10 ** (e / 4) for e in range(-24, 5))
+
+    # 默认的分桶边界: 0, 1, 2, 4, ..., 2^20(用于计数)
+    COUNT_EDGES = (0,) + tuple(2 ** e for e in range(21))
+
+    def __init__(self, edges):
+        """
+        构造函数
+        :param edges: tuple. 递增的分桶边界, 第i个桶为[edges[i-1], edges[i]), 两端各有一个溢出桶
+        """
+        self.edges = tuple(edges)
+        self.counts = [0] * (len(self.edges) + 1)
+        self.n = 0
+        self.total = 0.0
+        self.max = None
+
+    def add(self, value):
+        self.counts[bisect.bisect_right(self.edges, value)] += 1
+        self.n += 1
+        self.total += value
+        self.max = value if self.max is None or value > self.max else self.max
+
+    def merge(self, other):
+        """
+        :param other: Histogram. 分桶边界相同的直方图
+        :return: self
+        """
+        if other.edges != self.edges:
+            raise ValueError("分桶边界不同的直方图不能合并!")
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.n += other.n
+        self.total += other.total
+        if other.max is not None:
+            self.max = other.max if self.max is None else max(self.max, other.max)
+        return self
+
+    def quantile(self, q):
+        """
+        :param q: float. 0 ~ 1
+        :return: float. 分位数所在桶的上边界(溢出桶返回max)
+        """
+        if not self.n:
+            return None
+        rank, cumulative = q * self.n, 0
+        for i, count in enumerate(self.counts):
+            cumulative += count
+            if cumulative >= rank and count:
+                return self.edges[i] if i < len(self.edges) else self.max
+        return self.max
+
+    def to_dict(self):
+        return {'edges': list(self.edges), 'counts': list(self.counts), 'n': self.n, 'total': self.total,
+                'max': self.max}
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        :param data: dict. to_dict()的结果(可以经过JSON序列化)
+        :return: Histogram
+        """
+        histogram = cls(data['edges'])
+        histogram.counts = list(data['counts'])
+        histogram.n = data['n']
+        histogram.total = data['total']
+        histogram.max = data['max']
+        return histogram
+
+
+class Metrics:
+    """
+    MPC和Fopdt的运行指标
+    1. 计数器: cost计算次数(cost_evals, 批量计算时按候选序列个数计)、梯度计算次数、模型预测次数、模型单步次数、odeint调用次数；
+    2. 每个控制周期(MpcController.solve + apply)一条记录: 各阶段耗时(build, solve, post)、迭代次数、最终cost、
+       周期内的计数器增量；
+    3. 直方图: 各阶段耗时、迭代次数和cost计算次数的分布。
+    enable()时给相关方法包上计数/计时的包装, disable()时恢复原来的方法, 关闭时没有任何额外开销。
+    同一时刻只能有一个Metrics处于收集状态; 跨进程汇总时用to_dict()/from_dict()或pickle传递, 再merge。
+    """
+
+    # 计时的阶段
+    PHASES = ('build', 'solve', 'post')
+
+    # 正在收集指标的Metrics
+    _active = None
+
+    def __init__(self, max_records=100000):
+        """
+        构造函数
+        :param max_records: int. 最多保存的周期记录条数, 超出后丢弃最早的记录(计数器和直方图不受影响)
+        """
+        self.max_records = max_records
+        self.enabled = False
+        self._originals = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.reset()
+
+    def reset(self):
+        """
+        清空计数器、直方图和记录
+        :return: none
+        """
+        with self._lock:
+            self.counters = {}
+            self.histograms = {}
+            self.records = []
+
+    def count(self, name, n=1):
+        """
+        计数器加n, 当前线程处于一个控制周期中时同时计入该周期的记录
+        """
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+        record = getattr(self._local, 'record', None)
+        if record is not None:
+            record[name] = record.get(name, 0) + n
+
+    def observe(self, name, value, edges=Histogram.TIME_EDGES):
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram(edges)
+            histogram.add(value)
+
+    # ---------------- 开关 ----------------
+
+    def enable(self):
+        """
+        开始收集指标
+        :return: self
+        """
+        if self.enabled:
+            return self
+        if Metrics._active is not None:
+            raise RuntimeError("已经有一个Metrics在收集指标, 需要先调用它的disable()!")
+        metrics = self
+
+        def counted(name, amount=None):
+            def decorate(function):
+                @functools.wraps(function)
+                def wrapper(*args, **kwargs):
+                    metrics.count(name, 1 if amount is None else amount(*args, **kwargs))
+                    return function(*args, **kwargs)
+                return wrapper
+            return decorate
+
+        def timed(phase):
+            def decorate(function):
+                @functools.wraps(function)
+                def wrapper(*args, **kwargs):
+                    # 嵌套调用只计入最外层的阶段
+                    if getattr(metrics._local, 'phase', None) is not None:
+                        return function(*args, **kwargs)
+                    metrics._local.phase = phase
+                    start = time.perf_counter()
+                    try:
+                        return function(*args, **kwargs)
+                    finally:
+                        metrics._local.phase = None
+                        metrics._add_phase(phase, time.perf_counter() - start)
+                return wrapper
+            return decorate
+
+        def rows(uvs_batch, arg_dict):
+            shape = getattr(uvs_batch, 'shape', None)
+            return shape[0] if shape is not None and len(shape) > 1 else 1
+
+        def ode_calls(fopdt, start_t, end_t, init_y, uv, method=None):
+            return int((fopdt.method if method is None else method) == Fopdt.ODEINT)
+
+        patches = [
+            (MPC, 'batch_cost_function', True, counted('cost_evals', rows)),
+            (MPC, 'cost_gradient', True, counted('gradient_evals')),
+            (MPC, 'optimize_solution', True, timed('solve')),
+            (MPC, 'anytime_solution', True, timed('solve')),
+            (Fopdt, 'predict_horizon', False, counted('model_predictions')),
+            (Fopdt, 'solve_step_fopdt', False, lambda f: counted('ode_calls', ode_calls)(counted('model_steps')(f))),
+            (FopdtBank, 'next', False, counted('model_steps', lambda bank, uvs: len(bank))),
+            (MpcConfig, 'compile', False, timed('build')),
+            (MpcConfig, 'update', False, timed('build')),
+            (QpMPC, 'build', False, timed('build')),
+            (QpMPC, 'solve', False, timed('solve')),
+            (MpcController, 'solve', False, self._wrap_cycle),
+            (MpcController, 'apply', False, self._wrap_apply),
+        ]
+        for cls, name, static, wrap in patches:
+            original = cls.__dict__[name]
+            function = original.__func__ if static else original
+            wrapped = wrap(function)
+            setattr(cls, name, staticmethod(wrapped) if static else wrapped)
+            self._originals.append((cls, name, original))
+        self.enabled = True
+        Metrics._active = self
+        return self
+
+    def disable(self):
+        """
+        停止收集指标, 恢复原来的方法. 已经收集的指标保留
+        :return: self
+        """
+        if not self.enabled:
+            return self
+        for cls, name, original in reversed(self._originals):
+            setattr(cls, name, original)
+        self._originals = []
+        self.enabled = False
+        Metrics._active = None
+        return self
+
+    def __enter__(self):
+        return self.enable()
+
+    def __exit__(self, *exc_info):
+        self.disable()
+
+    # ---------------- 控制周期 ----------------
+
+    def _add_phase(self, phase, elapsed):
+        self.observe('time.' + phase, elapsed)
+        record = getattr(self._local, 'record', None)
+        if record is not None:
+            key = 'time_' + phase
+            record[key] = record.get(key, 0.0) + elapsed
+
+    def _wrap_cycle(self, function):
+        metrics = self
+
+        @functools.wraps(function)
+        def solve(controller, *args, **kwargs):
+            # 求解可能在其他线程中执行, 周期记录保存在控制器上, 由apply完成
+            record = {'controller': getattr(controller, 'name', id(controller)), 'cycle': len(controller.nits),
+                      'start': time.time()}
+            metrics._local.record = record
+            try:
+                return function(controller, *args, **kwargs)
+            finally:
+                metrics._local.record = None
+                controller._metrics_record = record
+        return solve
+
+    def _wrap_apply(self, function):
+        metrics = self
+
+        @functools.wraps(function)
+        def apply(controller, solution, *args, **kwargs):
+            record = controller.__dict__.pop('_metrics_record', None)
+            if record is None or solution is None:
+                # 没有可用的解(比如运行时的后备策略)时只记录post阶段
+                record = {'controller': getattr(controller, 'name', id(controller)), 'cycle': len(controller.nits),
+                          'start': time.time()}
+            metrics._local.record = record
+            start = time.perf_counter()
+            try:
+                return function(controller, solution, *args, **kwargs)
+            finally:
+                metrics._add_phase('post', time.perf_counter() - start)
+                metrics._local.record = None
+                metrics._finish(record, solution)
+        return apply
+
+    def _finish(self, record, solution):
+        for phase in Metrics.PHASES:
+            record.setdefault('time_' + phase, 0.0)
+        record['solved'] = solution is not None
+        if solution is not None:
+            record['nit'] = int(solution.get('nit', 0))
+            record['fun'] = float(solution.fun)
+            record['success'] = bool(solution.success)
+            record['status'] = solution.status if isinstance(solution.status, str) else int(solution.status)
+            self.observe('nit', record['nit'], Histogram.COUNT_EDGES)
+        self.observe('cost_evals', record.get('cost_evals', 0), Histogram.COUNT_EDGES)
+        with self._lock:
+            self.records.append(record)
+            if len(self.records) > self.max_records:
+                del self.records[:len(self.records) - self.max_records]
+
+    # ---------------- 导出 ----------------
+
+    def summary(self):
+        """
+        :return: dict. counters: 计数器; histograms: 名字 -> Histogram.to_dict(); n_records: 记录条数
+        """
+        with self._lock:
+            return {'counters': dict(self.counters),
+                    'histograms': {name: h.to_dict() for name, h in self.histograms.items()},
+                    'n_records': len(self.records)}
+
+    def export(self, path=None):
+        """
+        导出周期记录
+        :param path: str. JSON Lines文件路径(每行一条记录), None表示只返回记录
+        :return: list. 周期记录(dict)
+        """
+        with self._lock:
+            records = list(self.records)
+        if path is not None:
+            with open(path, 'w') as f:
+                for record in records:
+                    f.write(json.dumps(record, default=float) + '\n')
+        return records
+
+    def to_dict(self):
+        """
+        :return: dict. 可以JSON序列化的计数器、直方图和记录, 用from_dict()恢复
+        """
+        with self._lock:
+            return {'max_records': self.max_records,
+                    'counters': dict(self.counters),
+                    'histograms': {name: h.to_dict() for name, h in self.histograms.items()},
+                    'records': [dict(record) for record in self.records]}
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        :param data: dict. to_dict()的结果
+        :return: Metrics. 处于关闭状态
+        """
+        metrics = cls(data['max_records'])
+        metrics.counters = dict(data['counters'])
+        metrics.histograms = {name: Histogram.from_dict(h) for name, h in data['histograms'].items()}
+        metrics.records = [dict(record) for record in data['records']]
+        return metrics
+
+    def __getstate__(self):
+        # 锁、线程局部变量和被替换的方法不能序列化, 恢复后处于关闭状态
+        return self.to_dict()
+
+    def __setstate__(self, state):
+        self.__init__(state['max_records'])
+        self.merge(Metrics.from_dict(state))
+
+    def merge(self, other):
+        """
+        合并另一个Metrics(比如其他进程导出的结果)的计数器、直方图和记录
+        :param other: Metrics
+        :return: self
+        """
+        with self._lock:
+            for name, value in other.counters.items():
+                self.counters[name] = self.counters.get(name, 0) + value
+            for name, histogram in other.histograms.items():
+                if name in self.histograms:
+                    self.histograms[name].merge(histogram)
+                else:
+                    self.histograms[name] = Histogram(histogram.edges).merge(histogram)
+            self.records.extend(other.records)
+        return self
+
+
+# 进程内共享的指标
+METRICS = Metrics()
@@ -0,0 +1,247 @@
+import time
+import numpy as np
+from scipy.linalg import cho_factor, cho_solve
+from scipy.optimize import OptimizeResult
+from mpcControl import MPC, _active_set_qp
+
+
+class MimoMPC:
+    """
+    多输入多输出MPC, 模型为Fopdt组成的传递函数矩阵(没有关联的位置为None或0)
+    1. 只保存非零通道: 预测、Hessian和一次项的计算量只和非零通道的个数有关；
+    2. cv[i] = sum_j y_ij, 每个通道的响应y_ij由控制器用写入的uv推进, 预测值再加上测量值和模型输出之差(偏置修正)；
+    3. 每个cv的设定值权重和每个uv的移动权重可以分别设置, 约束按uv分块, 用和QpMPC相同的有效集法求解。
+    """
+
+    def __init__(self, models, ph, ch, circle, cv_weights=1.0, move_weights=1.0,
+                 u_max_move=None, uv_low=None, uv_high=None, uv0=0.0):
+        """
+        构造函数
+        :param models: list. ny行nu列的传递函数矩阵, models[i][j]为uv j到cv i的Fopdt, 没有关联时为None或0.
+                       每个非零位置需要是不同的Fopdt实例(控制器会记录写入其中的uv)
+        :param ph: int. 预测区间长度
+        :param ch: int. 控制区间长度, 0 < ch <= ph
+        :param circle: float. 控制周期
+        :param cv_weights: float or np.array. 每个cv的设定值误差权重, 标量或shape(ny,)
+        :param move_weights: float or np.array. 每个uv的移动权重, 标量或shape(nu,)
+        :param u_max_move: float or np.array. 每个uv每个周期的最大变化量, None表示不限制
+        :param uv_low: float or np.array. uv的下限, None表示不限制
+        :param uv_high: float or np.array. uv的上限, None表示不限制
+        :param uv0: float or np.array. uv的初值, 控制器假设过程在uv0下处于稳态
+        """
+        self.ny = len(models)
+        self.nu = len(models[0]) if self.ny else 0
+        if self.ny == 0 or self.nu == 0 or any(len(row) != self.nu for row in models):
+            raise ValueError("models需要是ny行nu列的非空矩阵!")
+        if not 0 < ch <= ph:
+            raise ValueError("控制区间长度需要满足 0 < ch <= ph! ch = %s, ph = %s" % (ch, ph))
+
+        # 非零通道: (cv编号, uv编号, Fopdt)
+        self.channels = [(i, j, model) for i, row in enumerate(models) for j, model in enumerate(row)
+                         if model is not None and not (np.isscalar(model) and model == 0)]
+        if len({id(model) for i, j, model in self.channels}) != len(self.channels):
+            raise ValueError("每个非零通道需要是不同的Fopdt实例!")
+
+        self.ph, self.ch, self.circle = ph, ch, circle
+        self.cv_weights = self._vector(cv_weights, self.ny, 'cv_weights')
+        self.move_weights = self._vector(move_weights, self.nu, 'move_weights')
+        self.u_max_move = None if u_max_move is None else self._vector(u_max_move, self.nu, 'u_max_move')
+        self.uv_low = None if uv_low is None else self._vector(uv_low, self.nu, 'uv_low')
+        self.uv_high = None if uv_high is None else self._vector(uv_high, self.nu, 'uv_high')
+        self.uv0 = self._vector(uv0, self.nu, 'uv0')
+
+        # 每个通道的模型输出(不含偏置), 初始时为uv0下的稳态, 迟滞缓冲区也填充uv0
+        self.states = np.zeros(len(self.channels))
+        for c, (i, j, model) in enumerate(self.channels):
+            model.uv_store.values[:] = self.uv0[j]
+            self.states[c] = model.k * self.uv0[j]
+
+        # 上一个周期的计划(nu, ph)和有效集
+        self.last_uvs = np.tile(self.uv0[:, None], (1, ph))
+        self.active_set = []
+        self.last_solution = None
+        self.nits = []
+        self.solve_times = []
+
+        self.build()
+
+    @staticmethod
+    def _vector(value, n, name):
+        array = np.asarray(value, dtype=float)
+        if array.ndim > 1 or (array.ndim == 1 and array.shape[0] != n):
+            raise ValueError("%s需要是标量或长度为%i的数组!" % (name, n))
+        return np.array(np.broadcast_to(array, (n,)))
+
+    def build(self):
+        """
+        预计算每个通道的动态矩阵、Hessian及其Cholesky分解和约束矩阵. 模型参数或权重变化后需要重新调用
+        :return: none
+        """
+        ph, ch, nu = self.ph, self.ch, self.nu
+        self.index = np.minimum(np.arange(ph), ch - 1)
+        M = np.zeros((ph, ch))
+        M[np.arange(ph), self.index] = 1
+
+        # 每个通道: 对控制区间内的uv的动态矩阵Gm(ph, ch)和自由响应系数phi
+        self.Gm, self.phi = [], []
+        for i, j, model in self.channels:
+            G, phi = model.dynamic_matrix(ph, self.circle)
+            self.Gm.append(G.dot(M))
+            self.phi.append(phi)
+
+        # 决策变量z: 第j个uv在控制区间内的ch个值为z[j * ch:(j + 1) * ch]
+        n = nu * ch
+        H = np.zeros((n, n))
+        by_cv = [[c for c, (i, j, model) in enumerate(self.channels) if i == cv] for cv in range(self.ny)]
+        for cv, channels in enumerate(by_cv):
+            for c in channels:
+                j = self.channels[c][1]
+                weighted = self.cv_weights[cv] * self.Gm[c].T
+                for d in channels:
+                    l = self.channels[d][1]
+                    H[j * ch:(j + 1) * ch, l * ch:(l + 1) * ch] += weighted.dot(self.Gm[d])
+        self.by_cv = by_cv
+
+        # uv增量: Dm.dot(z_j) - e0 * uv0_j
+        Dm = (np.eye(ph) - np.eye(ph, k=-1)).dot(M)
+        self.DtD = Dm.T.dot(Dm)
+        self.d0 = Dm[0]
+        for j in range(nu):
+            H[j * ch:(j + 1) * ch, j * ch:(j + 1) * ch] += self.move_weights[j] * self.DtD
+        # 没有任何通道且移动权重为0的uv, 加一个很小的正则项保证H正定
+        H += 1e-10 * np.eye(n) * max(np.abs(np.diag(H)).max(initial=0), 1.0)
+        self.H = H
+        self.H_factor = cho_factor(H)
+
+        # 约束按uv分块: A.dot(z) <= b0 + b_uv.dot(uv0)
+        A, b0, b_uv = [np.zeros((0, n))], [np.zeros(0)], [np.zeros((0, nu))]
+        for j in range(nu):
+            block = slice(j * ch, (j + 1) * ch)
+            rows, rhs, rhs_uv = [], [], []
+            if self.u_max_move is not None:
+                move_A, move_b0 = MPC.move_constraints(ch, ch, 0, self.u_max_move[j])
+                rows.append(move_A)
+                rhs.append(move_b0)
+                first = np.zeros((2 * ch, nu))
+                first[0, j], first[ch, j] = 1, -1
+                rhs_uv.append(first)
+            if self.uv_high is not None:
+                rows.append(np.eye(ch))
+                rhs.append(np.full(ch, self.uv_high[j]))
+                rhs_uv.append(np.zeros((ch, nu)))
+            if self.uv_low is not None:
+                rows.append(-np.eye(ch))
+                rhs.append(np.full(ch, -self.uv_low[j]))
+                rhs_uv.append(np.zeros((ch, nu)))
+            for row, r, r_uv in zip(rows, rhs, rhs_uv):
+                full = np.zeros((row.shape[0], n))
+                full[:, block] = row
+                A.append(full)
+                b0.append(r)
+                b_uv.append(r_uv)
+        self.A = np.vstack(A)
+        self.b0 = np.concatenate(b0)
+        self.b_uv = np.vstack(b_uv)
+
+    def free_response(self, cv0):
+        """
+        未来uv全为0时各个cv的预测值(包括通道状态的衰减和迟滞中的历史uv)
+        :param cv0: np.array. 各个cv的测量值, shape(ny,)
+        :return: np.array. shape(ny, ph)
+        """
+        free = np.repeat(np.asarray(cv0, dtype=float)[:, None], self.ph, axis=1)
+        for c, (i, j, model) in enumerate(self.channels):
+            free[i] += self.phi[c] * self.states[c] + model.history_response(self.ph, self.circle) - self.states[c]
+        return free
+
+    def predict(self, cv0, uvs):
+        """
+        预测区间上各个cv的轨迹
+        :param cv0: np.array. 各个cv的测量值, shape(ny,)
+        :param uvs: np.array. 各个uv在控制区间内的值, shape(nu, ch)
+        :return: np.array. shape(ny, ph)
+        """
+        uvs = np.asarray(uvs, dtype=float)
+        cvs = self.free_response(cv0)
+        for c, (i, j, model) in enumerate(self.channels):
+            cvs[i] += self.Gm[c].dot(uvs[j])
+        return cvs
+
+    def cost(self, uvs, cv0, uv0, sps):
+        """
+        :param uvs: np.array. 各个uv在控制区间内的值, shape(nu, ch)
+        :return: float. 预测区间上的cost
+        """
+        uvs = np.asarray(uvs, dtype=float)
+        errors = np.broadcast_to(sps, (self.ny, self.ph)) - self.predict(cv0, uvs)
+        moves = np.diff(uvs[:, self.index], prepend=np.asarray(uv0, dtype=float)[:, None], axis=1)
+        return float(np.sum(self.cv_weights[:, None] * errors ** 2) + np.sum(self.move_weights[:, None] * moves ** 2))
+
+    def solve(self, cv0, uv0=None, sps=0.0, working_set=None):
+        """
+        求解当前周期的QP
+        :param cv0: np.array. 各个cv的测量值, shape(ny,)
+        :param uv0: np.array. 各个uv的当前值, None表示使用控制器记录的uv0
+        :param sps: float or np.array. 设定值, 标量、shape(ny,)或shape(ny, ph)
+        :param working_set: list. 初始有效集
+        :return: solution: OptimizeResult. solution.x.shape = (nu, ph)
+        """
+        ph, ch, nu = self.ph, self.ch, self.nu
+        uv0 = self.uv0 if uv0 is None else self._vector(uv0, nu, 'uv0')
+        sps = np.asarray(sps, dtype=float)
+        sps = np.broadcast_to(sps[:, None] if sps.ndim == 1 else sps, (self.ny, ph))
+
+        # 一次项: 只在非零通道上累加
+        residual = self.free_response(cv0) - sps
+        g = np.zeros(nu * ch)
+        for c, (i, j, model) in enumerate(self.channels):
+            g[j * ch:(j + 1) * ch] += self.cv_weights[i] * self.Gm[c].T.dot(residual[i])
+        for j in range(nu):
+            g[j * ch:(j + 1) * ch] -= self.move_weights[j] * self.d0 * uv0[j]
+
+        x = cho_solve(self.H_factor, -g)
+        b = self.b0 + self.b_uv.dot(uv0)
+        nit, success, working = 0, True, []
+        if np.any(self.A.dot(x) > b + 1e-9):
+            # 从投影到约束内的上一周期计划出发
+            start = np.append(self.last_uvs[:, 1:], self.last_uvs[:, -1:], axis=1)[:, :ch]
+            for j in range(nu):
+                start[j] = MPC.project_rate_limit(
+                    uv0[j], start[j], None if self.u_max_move is None else self.u_max_move[j],
+                    None if self.uv_low is None else self.uv_low[j],
+                    None if self.uv_high is None else self.uv_high[j])
+            x, working, nit, success = _active_set_qp(self.H, self.H_factor, g, self.A, b, start.ravel(),
+                                                      working_set or self.active_set)
+        uvs = x.reshape(nu, ch)
+        return OptimizeResult(
+            x=uvs[:, self.index], fun=self.cost(uvs, cv0, uv0, sps), success=success, status=0 if success else 1,
+            message='Optimization terminated successfully' if success else 'Iteration limit reached',
+            nit=nit, active_set=working
+        )
+
+    def step(self, cv0, sps):
+        """
+        执行一个控制周期, 并用写入的uv推进各个通道的模型
+        :param cv0: np.array. 各个cv的测量值, shape(ny,)
+        :param sps: float or np.array. 设定值, 标量、shape(ny,)或shape(ny, ph)
+        :return: np.array. 当前周期写入的uv, shape(nu,), 求解失败时保持上一周期的uv
+        """
+        start = time.perf_counter()
+        solution = self.solve(cv0, self.uv0, sps)
+        self.solve_times.append(time.perf_counter() - start)
+        self.nits.append(solution.nit)
+        self.last_solution = solution
+
+        if solution.success:
+            self.last_uvs = solution.x
+            self.active_set = solution.active_set
+            self.uv0 = solution.x[:, 0].copy()
+        else:
+            self.last_uvs = np.append(self.last_uvs[:, 1:], self.last_uvs[:, -1:], axis=1)
+            self.active_set = []
+
+        for c, (i, j, model) in enumerate(self.channels):
+            model.record_uv(self.uv0[j], len(self.nits))
+            a, b = model.discretize(self.circle)
+            self.states[c] = a * self.states[c] + b * model.uv_store.pop_uv()
+        return self.uv0
@@ -1,10 +1,202 @@
+import time
 import numpy as np
 from fopdtUtils import Fopdt
-from scipy.optimize import minimize
+from scipy.optimize import minimize, OptimizeResult
+from scipy.linalg import cho_factor, cho_solve
+from cacheUtils import CACHE, array_key
+
+
+class MpcConfig:
+    """
+    类型化、带校验的MPC控制器配置
+    1. 构造时校验所有参数, 配置错误在构造时抛出ValueError, 而不是在求解过程中得到错误的结果；
+    2. 构造时"编译"出求解需要的预计算数组: 权重向量、预测区间到决策变量的索引、uv增量约束矩阵和模型的离散化系数；
+    3. 每个控制周期只需要通过update更新cv0, uv0, sps, 热点路径上的cost计算只访问这些预计算数组。
+    """
+
+    # 旧版arg_dict的键名 -> 配置字段名
+    ALIASES = {
+        'model': 'model', 'fopdt': 'model',
+        'ph': 'ph', 'predict_horizon': 'ph',
+        'ch': 'ch', 'control_horizon': 'ch',
+        'cv0': 'cv0', 'cv_init': 'cv0',
+        'uv0': 'uv0', 'uv_init': 'uv0',
+        'circle': 'circle',
+        'u_max_move': 'u_max_move', 'uv_limit': 'u_max_move',
+        'sps': 'sps', 'sp': 'sps', 'set_points': 'sps',
+        'sp_cv_wight': 'sp_cv_wight', 'sp_y_wight': 'sp_cv_wight',
+        'uv_step_weight': 'uv_step_weight',
+        'uv_low': 'uv_low',
+        'uv_high': 'uv_high'
+    }
+
+    def __init__(self, model, ph, ch, circle, sp_cv_wight, uv_step_weight,
+                 u_max_move=None, uv_low=None, uv_high=None, cv0=0.0, uv0=0.0, sps=0.0):
+        """
+        构造函数
+        :param model: 预测模型, 比如Fopdt. 需要提供predict_horizon, predict_horizon_transpose, dynamic_matrix
+        :param ph: int. 预测区间长度
+        :param ch: int. 控制区间长度, 0 < ch <= ph
+        :param circle: float. 控制周期
+        :param sp_cv_wight: float or np.array. 目标值和设定值误差的残差权重, 标量或shape(ph,)
+        :param uv_step_weight: float or np.array. uv增量的残差权重, 标量或shape(ph,)
+        :param u_max_move: float. u的最大变化范围, None表示不限制
+        :param uv_low: float. uv的下限, None表示不限制
+        :param uv_high: float. uv的上限, None表示不限制
+        :param cv0: float. y的初始值
+        :param uv0: float. uv的初始值
+        :param sps: float or np.array. 预测区间上的设定值, 标量或shape(ph,)
+        """
+        for method in ('predict_horizon', 'predict_horizon_transpose', 'dynamic_matrix'):
+            if not callable(getattr(model, method, None)):
+                raise ValueError("预测模型缺少%s方法!" % method)
+        if isinstance(ph, bool) or not isinstance(ph, (int, np.integer)) or ph <= 0:
+            raise ValueError("预测区间长度ph需要是正整数! ph = %s" % ph)
+        if isinstance(ch, bool) or not isinstance(ch, (int, np.integer)) or not 0 < ch <= ph:
+            raise ValueError("控制区间长度需要满足 0 < ch <= ph! ch = %s, ph = %s" % (ch, ph))
+        if not circle > 0:
+            raise ValueError("控制周期circle需要大于0! circle = %s" % circle)
+        if u_max_move is not None and not u_max_move > 0:
+            raise ValueError("u_max_move需要大于0! u_max_move = %s" % u_max_move)
+        if uv_low is not None and uv_high is not None and uv_low > uv_high:
+            raise ValueError("uv_low不能大于uv_high! uv_low = %s, uv_high = %s" % (uv_low, uv_high))
+
+        self.model = model
+        self.ph = int(ph)
+        self.ch = int(ch)
+        self.circle = circle
+        self.sp_cv_wight = sp_cv_wight
+        self.uv_step_weight = uv_step_weight
+        self.u_max_move = u_max_move
+        self.uv_low = uv_low
+        self.uv_high = uv_high
+
+        self.sp_weights = self._horizon_array(sp_cv_wight, 'sp_cv_wight')
+        self.uv_weights = self._horizon_array(uv_step_weight, 'uv_step_weight')
+        if np.any(self.sp_weights < 0) or np.any(self.uv_weights < 0):
+            raise ValueError("权重不能小于0!")
+
+        self.compile()
+        self.update(cv0, uv0, sps)
+
+    def _horizon_array(self, value, name):
+        """
+        把标量或shape(ph,)的参数转换为预测区间上的数组
+        :param value: float or np.array.
+        :param name: str. 参数名, 用于错误信息
+        :return: np.array, shape(ph,)
+        """
+        array = np.asarray(value, dtype=float)
+        if array.ndim > 1 or (array.ndim == 1 and array.shape[0] != self.ph):
+            raise ValueError("%s需要是标量或长度为ph = %i的数组! shape = %s" % (name, self.ph, array.shape))
+        if not np.all(np.isfinite(array)):
+            raise ValueError("%s不能包含nan或inf!" % name)
+        return np.array(np.broadcast_to(array, (self.ph,)))
+
+    def compile(self):
+        """
+        生成求解需要的预计算数组. 修改模型参数、预测区间或约束后需要重新调用
+        :return: none
+        """
+        ph, ch = self.ph, self.ch
+
+        # 预测区间上每一步对应的决策变量: 超出控制区间的uv统一设置为控制区间最后时刻的uv
+        self.index = np.minimum(np.arange(ph), ch - 1)
+
+        # 模型的离散化系数(同时校验模型参数和控制周期)
+        if callable(getattr(self.model, 'discretize', None)):
+            self.discretization = self.model.discretize(self.circle)
+        else:
+            self.discretization = None
+
+        # uv增量约束: move_A.dot(uvs) <= move_b0 + move_b_uv * uv0
+        if self.u_max_move is not None:
+            self.move_A, self.move_b0 = MPC.move_constraints(ph, ch, 0, self.u_max_move)
+            self.move_b_uv = np.zeros(2 * ch)
+            self.move_b_uv[0], self.move_b_uv[ch] = 1, -1
+        else:
+            self.move_A = self.move_b0 = self.move_b_uv = None
+
+    def update(self, cv0=None, uv0=None, sps=None):
+        """
+        更新当前控制周期的cv0, uv0, sps. 参数为None时保持不变
+        :param cv0: float. cv的初始值
+        :param uv0: float. uv的初始值
+        :param sps: float or np.array. 预测区间上的设定值, 标量或shape(ph,)
+        :return: self
+        """
+        if cv0 is not None:
+            self.cv0 = float(cv0)
+        if uv0 is not None:
+            self.uv0 = float(uv0)
+        if sps is not None:
+            self.sps = self._horizon_array(sps, 'sps')
+        return self
+
+    def move_b(self):
+        """
+        当前uv0下uv增量约束的右端项
+        :return: np.array, shape(2*ch,). 不限制u_max_move时返回None
+        """
+        if self.move_A is None:
+            return None
+        return self.move_b0 + self.move_b_uv * self.uv0
+
+    @staticmethod
+    def from_dict(arg_dict):
+        """
+        按键名(而不是键的顺序)把旧版的arg_dict转换为MpcConfig, 支持的键名见MpcConfig.ALIASES
+        :param arg_dict: dict. mpc配置
+        :return: MpcConfig
+        """
+        kwargs = {}
+        for key, value in arg_dict.items():
+            if key not in MpcConfig.ALIASES:
+                raise ValueError("未知的MPC配置项: %s" % key)
+            field = MpcConfig.ALIASES[key]
+            if field in kwargs:
+                raise ValueError("MPC配置项重复: %s" % field)
+            kwargs[field] = value
+        missing = {'model', 'ph', 'ch', 'circle', 'sp_cv_wight', 'uv_step_weight'} - set(kwargs)
+        if missing:
+            raise ValueError("缺少MPC配置项: %s" % ', '.join(sorted(missing)))
+        return MpcConfig(**kwargs)
+
+    @staticmethod
+    def of(arg_dict, uv_low=None, uv_high=None):
+        """
+        把MpcConfig或旧版arg_dict统一转换为MpcConfig
+        :param arg_dict: MpcConfig or dict.
+        :param uv_low: float. 不为None时覆盖配置中的uv下限
+        :param uv_high: float. 不为None时覆盖配置中的uv上限
+        :return: MpcConfig. 传入MpcConfig且没有覆盖项时返回同一个对象
+        """
+        config = arg_dict if isinstance(arg_dict, MpcConfig) else MpcConfig.from_dict(arg_dict)
+        if uv_low is None and uv_high is None:
+            return config
+        return MpcConfig(
+            config.model, config.ph, config.ch, config.circle, config.sp_cv_wight, config.uv_step_weight,
+            config.u_max_move,
+            config.uv_low if uv_low is None else uv_low,
+            config.uv_high if uv_high is None else uv_high,
+            config.cv0, config.uv0, config.sps
+        )
 
 
 class MPC:
 
+    # anytime_solution的状态: 收敛
+    CONVERGED = 'converged'
+
+    # anytime_solution的状态: 时间预算用完
+    TIME_LIMIT = 'time_limit'
+
+    # anytime_solution的状态: 达到最大迭代次数
+    ITERATION_LIMIT = 'iteration_limit'
+
+    # anytime_solution的状态: 优化器失败(返回目前最好的可行解)
+    FAILED = 'failed'
+
     # 1. 在k时刻测量/估计系统当前的状态值yk
 
 
@@ -18,7 +210,7 @@ class MPC:
         """
         根据uvs和mpc的配置，计算cost
         :param uvs: np.array. 整个预测区间上的操作变量数组, shape(ph, n)
-        :param arg_dict = {
+        :param arg_dict: MpcConfig, 或者按键名转换为MpcConfig的dict(每次调用都会重新校验, 热点路径上应当传入MpcConfig) = {
             model: function. 预测模型，比如FOPDT
             ph: int. 预测区间长度
             ch: int. 控制区间长度
@@ -34,62 +226,234 @@ class MPC:
         :return: cost: float. 残差
         """
 
-        model, ph, ch, cv0, uv0, circle, u_max_move, sp, sp_cv_wight, uv_step_weight = arg_dict.values()
+        return MPC.batch_cost_function(uvs, arg_dict)
+
+    @staticmethod
+    def batch_cost_function(uvs_batch, arg_dict):
+        """
+        一次性计算一批候选uv序列的cost, 预测模型在整批数据上广播计算
+        :param uvs_batch: np.array. 候选uv序列, shape(n, ph). 传入shape(ph,)时等价于cost_function
+        :param arg_dict: MpcConfig or dict. mpc配置, 同cost_function
+        :return: costs: np.array. 每个候选uv序列的残差, shape(n,)
+        """
+        config = MpcConfig.of(arg_dict)
+
+        # 根据控制区间的长度处理uvs,超出控制区间的uv统一设置为控制区间最后时刻的uv
+        uvs = np.asarray(uvs_batch, dtype=float)[..., config.index]
 
-        cost = np.zeros(ph)
-        before_uv = uv0
-        before_cv = cv0
+        # 基于输入u和预测模型model，一次性计算预测区间p内的输出
+        cvs = config.model.predict_horizon(config.cv0, uvs, config.circle)
 
-        # 根据控制区间的长度处理uvs,超出控制区间的uv统一设置未控制区间最后时刻的uv
-        uvs[ch:] = uvs[ch]
+        # 设定值误差和uv增量的损失
+        delta_uvs = np.diff(uvs, prepend=config.uv0, axis=-1)
+        cost = config.sp_weights * ((config.sps - cvs) ** 2) + config.uv_weights * (delta_uvs ** 2)
 
-        # 遍历sps, i迭代次数，sp
-        for i in range(0, ph):
-            # print("i = %i, sp = %f" % (i, set_point))
-            # 基于输入u和预测模型model，计算预测区间p内的输出
-            next_uv = uvs[i]
-            start_time = i * circle
-            end_time = (i + 1) * circle
-            next_cv = model.solve_step_fopdt(start_time, end_time, before_cv, next_uv)
+        return np.sum(cost, axis=-1)
 
-            # 计算这次迭代的损失
-            delta_uv = next_uv - before_uv
-            cost[i] = sp_cv_wight * ((sp - next_cv) ** 2) + uv_step_weight * (delta_uv ** 2)
+    @staticmethod
+    def cost_gradient(uvs, arg_dict):
+        """
+        cost_function对uvs的解析梯度(基于FOPDT阶跃响应的灵敏度), 作为minimize的jac
+        :param uvs: np.array. 整个预测区间上的操作变量数组, shape(n,)
+        :param arg_dict: MpcConfig or dict. mpc配置, 同cost_function
+        :return: grad: np.array. 梯度, shape(n,)
+        """
+        config = MpcConfig.of(arg_dict)
+        model, circle = config.model, config.circle
 
-            # 更新uv, cv
-            before_cv = next_uv
-            before_uv = next_cv
+        uvs = np.asarray(uvs, dtype=float)
+        horizon_uvs = uvs[config.index]
 
-        sum_cost = np.sum(cost)
-        return sum_cost
+        cvs = model.predict_horizon(config.cv0, horizon_uvs, circle)
+        delta_uvs = np.diff(horizon_uvs, prepend=config.uv0)
+
+        # d/du sum(w_sp * (sp - y)^2) = -2 * G^T * (w_sp * (sp - y))
+        grad = -2 * model.predict_horizon_transpose(config.sp_weights * (config.sps - cvs), circle)
+        # d/du sum(w_uv * (u[i] - u[i-1])^2) = 2 * (w_uv[i] * du[i] - w_uv[i+1] * du[i+1])
+        weighted = config.uv_weights * delta_uvs
+        grad += 2 * (weighted - np.append(weighted[1:], 0))
+
+        # 控制区间以外的uv都等于uvs[ch-1], 梯度累加到对应的决策变量上
+        return np.bincount(config.index, weights=grad, minlength=len(uvs))
 
     @staticmethod
-    def optimize_solution(init_uvs, arg_dict):
+    def move_constraints(n, ch, uv0, u_max_move):
+        """
+        uv最大变化范围对应的线性不等式约束 A.dot(uvs) <= b, 即 |uvs[i] - uvs[i-1]| <= u_max_move, uvs[-1] = uv0
+        控制区间以外的uv都等于uvs[ch-1], 只需要约束前ch个uv
+        :param n: int. 决策变量的个数
+        :param ch: int. 控制区间长度
+        :param uv0: float. uv的初始值
+        :param u_max_move: float. u的最大变化范围
+        :return: (A, b). A: np.array, shape(2*ch, n); b: np.array, shape(2*ch,)
+        """
+        D = np.eye(ch, n) - np.eye(ch, n, k=-1)
+        A = np.vstack((D, -D))
+        b = np.full(2 * ch, float(u_max_move))
+        b[0] += uv0
+        b[ch] -= uv0
+        return A, b
+
+    @staticmethod
+    def optimize_solution(init_uvs, arg_dict, uv_low=None, uv_high=None):
         """
         给定uvs的初始猜测值和mpc配置，计算最优uvs
+        u_max_move作为线性不等式约束, uv_low/uv_high作为决策变量的上下限, 在优化过程中直接满足
         :param init_uvs. np.array. 整个预测区间上的操作变量数组
-        :param arg_dict = {
+        :param arg_dict: MpcConfig, 或者按键名转换为MpcConfig的dict = {
             model: function. 预测模型，比如FOPDT
             ph: int. 预测区间长度
             ch: int. 控制区间长度
             cv0: float. y的初始值
             uv0: float. uv的初始值
             circle: float. 控制周期
-            u_max_move: float. u的最大变化范围
+            u_max_move: float. u的最大变化范围, None表示不限制
             sps: np.array. 整个预测区间y的设定值, shape(ph, n)
             sp_cv_wight: float. 目标值和设定值误差的残差权重
             uv_step_weight: float. uv增量的残差权重
         }
+        :param uv_low: float. uv的下限, None表示使用配置中的下限
+        :param uv_high: float. uv的上限, None表示使用配置中的上限
         :return: solution: 求解结果
         """
+        config = MpcConfig.of(arg_dict, uv_low, uv_high)
+        n = len(init_uvs)
+
+        constraints = ()
+        if config.u_max_move is not None:
+            if n == config.ph:
+                A, b = config.move_A, config.move_b()
+            else:
+                A, b = MPC.move_constraints(n, config.ch, config.uv0, config.u_max_move)
+            constraints = {
+                'type': 'ineq',
+                'fun': lambda x: b - A.dot(x),
+                'jac': lambda x: -A
+            }
+
+        bounds = None
+        if config.uv_low is not None or config.uv_high is not None:
+            bounds = [(config.uv_low, config.uv_high)] * n
+
         solution = minimize(
             MPC.cost_function,
             init_uvs,
-            args=arg_dict,
-            method='SLSQP'
+            args=config,
+            method='SLSQP',
+            jac=MPC.cost_gradient,
+            bounds=bounds,
+            constraints=constraints
         )
         return solution
 
+    @staticmethod
+    def anytime_solution(init_uvs, arg_dict, time_budget, max_iter=100, uv_low=None, uv_high=None):
+        """
+        有时间预算的求解: 优化开始前先计算可行的后备计划, 优化过程中记录目前最好的可行解, 预算用完时立即返回
+        1. 后备计划: 投影到约束内的init_uvs(比如平移后的上一周期计划)和保持uv0, 取cost较小的一个；
+        2. SLSQP的迭代点不一定可行, 每次迭代后投影到约束内再和目前最好的解比较；
+        3. cost和梯度的每次计算前检查时间, 超出预算时中止优化。
+        :param init_uvs: np.array. 整个预测区间上的操作变量数组, 同optimize_solution
+        :param arg_dict: MpcConfig or dict. mpc配置, 同optimize_solution
+        :param time_budget: float. 时间预算(秒)
+        :param max_iter: int. 最大迭代次数
+        :param uv_low: float. uv的下限, None表示使用配置中的下限
+        :param uv_high: float. uv的上限, None表示使用配置中的上限
+        :return: solution: OptimizeResult. x: 目前最好的可行解; success: 是否收敛;
+                 status: MPC.CONVERGED, MPC.TIME_LIMIT, MPC.ITERATION_LIMIT 或 MPC.FAILED;
+                 feasible: x是否满足约束; fallback: x是否为后备计划; nit, nfev, elapsed
+        """
+        start = time.perf_counter()
+        deadline = start + time_budget
+        config = MpcConfig.of(arg_dict, uv_low, uv_high)
+        init_uvs = np.asarray(init_uvs, dtype=float)
+        n = len(init_uvs)
+        if config.u_max_move is None:
+            A = b = None
+        elif n == config.ph:
+            A, b = config.move_A, config.move_b()
+        else:
+            A, b = MPC.move_constraints(n, config.ch, config.uv0, config.u_max_move)
+
+        def project(uvs):
+            return MPC.project_rate_limit(config.uv0, uvs, config.u_max_move, config.uv_low, config.uv_high)
+
+        def is_feasible(uvs):
+            if A is not None and np.any(A.dot(uvs) > b + 1e-7):
+                return False
+            return ((config.uv_low is None or np.all(uvs >= config.uv_low - 1e-7)) and
+                    (config.uv_high is None or np.all(uvs <= config.uv_high + 1e-7)))
+
+        # 后备计划
+        candidates = np.array([project(init_uvs), project(np.full(n, float(config.uv0)))])
+        costs = MPC.batch_cost_function(candidates, config)
+        best = {'x': candidates[np.argmin(costs)], 'fun': float(costs.min()), 'fallback': True, 'nit': 0, 'nfev': 2}
+
+        def check_time():
+            if time.perf_counter() > deadline:
+                raise _BudgetExhausted
+
+        def fun(x):
+            check_time()
+            best['nfev'] += 1
+            return MPC.cost_function(x, config)
+
+        def jac(x):
+            check_time()
+            return MPC.cost_gradient(x, config)
+
+        def callback(x):
+            best['nit'] += 1
+            x = project(x)
+            cost = MPC.cost_function(x, config)
+            if cost < best['fun']:
+                best.update(x=x, fun=cost, fallback=False)
+
+        constraints = () if A is None else {'type': 'ineq', 'fun': lambda x: b - A.dot(x), 'jac': lambda x: -A}
+        bounds = None
+        if config.uv_low is not None or config.uv_high is not None:
+            bounds = [(config.uv_low, config.uv_high)] * n
+
+        try:
+            solution = minimize(fun, best['x'], args=(), method='SLSQP', jac=jac, bounds=bounds,
+                                constraints=constraints, callback=callback, options={'maxiter': max_iter})
+            converged = bool(solution.success) and is_feasible(solution.x)
+            if converged or (is_feasible(solution.x) and solution.fun < best['fun']):
+                best.update(x=np.asarray(solution.x), fun=float(solution.fun), fallback=False)
+            if converged:
+                status = MPC.CONVERGED
+            else:
+                status = MPC.ITERATION_LIMIT if solution.status == 9 else MPC.FAILED
+            message = solution.message
+        except _BudgetExhausted:
+            converged, status, message = False, MPC.TIME_LIMIT, 'Time budget exhausted'
+
+        return OptimizeResult(
+            x=best['x'], fun=best['fun'], success=converged, status=status, message=message,
+            feasible=is_feasible(best['x']), fallback=best['fallback'], nit=best['nit'], nfev=best['nfev'],
+            elapsed=time.perf_counter() - start
+        )
+
+    @staticmethod
+    def project_rate_limit(uv0, uvs, u_max_move, uv_low=None, uv_high=None):
+        """
+        向量化的uv变化率投影: 把相邻uv的增量裁剪到[-u_max_move, u_max_move], 累加后再裁剪到[uv_low, uv_high]
+        (裁剪到上下限不会增大相邻uv的增量, 所以结果同时满足两类约束, 前提是uv0本身在上下限内)
+        :param uv0: float. uv的初始值
+        :param uvs: np.array. 待投影的uv数组, shape(n,) 或 shape(m, n)
+        :param u_max_move: float. u的最大变化范围, None表示不限制
+        :param uv_low: float. uv的下限, None表示不限制
+        :param uv_high: float. uv的上限, None表示不限制
+        :return: np.array. 投影后的uv数组, shape与uvs相同
+        """
+        uvs = np.asarray(uvs, dtype=float)
+        if u_max_move is not None:
+            delta_uvs = np.clip(np.diff(uvs, prepend=uv0, axis=-1), -u_max_move, u_max_move)
+            uvs = uv0 + np.cumsum(delta_uvs, axis=-1)
+        if uv_low is not None or uv_high is not None:
+            uvs = np.clip(uvs, uv_low, uv_high)
+        return uvs
+
     @staticmethod
     def filter_uv_by_max_move(uv0, uvs, uv_max_move):
         """
@@ -99,22 +463,416 @@ class MPC:
         :param uv_max_move: uv最大移动步长
         :return:
         """
-        filter_uvs = []
+        return list(MPC.project_rate_limit(uv0, uvs, uv_max_move))
+
 
-        # 控制uvs[0]的步幅
-        if np.abs(uvs[0] - uv0) <= uv_max_move:
-            filter_uvs.append(uvs[0])
+class QpMPC:
+    """
+    线性FOPDT模型 + 二次型损失的MPC(凝聚QP / 动态矩阵形式)
+    1. 构造时根据k, tau, ph, ch, circle和权重预计算动态矩阵、Hessian并做Cholesky分解；
+    2. 每个控制周期只更新右端项(cv0, uv0, sps)，再做一次三角回代求解；
+    3. 无约束解违反u_max_move或uv上下限时，从投影得到的可行点出发，用有效集法求解带约束的QP。
+    损失函数和MPC.cost_function完全相同，已有的arg_dict配置可以直接使用
+    """
+
+    def __init__(self, arg_dict, uv_low=None, uv_high=None):
+        """
+        构造函数
+        :param arg_dict: MpcConfig or dict. mpc配置, 同MPC.cost_function. 其中的cv0, uv0, sps作为第一个周期的初值
+        :param uv_low: float. uv的下限, None表示使用配置中的下限
+        :param uv_high: float. uv的上限, None表示使用配置中的上限
+        """
+        self.config = MpcConfig.of(arg_dict, uv_low, uv_high)
+
+        # 上一次求解结束时的有效约束
+        self.active_set = []
+
+        self.build()
+
+    def build(self):
+        """
+        预计算动态矩阵、Hessian及其Cholesky分解. 模型参数或权重变化后需要重新调用
+        :return: none
+        """
+        config = self.config
+        config.compile()
+        self.model = config.model
+        self.ph, self.ch, self.circle = ph, ch, circle = config.ph, config.ch, config.circle
+        self.u_max_move, self.uv_low, self.uv_high = config.u_max_move, config.uv_low, config.uv_high
+        self.index = config.index
+
+        # 模型提供cache_key时, 参数和权重相同的控制器共用同一份矩阵和Cholesky分解
+        model_key = getattr(self.model, 'cache_key', None)
+        if model_key is None:
+            matrices = self._build_matrices()
         else:
-            filter_uvs.append(uvs[0] + uv_max_move * (uvs[0] / np.abs(uvs[0])))
+            key = ('qp', model_key, ph, ch, circle) + array_key(config.sp_weights, config.uv_weights)
+            matrices = CACHE.get(key, self._build_matrices)
+        self.phi, self.Gm, self.Gt_w, self.H, self.f_cv, self.f_uv, self.H_factor = matrices
+
+        # 约束: A.dot(x) <= b0 + b_uv * uv0
+        A, b0, b_uv = [np.zeros((0, ch))], [np.zeros(0)], [np.zeros(0)]
+        if config.move_A is not None:
+            A.append(config.move_A[:, :ch])
+            b0.append(config.move_b0)
+            b_uv.append(config.move_b_uv)
+        if self.uv_high is not None:
+            A.append(np.eye(ch))
+            b0.append(np.full(ch, float(self.uv_high)))
+            b_uv.append(np.zeros(ch))
+        if self.uv_low is not None:
+            A.append(-np.eye(ch))
+            b0.append(np.full(ch, -float(self.uv_low)))
+            b_uv.append(np.zeros(ch))
+        self.A = np.vstack(A)
+        self.b0 = np.concatenate(b0)
+        self.b_uv = np.concatenate(b_uv)
+
+    def _build_matrices(self):
+        """
+        :return: (phi, Gm, Gt_w, H, f_cv, f_uv, H_factor)
+        """
+        config = self.config
+        ph, ch = self.ph, self.ch
+        G, phi = self.model.dynamic_matrix(ph, self.circle)
 
-        # 控制其他uv的步幅
-        for i in uvs[1:]:
-            uv = uvs[i]
-            if np.abs(uvs[i] - uvs[i-1]) <= uv_max_move:
-                filter_uvs.append(uv)
+        # 决策变量x为控制区间内的ch个uv, 整个预测区间上的uvs = M.dot(x)
+        M = np.zeros((ph, ch))
+        M[np.arange(ph), self.index] = 1
+
+        # 预测: y = phi * cv0 + Gm.dot(x); uv增量: du = Dm.dot(x) - e0 * uv0
+        Gm = G.dot(M)
+        Dm = (np.eye(ph) - np.eye(ph, k=-1)).dot(M)
+
+        # cost = x'Hx + 2g'x + c, g = f_cv * cv0 + f_uv * uv0 - Gt_w.dot(sps)
+        Gt_w = Gm.T * config.sp_weights
+        H = Gt_w.dot(Gm) + (Dm.T * config.uv_weights).dot(Dm)
+        try:
+            H_factor = cho_factor(H)
+        except np.linalg.LinAlgError:
+            # 比如uv_step_weight = 0且ch > ph - 迟滞时, 迟滞后落在预测区间之外的uv既不影响cv也没有增量代价
+            raise ValueError("QP的Hessian不正定, 最优解不唯一: ph = %s, ch = %s, theta = %s, sp_cv_wight = %s, "
+                             "uv_step_weight = %s. 需要uv_step_weight > 0, 或者减小ch使每个uv都能影响预测区间内的cv"
+                             % (ph, ch, getattr(self.model, 'theta', None), config.sp_cv_wight,
+                                config.uv_step_weight)) from None
+        return phi, Gm, Gt_w, H, Gt_w.dot(phi), -config.uv_weights[0] * Dm[0], H_factor
+
+    def gradient_term(self, cv0, uv0, sps):
+        """
+        当前周期QP的一次项g
+        :param cv0: float. cv的初始值
+        :param uv0: float. uv的初始值
+        :param sps: float or np.array. 预测区间上的设定值
+        :return: g: np.array, shape(ch,)
+        """
+        # 迟滞时, 已经写入的历史uv引起的响应相当于从设定值中扣除的偏置
+        sps = np.broadcast_to(sps, (self.ph,)) - self.model.history_response(self.ph, self.circle)
+        return self.f_cv * cv0 + self.f_uv * uv0 - self.Gt_w.dot(sps)
+
+    def cost(self, uvs, cv0, uv0, sps):
+        """
+        计算预测区间上uvs的cost, 和MPC.cost_function一致
+        :param uvs: np.array. 整个预测区间上的操作变量数组, shape(ph,)
+        :return: cost: float
+        """
+        cvs = self.phi * cv0 + self.Gm.dot(uvs[:self.ch]) + self.model.history_response(self.ph, self.circle)
+        delta_uvs = np.diff(uvs, prepend=uv0)
+        return np.sum(self.config.sp_weights * (sps - cvs) ** 2 + self.config.uv_weights * delta_uvs ** 2)
+
+    def shift_active_set(self, active_set):
+        """
+        把上一个周期的有效集向前平移一步, 作为当前周期有效集的初始猜测
+        约束矩阵按每ch行一组排列(各类约束对x[0], ..., x[ch-1]各有一行), 平移后第j行变为第j-1行, x[ch-1]对应的行保留
+        :param active_set: list. 上一个周期的有效约束
+        :return: list. 平移后的有效约束
+        """
+        ch = self.ch
+        shifted = []
+        for row in active_set:
+            j = row % ch
+            if j > 0:
+                shifted.append(row - 1)
+            if j == ch - 1:
+                shifted.append(row)
+        return sorted(set(shifted))
+
+    def solve(self, cv0=None, uv0=None, sps=None, working_set=None, time_budget=None):
+        """
+        求解当前周期的最优uvs. 参数为None时使用上一次的值
+        :param cv0: float. cv的初始值
+        :param uv0: float. uv的初始值
+        :param sps: float or np.array. 预测区间上的设定值
+        :param working_set: list. 有效集的初始猜测(比如shift_active_set平移后的上一周期有效集), 用于热启动
+        :param time_budget: float. 时间预算(秒), 用完时返回有效集法当前的迭代点(始终可行), None表示不限制
+        :return: solution: OptimizeResult. 和MPC.optimize_solution的返回值用法相同, solution.x.shape = (ph,);
+                 solution.feasible表示x是否满足约束
+        """
+        deadline = None if time_budget is None else time.perf_counter() + time_budget
+        config = self.config.update(cv0, uv0, sps)
+        cv0, uv0, sps = config.cv0, config.uv0, config.sps
+
+        g = self.gradient_term(cv0, uv0, sps)
+        b = self.b0 + self.b_uv * uv0
+        x = cho_solve(self.H_factor, -g)
+        success, nit, message = True, 0, 'Optimization terminated successfully'
+        self.active_set = []
+
+        if np.any(self.A.dot(x) > b + _QP_TOL):
+            # 无约束解不可行, 优先以猜测的有效集上的等式约束解作为起点, 否则从投影得到的可行点出发求解带约束的QP
+            x0, working_set = None, list(working_set or [])
+            if working_set:
+                x0 = _solve_eqp(self.H_factor, g, self.A[working_set], b[working_set])
+                if np.any(self.A.dot(x0) > b + _QP_TOL):
+                    x0, working_set = None, []
+            if x0 is None:
+                x0 = MPC.project_rate_limit(uv0, x, self.u_max_move, self.uv_low, self.uv_high)
+
+            if np.any(self.A.dot(x0) > b + _QP_TOL):
+                x, success, message = x0, False, 'Infeasible: uv0 is outside the reachable uv limits'
             else:
-                # uv = uv + (uv/|uv|) * uv_max_move
-                filter_uvs.append(uv + uv_max_move * (uv/np.abs(uv)))
+                x, self.active_set, nit, success = _active_set_qp(
+                    self.H, self.H_factor, g, self.A, b, x0, working_set, deadline=deadline
+                )
+                if not success:
+                    if deadline is not None and time.perf_counter() > deadline:
+                        message = 'Time budget exhausted'
+                    else:
+                        message = 'Iteration limit reached'
+
+        uvs = x[self.index]
+
+        return OptimizeResult(
+            x=uvs,
+            fun=self.cost(uvs, cv0, uv0, sps),
+            success=success,
+            status=0 if success else 1,
+            message=message,
+            nit=nit,
+            active_set=list(self.active_set),
+            feasible=bool(np.all(self.A.dot(x) <= b + _QP_TOL))
+        )
+
+
+# 有效集法判断约束是否满足、步长是否为0的容差
+_QP_TOL = 1e-9
+
+
+class _BudgetExhausted(Exception):
+    """
+    anytime_solution中用于中止minimize的异常
+    """
+
+
+def _solve_eqp(H_factor, g, A_w, b_w):
+    """
+    求解等式约束的QP: min 0.5 * x'Hx + g'x, s.t. A_w.dot(x) = b_w
+    :param H_factor: H的Cholesky分解(cho_factor的返回值)
+    :param g: np.array. 一次项, shape(n,)
+    :param A_w: np.array. 等式约束矩阵, shape(m, n)
+    :param b_w: np.array. 等式约束右端项, shape(m,)
+    :return: x: np.array, shape(n,)
+    """
+    H_inv_g = cho_solve(H_factor, g)
+    H_inv_At = cho_solve(H_factor, A_w.T)
+    lam = np.linalg.lstsq(A_w.dot(H_inv_At), -A_w.dot(H_inv_g) - b_w, rcond=None)[0]
+    return -H_inv_g - H_inv_At.dot(lam)
+
+
+def _active_set_qp(H, H_factor, g, A, b, x0, working_set=(), max_iter=100, deadline=None):
+    """
+    原始有效集法求解凸QP: min 0.5 * x'Hx + g'x, s.t. A.dot(x) <= b. 迭代过程中的x始终可行
+    :param H: np.array. 正定的Hessian, shape(n, n)
+    :param H_factor: H的Cholesky分解(cho_factor的返回值)
+    :param g: np.array. 一次项, shape(n,)
+    :param A: np.array. 约束矩阵, shape(m, n)
+    :param b: np.array. 约束右端项, shape(m,)
+    :param x0: np.array. 可行的初始点, shape(n,)
+    :param working_set: list. 初始的有效约束(比如上一个周期的有效集), 不在x0处起作用的约束会被忽略
+    :param max_iter: int. 最大迭代次数
+    :param deadline: float. time.perf_counter()的截止时刻, 超过时返回当前(可行的)迭代点, None表示不限制
+    :return: (x, working_set, nit, success)
+    """
+    x = np.array(x0, dtype=float)
+    slack = b - A.dot(x)
+    working = [i for i in working_set if abs(slack[i]) <= 1e-7]
+
+    for nit in range(1, max_iter + 1):
+        if deadline is not None and time.perf_counter() > deadline:
+            return x, working, nit - 1, False
+        grad = H.dot(x) + g
+
+        # 在有效约束上求解等式约束的QP: H.dot(p) + A_w'.dot(lam) = -grad, A_w.dot(p) = 0
+        if working:
+            A_w = A[working]
+            H_inv_At = cho_solve(H_factor, A_w.T)
+            H_inv_grad = cho_solve(H_factor, grad)
+            lam = np.linalg.lstsq(A_w.dot(H_inv_At), -A_w.dot(H_inv_grad), rcond=None)[0]
+            p = -H_inv_grad - H_inv_At.dot(lam)
+        else:
+            lam = np.zeros(0)
+            p = -cho_solve(H_factor, grad)
+
+        if np.max(np.abs(p), initial=0) <= 1e-10 * (1 + np.max(np.abs(x))):
+            if lam.size == 0 or lam.min() >= -_QP_TOL:
+                return x, working, nit, True
+            # 移除乘子为负的约束
+            working.pop(int(np.argmin(lam)))
+        else:
+            # 沿p前进, 遇到的第一个阻塞约束加入有效集
+            Ap = A.dot(p)
+            slack = b - A.dot(x)
+            alpha, blocking = 1.0, None
+            for i in np.flatnonzero(Ap > _QP_TOL):
+                if i not in working and slack[i] / Ap[i] < alpha:
+                    alpha, blocking = max(slack[i] / Ap[i], 0.0), i
+            x = x + alpha * p
+            if blocking is not None:
+                working.append(int(blocking))
+
+    return x, working, max_iter, False
+
+
+class MpcController:
+    """
+    带状态的滚动优化控制器
+    1. 保存上一个周期的最优uv序列, 向前平移一步后作为当前周期的初始猜测(热启动)；
+    2. QP模式下同时平移并复用上一个周期的有效集；
+    3. 记录每个周期的迭代次数和求解耗时, 用于确认热启动的效果。
+    """
+
+    # 求解方式: MPC.optimize_solution(SLSQP)
+    SLSQP = 'slsqp'
+
+    # 求解方式: QpMPC(凝聚QP + 有效集法)
+    QP = 'qp'
+
+    # 后备策略: 保持上一周期的uv
+    HOLD = 'hold'
+
+    # 后备策略: 执行平移后的上一周期计划
+    SHIFT = 'shift'
+
+    def __init__(self, arg_dict, uv_low=None, uv_high=None, mode=SLSQP, time_budget=None):
+        """
+        构造函数
+        :param arg_dict: MpcConfig or dict. mpc配置, 同MPC.cost_function. 其中的uv0作为控制器的初始输出.
+                         传入MpcConfig时, 控制器在每个周期更新其中的cv0, uv0, sps.
+                         控制器把写入的uv记录到其中的model, model不能同时作为过程模型
+        :param uv_low: float. uv的下限, None表示使用配置中的下限
+        :param uv_high: float. uv的上限, None表示使用配置中的上限
+        :param mode: str. 求解方式, MpcController.SLSQP 或 MpcController.QP
+        :param time_budget: float. 每个周期的求解时间预算(秒), 用完时采用目前最好的可行解
+                            (SLSQP模式使用MPC.anytime_solution), None表示求解到收敛
+        """
+        if mode not in (MpcController.SLSQP, MpcController.QP):
+            raise ValueError("未知的求解方式: %s" % mode)
+        self.config = MpcConfig.of(arg_dict, uv_low, uv_high)
+        self.mode = mode
+        self.qp = QpMPC(self.config) if mode == MpcController.QP else None
+        self.time_budget = time_budget
+
+        # 当前写入的uv和上一个周期的最优uv序列
+        self.uv0 = self.config.uv0
+        self.last_uvs = np.full(self.config.ph, self.uv0)
+        self.last_solution = None
+
+        # 每个周期的迭代次数和求解耗时(秒)
+        self.nits = []
+        self.solve_times = []
+
+        # 为True时, 每个周期记录当前计划对应的cv预测轨迹
+        self.record_predictions = False
+        self.last_prediction = None
+
+    def fallback_move(self, fallback=None, n=1):
+        """
+        连续n个周期没有可用的解(apply(None, fallback=fallback)调用n次)后写入的uv, 不修改控制器
+        :param fallback: str. 后备策略, 同apply
+        :param n: int. 连续使用后备策略的周期数
+        :return: float. uv
+        """
+        if fallback == MpcController.SHIFT:
+            return self.last_uvs[min(n, len(self.last_uvs) - 1)]
+        return self.uv0
+
+    def warm_start(self):
+        """
+        把上一个周期的最优uv序列向前平移一步, 最后一个uv保持不变
+        :return: np.array. 当前周期的初始猜测, shape(ph,)
+        """
+        return np.append(self.last_uvs[1:], self.last_uvs[-1])
+
+    def rebuild(self):
+        """
+        模型参数(k, tau)变化后重新生成预计算数组, 比如在线辨识更新了模型之后
+        :return: none
+        """
+        if self.qp is not None:
+            self.qp.build()
+            self.qp.active_set = []
+        else:
+            self.config.compile()
+
+    def step(self, cv0, sps=None):
+        """
+        执行一个控制周期: 以平移后的上一周期解为初值求解, 返回需要写入的uv
+        :param cv0: float. 当前周期cv的测量值
+        :param sps: float or np.array. 预测区间上的设定值, None表示沿用上一次的设定值
+        :return: uv: float. 当前周期写入的uv, 求解失败时保持上一周期的uv
+        """
+        return self.apply(self.solve(cv0, sps), cv0)
+
+    def solve(self, cv0, sps=None):
+        """
+        只求解当前周期, 不修改控制器的输出和计划. 和apply配合使用, 可以把求解放到其他线程中执行
+        :param cv0: float. 当前周期cv的测量值
+        :param sps: float or np.array. 预测区间上的设定值, None表示沿用上一次的设定值
+        :return: solution: OptimizeResult. solution.solve_time为求解耗时(秒)
+        """
+        self.config.update(cv0, self.uv0, sps)
+
+        start = time.perf_counter()
+        if self.mode == MpcController.QP:
+            working_set = self.qp.shift_active_set(self.qp.active_set)
+            solution = self.qp.solve(working_set=working_set, time_budget=self.time_budget)
+        elif self.time_budget is not None:
+            solution = MPC.anytime_solution(self.warm_start(), self.config, self.time_budget)
+        else:
+            solution = MPC.optimize_solution(self.warm_start(), self.config)
+        solution.solve_time = time.perf_counter() - start
+        return solution
+
+    def apply(self, solution, cv0=None, fallback=None):
+        """
+        采用solve的结果(或者不采用, 使用后备策略), 更新控制器的输出和计划
+        :param solution: OptimizeResult. solve的返回值, None表示当前周期没有可用的解
+        :param cv0: float. 当前周期cv的测量值, 只在record_predictions时使用
+        :param fallback: str. 没有可用的解(或求解失败)时的后备策略: MpcController.HOLD(保持uv, 默认)
+                         或 MpcController.SHIFT(执行平移后的上一周期计划)
+        :return: uv: float. 当前周期写入的uv
+        """
+        self.solve_times.append(solution.solve_time if solution is not None else 0.0)
+        self.nits.append(solution.nit if solution is not None else 0)
+        self.last_solution = solution
+
+        # 有时间预算时, 没有收敛但可行的解同样被采用
+        usable = solution is not None and (solution.success or (self.time_budget is not None and
+                                                                solution.get('feasible', False)))
+        if usable:
+            self.last_uvs = np.asarray(solution.x, dtype=float)
+            self.uv0 = self.last_uvs[0]
+        else:
+            # 没有可用的解时, 下一个周期仍然从平移后的计划出发
+            self.last_uvs = self.warm_start()
+            if fallback == MpcController.SHIFT:
+                self.uv0 = self.last_uvs[0]
+            elif fallback not in (None, MpcController.HOLD):
+                raise ValueError("未知的后备策略: %s" % fallback)
 
-        return filter_uvs
+        if self.record_predictions and cv0 is not None:
+            config = self.config
+            self.last_prediction = config.model.predict_horizon(cv0, self.last_uvs[config.index], config.circle)
 
+        # 写入的uv进入预测模型的迟滞缓冲区(状态空间模型同时推进内部状态), 供之后周期的预测使用
+        self.config.model.record_uv(self.uv0, len(self.nits))
+        return self.uv0
@@ -0,0 +1,283 @@
+import time
+import numpy as np
+from scipy.linalg import cho_factor, LinAlgError
+from scipy.optimize import OptimizeResult
+from balloonUtils import HotAirBalloon
+from mpcControl import MPC, _active_set_qp
+
+
+class BalloonNMPC:
+    """
+    热气球的逐次线性化非线性MPC(successive linearization)
+    1. 以平移后的上一周期计划为名义输入, 用固定步长RK4仿真名义轨迹, 并用有限差分求出每一步的A_k, B_k；
+    2. 把线性化的预测 y = y_bar + G.dot(z - z_bar) 凝聚成和QpMPC相同形式的QP, 用同一个有效集法求解；
+    3. 以新的解为名义输入重新线性化, 至多迭代max_iter次, 每次迭代的开销和一次线性MPC相当；
+    4. 决策变量按输入的上下限范围归一化, 移动权重对两个输入是可比的。
+    """
+
+    # 状态个数, 输入个数
+    NX = 3
+    NU = 2
+
+    def __init__(self, ph=40, ch=8, dt=4.0, sp_weight=1.0, move_weight=(1.0, 1.0),
+                 u_low=(0.0, 0.0), u_high=(30.0 / HotAirBalloon.FR, 5.0 / HotAirBalloon.PR),
+                 u_max_move=None, max_iter=3, tol=1e-6, substeps=4):
+        """
+        构造函数
+        :param ph: int. 预测区间长度
+        :param ch: int. 控制区间长度, ch <= ph
+        :param dt: float. 控制周期, 无量纲时间
+        :param sp_weight: float. 高度跟踪误差的权重
+        :param move_weight: tuple. (燃料阀, 排气阀)归一化后的移动权重
+        :param u_low: tuple. 输入的下限(无量纲)
+        :param u_high: tuple. 输入的上限(无量纲)
+        :param u_max_move: tuple. 每个周期输入的最大变化量(无量纲), None表示不限制
+        :param max_iter: int. 每个周期重新线性化的最大次数
+        :param tol: float. 两次迭代的归一化输入变化小于tol时停止迭代
+        :param substeps: int. 每个控制周期内RK4的步数
+        """
+        if not 0 < ch <= ph:
+            raise ValueError("需要 0 < ch <= ph!")
+        if max_iter < 1:
+            raise ValueError("max_iter需要大于0!")
+        self.ph = ph
+        self.ch = ch
+        self.dt = dt
+        self.sp_weight = sp_weight
+        self.move_weight = np.broadcast_to(np.asarray(move_weight, dtype=float), (self.NU,))
+        self.u_low = np.broadcast_to(np.asarray(u_low, dtype=float), (self.NU,))
+        self.u_high = np.broadcast_to(np.asarray(u_high, dtype=float), (self.NU,))
+        if np.any(self.u_high <= self.u_low):
+            raise ValueError("u_high需要大于u_low!")
+        self.u_max_move = None if u_max_move is None else np.broadcast_to(
+            np.asarray(u_max_move, dtype=float), (self.NU,))
+        self.max_iter = max_iter
+        self.tol = tol
+        self.substeps = substeps
+
+        # 预测区间上每一步对应的控制步
+        self.index = np.minimum(np.arange(ph), ch - 1)
+
+        # 归一化: u = scale * z
+        self.scale = self.u_high - self.u_low
+
+        self._build_constraints()
+
+        # 当前写入的输入, 上一个周期的计划和有效集
+        self.u0 = np.array(self.u_low)
+        self.last_plan = None
+        self.active_set = []
+
+        # 每个周期的线性化次数, QP迭代次数和求解耗时(秒)
+        self.nits = []
+        self.qp_nits = []
+        self.solve_times = []
+        self.last_solution = None
+
+    def _build_constraints(self):
+        """
+        和初值无关的部分: 移动矩阵D(第一行相对于u0), 约束 A.dot(z) <= b0 + b_u0.dot(z0)
+        """
+        ch, nu = self.ch, self.NU
+        n = ch * nu
+        eye = np.eye(n)
+        # 第j步第i个输入的移动: z[j, i] - z[j - 1, i]
+        self.D = eye - np.eye(n, k=-nu)
+        self.R = np.tile(self.move_weight, ch)
+
+        rows = [eye, -eye]
+        b0 = [np.tile(self.u_high / self.scale, ch), -np.tile(self.u_low / self.scale, ch)]
+        b_u0 = [np.zeros((n, nu)), np.zeros((n, nu))]
+        if self.u_max_move is not None:
+            first = np.zeros((n, nu))
+            first[:nu] = np.eye(nu)
+            limit = np.tile(self.u_max_move / self.scale, ch)
+            rows += [self.D, -self.D]
+            b0 += [limit, limit]
+            b_u0 += [first, -first]
+        self.A = np.vstack(rows)
+        self.b0 = np.concatenate(b0)
+        self.b_u0 = np.vstack(b_u0)
+
+    def step_model(self, x, u, ground=True):
+        """
+        离散模型: 在一个控制周期内对HotAirBalloon.derivative做RK4积分, 结束时施加地面约束
+        :param x: np.array. 状态, shape(3,)或(3, m)
+        :param u: np.array. 输入, shape(2,)或(2, m)
+        :param ground: bool. 是否施加地面约束(高度小于0时高度和速度置为0)
+        :return: np.array. 下一个控制周期的状态, shape同x
+        """
+        f = HotAirBalloon.derivative
+        h = self.dt / self.substeps
+        x = np.array(x, dtype=float)
+        for _ in range(self.substeps):
+            k1 = f(0, x, u[0], u[1])
+            k2 = f(0, x + 0.5 * h * k1, u[0], u[1])
+            k3 = f(0, x + 0.5 * h * k2, u[0], u[1])
+            k4 = f(0, x + h * k3, u[0], u[1])
+            x = x + h / 6 * (k1 + 2 * k2 + 2 * k3 + k4)
+        if ground:
+            below = x[0] <= 0
+            x[0] = np.where(below, 0.0, x[0])
+            x[1] = np.where(below, 0.0, x[1])
+        return x
+
+    def predict(self, x0, plan):
+        """
+        名义轨迹
+        :param x0: np.array. 当前状态, shape(3,)
+        :param plan: np.array. 控制区间上的输入, shape(ch, 2)
+        :return: np.array. 状态轨迹, shape(ph + 1, 3), 第0行为x0
+        """
+        states = np.empty((self.ph + 1, self.NX))
+        states[0] = x0
+        for k in range(self.ph):
+            states[k + 1] = self.step_model(states[k], plan[self.index[k]])
+        return states
+
+    def linearize(self, x0, plan):
+        """
+        沿名义轨迹线性化, 得到高度对归一化决策变量的灵敏度
+        :param x0: np.array. 当前状态, shape(3,)
+        :param plan: np.array. 名义输入, shape(ch, 2)
+        :return: (states, G). states.shape = (ph + 1, 3), G.shape = (ph, ch * 2)
+        """
+        nx, nu = self.NX, self.NU
+        states = np.empty((self.ph + 1, nx))
+        states[0] = x0
+        G = np.empty((self.ph, self.ch * nu))
+        S = np.zeros((nx, self.ch * nu))
+        for k in range(self.ph):
+            x, u = states[k], plan[self.index[k]]
+            # 名义点和每个状态/输入方向上的扰动点一起向量化地积分.
+            # 灵敏度取自不施加地面约束的模型: 停在地面上时, 加热仍然能在线性化的预测中体现为高度的上升
+            eps_x = 1e-7 * (1 + np.abs(x))
+            eps_u = 1e-7 * self.scale
+            X = np.tile(x[:, None], (1, 1 + nx + nu))
+            U = np.tile(u[:, None], (1, 1 + nx + nu))
+            X[np.arange(nx), 1 + np.arange(nx)] += eps_x
+            U[np.arange(nu), 1 + nx + np.arange(nu)] += eps_u
+            Y = self.step_model(X, U, ground=False)
+
+            states[k + 1] = Y[:, 0]
+            if states[k + 1, 0] <= 0:
+                states[k + 1, :2] = 0.0
+            A = (Y[:, 1:1 + nx] - Y[:, :1]) / eps_x
+            B = (Y[:, 1 + nx:] - Y[:, :1]) / eps_u * self.scale
+            j = self.index[k]
+            S = A.dot(S)
+            S[:, j * nu:(j + 1) * nu] += B
+            G[k] = S[0]
+        return states, G
+
+    def cost(self, x0, u0, plan, sps):
+        """
+        非线性模型下的目标函数
+        :param x0: np.array. 当前状态
+        :param u0: np.array. 当前写入的输入, shape(2,)
+        :param plan: np.array. 控制区间上的输入, shape(ch, 2)
+        :param sps: float or np.array. 预测区间上的高度设定值
+        :return: float
+        """
+        heights = self.predict(x0, plan)[1:, 0]
+        moves = np.diff(np.vstack((u0, plan)), axis=0) / self.scale
+        return self.sp_weight * np.sum((heights - sps) ** 2) + np.sum(self.move_weight * moves ** 2)
+
+    def _feasible(self, u0, plan):
+        """
+        把名义输入投影到约束内, 作为有效集法的可行初始点
+        """
+        plan = np.array(plan, dtype=float)
+        for i in range(self.NU):
+            if self.u_max_move is None:
+                plan[:, i] = np.clip(plan[:, i], self.u_low[i], self.u_high[i])
+            else:
+                plan[:, i] = MPC.project_rate_limit(u0[i], plan[:, i], self.u_max_move[i],
+                                                    self.u_low[i], self.u_high[i])
+        return plan
+
+    def solve(self, x0, u0=None, sps=0.0, plan=None, working_set=None):
+        """
+        计算当前周期的最优输入序列
+        :param x0: np.array. 当前状态(高度, 速度, 温度)
+        :param u0: np.array. 当前写入的输入, None表示使用self.u0
+        :param sps: float or np.array. 预测区间上的高度设定值, shape(ph,)
+        :param plan: np.array. 名义输入, shape(ch, 2), None表示保持u0
+        :param working_set: list. 初始有效集
+        :return: solution: OptimizeResult.
+                 solution.x: 预测区间上的最优输入, shape(ph, 2)
+                 solution.plan: 控制区间上的最优输入, shape(ch, 2)
+                 solution.nit: 线性化次数; solution.qp_nit: QP迭代次数之和
+                 solution.predicted: 非线性模型下的状态轨迹, shape(ph + 1, 3)
+        """
+        u0 = self.u0 if u0 is None else np.asarray(u0, dtype=float)
+        sps = np.broadcast_to(np.asarray(sps, dtype=float), (self.ph,))
+        plan = np.tile(u0, (self.ch, 1)) if plan is None else plan
+        z = (self._feasible(u0, plan) / self.scale).ravel()
+        z0 = u0 / self.scale
+        working = list(working_set or [])
+
+        b = self.b0 + self.b_u0.dot(z0)
+        d0 = np.zeros_like(z)
+        d0[:self.NU] = z0
+
+        qp_nit, success, converged = 0, True, False
+        for nit in range(1, self.max_iter + 1):
+            states, G = self.linearize(x0, z.reshape(self.ch, self.NU) * self.scale)
+            # 线性化的预测: heights = residual + G.dot(z_new)
+            residual = states[1:, 0] - G.dot(z) - sps
+            H = 2 * (self.sp_weight * G.T.dot(G) + self.D.T.dot(self.R[:, None] * self.D))
+            g = 2 * (self.sp_weight * G.T.dot(residual) - self.D.T.dot(self.R * d0))
+            try:
+                H_factor = cho_factor(H)
+            except LinAlgError:
+                success = False
+                break
+            z_new, working, qp_iter, success = _active_set_qp(H, H_factor, g, self.A, b, z, working)
+            qp_nit += qp_iter
+            step = np.max(np.abs(z_new - z))
+            z = z_new
+            if not success:
+                break
+            if step <= self.tol:
+                converged = True
+                break
+
+        plan = z.reshape(self.ch, self.NU) * self.scale
+        predicted = self.predict(x0, plan)
+        return OptimizeResult(
+            x=plan[self.index], plan=plan, fun=self.cost(x0, u0, plan, sps), success=success,
+            status=0 if converged else 1, nit=nit, qp_nit=qp_nit, active_set=working, predicted=predicted,
+            message='Converged' if converged else 'Iteration limit reached' if success else 'QP failed'
+        )
+
+    def warm_start(self):
+        """
+        :return: np.array. 上一个周期的计划向前平移一步, shape(ch, 2), 第一个周期时保持u0
+        """
+        if self.last_plan is None:
+            return np.tile(self.u0, (self.ch, 1))
+        return np.vstack((self.last_plan[1:], self.last_plan[-1:]))
+
+    def step(self, x0, sps):
+        """
+        执行一个控制周期
+        :param x0: np.array. 当前状态的测量值(高度, 速度, 温度)
+        :param sps: float or np.array. 预测区间上的高度设定值
+        :return: np.array. 当前周期写入的输入(燃料阀, 排气阀), 求解失败时保持上一周期的输入
+        """
+        start = time.perf_counter()
+        solution = self.solve(x0, self.u0, sps, self.warm_start(), self.active_set)
+        self.solve_times.append(time.perf_counter() - start)
+        self.nits.append(solution.nit)
+        self.qp_nits.append(solution.qp_nit)
+        self.last_solution = solution
+
+        if solution.success:
+            self.last_plan = solution.plan
+            self.active_set = solution.active_set
+            self.u0 = solution.plan[0].copy()
+        else:
+            self.last_plan = self.warm_start()
+            self.active_set = []
+        return self.u0
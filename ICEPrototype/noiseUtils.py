@@ -0,0 +1,238 @@
+import numpy as np
+from scipy.signal import lfilter
+
+
+class NoiseModel:
+    """
+    可复现的测量噪声和不可测扰动
+    1. 每个通道(过程)拥有由seed派生的独立随机数流: 第i个通道使用SeedSequence(seed, spawn_key=(i,)),
+       同一个过程的序列和通道总数无关; 单通道时直接使用SeedSequence(seed)；
+    2. 随机数按块(block)预先生成, apply按下标消费, 生成的开销分摊到整个块上; 块的长度由内存预算和通道个数决定；
+    3. 每种成分使用独立的随机数流, 打开或关闭某一种成分不改变其余成分的序列; 没有打开的成分(包括dv为0的通道)不生成随机数；
+    4. 测量值 = y * (1 + dv * U(-1, 1) / 100) + 白噪声 + 有色/随机游走扰动 + 阶跃扰动。
+    """
+
+    # 每次预先生成的最大步数
+    BLOCK = 4096
+
+    # 每个预先生成的数组的内存预算(字节), 通道很多时按此缩短块的长度
+    MEMORY = 1 << 23
+
+    # 各成分在通道的SeedSequence下的编号(随机阶跃的发生时刻和幅度使用两个流, 序列和块的长度无关)
+    COMPONENTS = ('uniform', 'white', 'walk', 'steps', 'step_sizes')
+
+    def __init__(self, n=None, dv=0, white=0, walk=0, phi=1.0, steps=(), step_rate=0, step_size=0,
+                 seed=None, block=None):
+        """
+        构造函数
+        :param n: int. 通道个数, None表示单个通道(apply接受和返回标量)
+        :param dv: float or np.array. 乘性均匀扰动幅度(百分比), 同Fopdt的dv
+        :param white: float or np.array. 加性白噪声的标准差
+        :param walk: float or np.array. 有色扰动 d[t] = phi * d[t - 1] + walk * N(0, 1) 的驱动噪声标准差
+        :param phi: float. 有色扰动的自回归系数, phi = 1为随机游走, 0 <= phi <= 1
+        :param steps: list. 确定的阶跃扰动 [(时间步, 幅度), ...], 幅度可以是标量或shape(n,)
+        :param step_rate: float. 每个时间步发生随机阶跃扰动的概率
+        :param step_size: float or np.array. 随机阶跃扰动幅度的标准差
+        :param seed: int. 随机数种子, None表示不可复现
+        :param block: int. 每次预先生成的步数, None表示 min(BLOCK, MEMORY / (8 * 通道个数))
+        """
+        if not 0 <= phi <= 1:
+            raise ValueError("phi需要在[0, 1]之间!")
+        if not 0 <= step_rate <= 1:
+            raise ValueError("step_rate需要在[0, 1]之间!")
+        if block is not None and block < 1:
+            raise ValueError("block需要大于0!")
+        self.shape = () if n is None else (n,)
+        self.channels = 1 if n is None else int(n)
+        self._dv = self._channel(dv)
+        self.white = self._channel(white)
+        self.walk = self._channel(walk)
+        self.phi = float(phi)
+        self.steps = [(int(t), self._channel(amplitude)) for t, amplitude in steps]
+        self.step_rate = float(step_rate)
+        self.step_size = self._channel(step_size)
+        if block is None:
+            block = min(NoiseModel.BLOCK, max(1, NoiseModel.MEMORY // (8 * max(self.channels, 1))))
+        self.block = int(block)
+        self.seed = np.random.SeedSequence(seed).entropy
+
+        # 是否有加性成分; 没有时不生成加性扰动的数组
+        self.additive = bool(np.any(self.white) or np.any(self.walk) or self.steps or
+                             (self.step_rate and np.any(self.step_size)))
+
+        self.reset()
+
+    def _channel(self, value):
+        return np.array(np.broadcast_to(np.asarray(value, dtype=float), self.shape))
+
+    @property
+    def dv(self):
+        """
+        :return: float or np.array. 乘性均匀扰动幅度(百分比)
+        """
+        return self._dv
+
+    @dv.setter
+    def dv(self, dv):
+        # dv可以随时修改: 从0变为非0时, 在当前块中补充生成对应通道的均匀分布序列
+        self._dv = self._channel(dv)
+        self._dv_changed = True
+
+    def reset(self):
+        """
+        回到第0个时间步, 之后重新产生和构造时完全相同的序列
+        :return: none
+        """
+        self._rngs = {component: {} for component in NoiseModel.COMPONENTS}
+        # 每个通道的均匀分布序列已经生成到的时间步(跳过dv为0的时间段时, 随机数流前进相同的步数)
+        self._uniform_position = np.zeros(self.channels, dtype=int)
+        # 已经消费的时间步
+        self.t = 0
+        self._start = 0
+        self._position = self.block
+        self._walk_state = np.zeros((1, self.channels))
+        self._step_level = np.zeros(self.channels)
+        self._uniform = self._uniform_rows = None
+        self._additive_rows = None
+        self._dv_changed = False
+
+    def _rng(self, component, i):
+        """
+        :return: np.random.Generator. 第i个通道某一种成分的随机数流, 第一次使用时创建
+        """
+        rngs = self._rngs[component]
+        if i not in rngs:
+            key = (() if self.shape == () else (i,)) + (NoiseModel.COMPONENTS.index(component),)
+            rngs[i] = np.random.default_rng(np.random.SeedSequence(self.seed, spawn_key=key))
+        return rngs[i]
+
+    def _fill(self):
+        """
+        生成下一个块
+        :return: none
+        """
+        block, m = self.block, self.channels
+        self._start = self.t
+        self._position = 0
+        self._uniform = self._uniform_rows = None
+        self._uniform_filled = np.zeros(m, dtype=bool)
+        self._fill_uniform()
+
+        self._additive_rows = None
+        if not self.additive:
+            return
+        additive = np.zeros((block, m))
+        white = self.white.reshape(m)
+        for i in np.flatnonzero(white):
+            additive[:, i] += white[i] * self._rng('white', i).standard_normal(block)
+        walk = self.walk.reshape(m)
+        if np.any(walk):
+            drive = np.zeros((block, m))
+            for i in np.flatnonzero(walk):
+                drive[:, i] = walk[i] * self._rng('walk', i).standard_normal(block)
+            walk, self._walk_state = lfilter([1.0], [1.0, -self.phi], drive, axis=0, zi=self._walk_state)
+            additive += walk
+        step_size = self.step_size.reshape(m)
+        if self.step_rate and np.any(step_size):
+            jumps = np.zeros((block, m))
+            for i in np.flatnonzero(step_size):
+                occurs = self._rng('steps', i).random(block) < self.step_rate
+                jumps[:, i] = occurs * step_size[i] * self._rng('step_sizes', i).standard_normal(block)
+            levels = self._step_level + np.cumsum(jumps, axis=0)
+            self._step_level = levels[-1]
+            additive += levels
+        if self.steps:
+            index = np.arange(self._start, self._start + block)[:, None]
+            for t, amplitude in self.steps:
+                additive += (index >= t) * amplitude.reshape(m)
+        self._additive_rows = additive.reshape((block,) + self.shape)
+
+    def _fill_uniform(self):
+        """
+        为当前块中dv不为0且还没有生成的通道生成均匀分布序列
+        :return: none
+        """
+        self._dv_changed = False
+        dv = self._dv.reshape(self.channels)
+        missing = np.flatnonzero((dv != 0) & ~self._uniform_filled)
+        if not len(missing):
+            return
+        if self._uniform is None:
+            self._uniform = np.zeros((self.block, self.channels))
+            self._uniform_rows = self._uniform.reshape((self.block,) + self.shape)
+        for i in missing:
+            rng = self._rng('uniform', i)
+            skipped = self._start - self._uniform_position[i]
+            if skipped:
+                # 每个均匀分布的随机数消耗一次64位输出, 前进skipped步和逐个生成的序列一致
+                rng.bit_generator.advance(int(skipped))
+            self._uniform[:, i] = rng.uniform(-1, 1, self.block)
+            self._uniform_position[i] = self._start + self.block
+        self._uniform_filled[missing] = True
+
+    def disturbance(self):
+        """
+        :return: float or np.array. 当前时间步的加性扰动(白噪声 + 有色 + 阶跃), 不推进时间步
+        """
+        if self._position == self.block:
+            self._fill()
+        if self._additive_rows is None:
+            return np.zeros(self.shape) if self.shape else 0.0
+        return self._additive_rows[self._position]
+
+    def apply(self, y):
+        """
+        给过程输出加上当前时间步的噪声和扰动, 并推进一个时间步
+        :param y: float or np.array. 不含噪声的过程输出, shape和通道个数一致
+        :return: float or np.array. 测量值(新的对象, 不是y本身)
+        """
+        if self._position == self.block:
+            self._fill()
+        elif self._dv_changed:
+            self._fill_uniform()
+        i = self._position
+        self._position += 1
+        self.t += 1
+        if self._uniform_rows is not None:
+            y = y * (1 + self._dv * self._uniform_rows[i] / 100)
+        else:
+            y = y + 0.0
+        if self._additive_rows is not None:
+            y = y + self._additive_rows[i]
+        return y
+
+
+class NoiseStack:
+    """
+    把多个单通道NoiseModel组合为一个多通道的噪声模型(接口同NoiseModel.apply)
+    第i个通道的序列和第i个模型单独使用时逐位相同, 代价是每个时间步逐个通道调用apply
+    """
+
+    def __init__(self, models):
+        """
+        构造函数
+        :param models: list. 单通道(n = None)的NoiseModel, 模型在之后的apply中被推进
+        """
+        self.models = list(models)
+        if any(model.shape != () for model in self.models):
+            raise ValueError("NoiseStack只能组合单通道的噪声模型!")
+        self.shape = (len(self.models),)
+        self.channels = len(self.models)
+
+    @property
+    def dv(self):
+        """
+        :return: np.array. 每个通道的乘性均匀扰动幅度(百分比)
+        """
+        return np.array([model.dv for model in self.models], dtype=float)
+
+    def reset(self):
+        for model in self.models:
+            model.reset()
+
+    def apply(self, y):
+        """
+        :param y: np.array. 不含噪声的过程输出, shape(n,)
+        :return: np.array. 测量值, shape(n,)
+        """
+        return np.array([model.apply(value) for model, value in zip(self.models, y)], dtype=float)
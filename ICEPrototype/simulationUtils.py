@@ -1,27 +1,77 @@
+import itertools
 import numpy as np
 import matplotlib.pyplot as plt
-from fopdtUtils import Fopdt
+from fopdtUtils import Fopdt, FopdtBank
+from mpcControl import MpcController, MpcConfig
+
+
+class ClosedLoopResult:
+    """
+    闭环仿真的结果, 所有数组在仿真开始前预分配
+    """
+
+    def __init__(self, n_steps, ph, circle):
+        """
+        构造函数
+        :param n_steps: int. 仿真步数
+        :param ph: int. 预测区间长度
+        :param circle: float. 控制周期
+        """
+        # 第i个控制周期开始的时刻
+        self.t = np.arange(n_steps + 1) * circle
+
+        # cv[i]: 第i个周期开始时的cv测量值; uv[i]: 第i个周期写入的uv(uv[0]为初值)
+        self.cv = np.zeros(n_steps + 1)
+        self.uv = np.zeros(n_steps + 1)
+
+        # 第i个周期的设定值, cv预测轨迹, 求解耗时(秒), 迭代次数和求解是否成功
+        self.sp = np.zeros(n_steps)
+        self.predicted = np.zeros((n_steps, ph))
+        self.solve_time = np.zeros(n_steps)
+        self.nit = np.zeros(n_steps, dtype=int)
+        self.success = np.zeros(n_steps, dtype=bool)
+
 
 class SimulationUtils:
     """
     用于控制器调试和仿真测试的工具类
     1. 包含生成设定值生成器；
     2. cv测试信号模拟生成器，该生成器可以包含可调的扰动项；
-    3. 可以同时生成多个cv测试信号
+    3. 可以同时生成多个cv测试信号, 大规模仿真时使用FopdtBank向量化地推进所有回路
     """
 
     def __init__(self):
         self.cv_functions = {}
+        self.cv_bank = None
 
     def add_cv_function(self, name, fopdt):
         """
         向仿真工具的实例中增加一个cv的一阶响应函数
         :param name: cv_function的名字
-        :param fopdt: class FOPDT.
+        :param fopdt: class FOPDT. 也可以是StateSpace等提供next(uv)方法的过程模型
         :return: none
         """
         self.cv_functions[name] = fopdt
 
+    def set_cv_bank(self, bank):
+        """
+        设置仿真工具实例使用的FOPDT回路组
+        :param bank: class FopdtBank. 也可以是 名字 -> Fopdt 的dict, 会被转换为FopdtBank
+        :return: bank: FopdtBank
+        """
+        if isinstance(bank, dict):
+            bank = FopdtBank.from_fopdts(bank)
+        self.cv_bank = bank
+        return bank
+
+    def get_next_cv_values(self, uvs):
+        """
+        回路组中所有回路同时推进一个时间步
+        :param uvs: np.array or dict. 每个回路的uv, 同FopdtBank.next
+        :return: np.array. 所有回路的cv测量值, 顺序同cv_bank.names
+        """
+        return self.cv_bank.next(uvs)
+
     @staticmethod
     def create_sps(sp_numbers, times, sps):
         """
@@ -31,23 +81,144 @@ class SimulationUtils:
         :param sp_numbers: int. 整个时间序列的长度, len = n
         :return: res: np.array. 一组由设定值组成的二维数组. shape = n*2
         """
-        t_sequence = np.linspace(0, sp_numbers-1, sp_numbers)
-        sp_sequence = np.zeros(sp_numbers)
-        res = np.dstack((t_sequence, sp_sequence)).reshape((sp_numbers, 2))
-
-        sp_index = 0
-        t_index = 0
-        for t in range(0, sp_numbers):
-            if t < times[t_index]:
-                res[t][1] = sps[sp_index]
-            else:
-                sp_index += 1
-                t_index += 1
-                if t_index > len(times) - 1:
-                    t_index = len(times) - 1
-                    sp_index = len(sps) - 1
-                res[t][1] = sps[sp_index]
-        return res
+        return np.column_stack(SimulationUtils.sp_values(np.arange(sp_numbers, dtype=float), times, sps))
+
+    @staticmethod
+    def sp_values(t, times, sps, ramps=0, period=None):
+        """
+        向量化地计算任意时刻的设定值. sps[0]保持到times[0], 在times[i]时刻变为sps[i+1]
+        :param t: np.array. 需要计算设定值的时刻
+        :param times: list. 设定值变化的时间点, 递增
+        :param sps: list. 设定值的值, len(sps) = len(times) + 1 (多余的时间点沿用最后一个设定值)
+        :param ramps: float or list. 每次变化的斜坡时长, 0表示阶跃. 在[times[i], times[i] + ramps[i])内线性过渡到新值
+        :param period: float. 设定值曲线的周期, None表示不重复
+        :return: (t, values): np.array. 时刻和对应的设定值
+        """
+        t = np.asarray(t, dtype=float)
+        times = np.asarray(times, dtype=float)
+        sps = np.asarray(sps, dtype=float)
+        local_t = t if period is None else np.mod(t, period)
+
+        # 每个时刻之前最近一次变化的编号, 超出sps长度时沿用最后一个设定值
+        index = np.minimum(np.searchsorted(times, local_t, side='right'), len(sps) - 1)
+        values = sps[index]
+
+        ramps = np.broadcast_to(np.asarray(ramps, dtype=float), times.shape)
+        if np.any(ramps > 0):
+            previous = np.maximum(index - 1, 0)
+            elapsed = local_t - times[np.minimum(previous, len(times) - 1)]
+            duration = ramps[np.minimum(previous, len(times) - 1)]
+            ramping = (index > 0) & (elapsed < duration)
+            fraction = np.divide(elapsed, duration, out=np.ones_like(elapsed), where=ramping)
+            values = np.where(ramping, sps[previous] + (values - sps[previous]) * fraction, values)
+        return t, values
+
+    @staticmethod
+    def iter_sps(times, sps, chunk_size=3600, total=None, ramps=0, period=None, circle=1):
+        """
+        以生成器的形式分块生成设定值, 不需要在内存中保存整个设定值序列. 支持斜坡和周期性的设定值
+        :param times: list. 设定值变化的时间点
+        :param sps: list. 设定值的值
+        :param chunk_size: int. 每块的数据点个数
+        :param total: int. 总的数据点个数, None表示无限长
+        :param ramps: float or list. 每次变化的斜坡时长, 同sp_values
+        :param period: float. 设定值曲线的周期, None表示不重复
+        :param circle: float. 相邻数据点的时间间隔
+        :return: generator. 每次返回一块shape = (n, 2)的数组, 格式同create_sps
+        """
+        start = 0
+        while total is None or start < total:
+            end = start + chunk_size if total is None else min(start + chunk_size, total)
+            t = np.arange(start, end) * circle
+            yield np.column_stack(SimulationUtils.sp_values(t, times, sps, ramps, period))
+            start = end
+
+    @staticmethod
+    def run_closed_loop(plant, arg_dict, sps, n_steps, mode=MpcController.SLSQP, uv_low=None, uv_high=None):
+        """
+        不绘图的闭环仿真: MPC控制器(MpcController)驱动过程模型运行n_steps个控制周期
+        :param plant: 过程模型, 比如Fopdt. 需要提供next(uv)方法, 返回下一个控制周期的cv测量值. 不能是arg_dict中的model
+        :param arg_dict: MpcConfig or dict. mpc配置, 其中的cv0, uv0为仿真的初值
+        :param sps: 设定值. 可以是标量、shape(n,)的数组、create_sps返回的shape(n, 2)数组, 或者iter_sps返回的生成器.
+                    第i个周期使用第i个设定值, 数组长度不足时沿用最后一个设定值
+        :param n_steps: int. 仿真步数
+        :param mode: str. 求解方式, MpcController.SLSQP 或 MpcController.QP
+        :param uv_low: float. uv的下限, None表示使用配置中的下限
+        :param uv_high: float. uv的上限, None表示使用配置中的上限
+        :return: ClosedLoopResult
+        """
+        controller = MpcController(MpcConfig.of(arg_dict), uv_low, uv_high, mode)
+        controller.record_predictions = True
+        config = controller.config
+        if plant is config.model:
+            # 控制器把写入的uv记录到预测模型的迟滞缓冲区中, 同一个实例会使每个uv被记录两次
+            raise ValueError("过程模型(plant)和mpc配置中的预测模型(model)不能是同一个实例!")
+
+        result = ClosedLoopResult(n_steps, config.ph, config.circle)
+        result.cv[0] = cv = config.cv0
+        result.uv[0] = config.uv0
+
+        for i, sp in enumerate(itertools.islice(SimulationUtils._iter_sp_values(sps), n_steps)):
+            uv = controller.step(cv, sp)
+            cv = plant.next(uv)
+
+            result.sp[i] = sp
+            result.uv[i + 1] = uv
+            result.cv[i + 1] = cv
+            result.predicted[i] = controller.last_prediction
+            result.solve_time[i] = controller.solve_times[-1]
+            result.nit[i] = controller.nits[-1]
+            result.success[i] = controller.last_solution.success
+        return result
+
+    @staticmethod
+    def _iter_sp_values(sps):
+        """
+        把各种形式的设定值统一转换为逐个周期的设定值, 序列结束后无限沿用最后一个设定值
+        :param sps: 标量、数组、create_sps的返回值, 或者iter_sps返回的生成器
+        :return: generator. 每次返回一个float
+        """
+        if np.isscalar(sps):
+            chunks = iter(())
+            last = float(sps)
+        else:
+            chunks = iter([sps]) if isinstance(sps, (np.ndarray, list, tuple)) else sps
+            last = None
+        for chunk in chunks:
+            chunk = np.asarray(chunk, dtype=float)
+            values = chunk[:, 1] if chunk.ndim == 2 else chunk
+            for value in values:
+                yield value
+            if len(values):
+                last = values[-1]
+        if last is None:
+            raise ValueError("设定值不能为空!")
+        while True:
+            yield last
+
+    @staticmethod
+    def plot_closed_loop(result, show=True):
+        """
+        绘制闭环仿真的结果(run_closed_loop返回值的一个消费者)
+        :param result: ClosedLoopResult.
+        :param show: bool. 是否调用plt.show()
+        :return: none
+        """
+        plt.figure(figsize=(20, 8))
+        plt.subplot(2, 1, 1)
+        plt.plot(result.t, result.cv, 'r-', label='CV')
+        plt.plot(result.t[:-1], result.sp, 'b-', drawstyle='steps-post', label='SetPoint')
+        plt.ylabel('cv')
+        plt.legend()
+        plt.grid()
+        plt.subplot(2, 1, 2)
+        plt.plot(result.t, result.uv, 'g-', drawstyle='steps-post', label='MV')
+        plt.ylabel('uv')
+        plt.xlabel('time')
+        plt.legend()
+        plt.grid()
+        if show:
+            plt.show()
 
     @staticmethod
     def plot_sps(time_sp_array):
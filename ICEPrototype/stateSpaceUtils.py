@@ -0,0 +1,206 @@
+import numpy as np
+from scipy.linalg import expm, toeplitz
+from fopdtUtils import _UVStore
+from noiseUtils import NoiseModel
+from cacheUtils import CACHE, array_key
+
+
+class StateSpace:
+    """
+    单输入单输出的线性状态空间模型 dx/dt = A.dot(x) + B * u, y = C.dot(x) + D * u, 输入带迟滞theta
+    1. 零阶保持下用矩阵指数精确离散化, 结果保存在共享缓存(cacheUtils.CACHE)中, next只需要一次矩阵-向量乘法；
+    2. 接口和Fopdt相同(next, discretize, predict_horizon, predict_horizon_transpose, dynamic_matrix,
+       history_response, uv_store), 既可以作为SimulationUtils中的过程, 也可以作为MPC的预测模型；
+    3. 作为预测模型时, 模型用写入的uv(record_uv)推进内部状态, 预测值再加上测量值cv0和模型输出之差(偏置修正)。
+    """
+
+    def __init__(self, A, B, C, D=0.0, theta=0, x0=None, circle=1, dv=0, seed=None, noise=None):
+        """
+        构造函数
+        :param A: np.array. 状态矩阵, shape(n, n)
+        :param B: np.array. 输入矩阵, shape(n,)或(n, 1)
+        :param C: np.array. 输出矩阵, shape(n,)或(1, n)
+        :param D: float. 直接传递项
+        :param theta: float. 输入迟滞(时间步的个数), 可以是小数
+        :param x0: np.array. t = 0时的状态, None表示0
+        :param circle: float. next/record_uv的时间步长, 作为MPC的预测模型时和控制周期一致
+        :param dv: float. 扰动幅度(百分比), 同Fopdt
+        :param seed: int. 噪声的随机数种子
+        :param noise: NoiseModel. 测量噪声和不可测扰动, None表示只使用dv的乘性扰动
+        """
+        self.A = np.atleast_2d(np.asarray(A, dtype=float))
+        n = self.A.shape[0]
+        self.B = np.asarray(B, dtype=float).reshape(n)
+        self.C = np.asarray(C, dtype=float).reshape(n)
+        self.D = float(D)
+        if self.A.shape != (n, n):
+            raise ValueError("A需要是方阵!")
+        # 矩阵不可修改, 保证按采样周期缓存的离散化结果始终有效
+        for matrix in (self.A, self.B, self.C):
+            matrix.setflags(write=False)
+
+        self.theta = theta
+        self.uv_store = _UVStore(theta)
+        self.x = np.zeros(n) if x0 is None else np.array(x0, dtype=float).reshape(n)
+        self.t = 0
+        self.circle = circle
+
+        # 不含噪声的模型输出, 用于预测时的偏置修正
+        self.y0 = float(self.C.dot(self.x))
+
+        self.noise = NoiseModel(dv=dv, seed=seed) if noise is None else noise
+
+        # 离散化结果和预测区间上的矩阵按(A, B, C, D)的内容保存在共享缓存中
+        self._matrices_key = array_key(self.A, self.B, self.C) + (self.D,)
+
+    @staticmethod
+    def lag_chain(n, k, tau, theta=0, **kwargs):
+        """
+        n个相同一阶惯性环节的串联: 总增益k, 总时间常数tau(每个环节tau / n)
+        :param n: int. 阶数
+        :param k: float. process gain
+        :param tau: float. 总时间常数
+        :param theta: float. 输入迟滞
+        :param kwargs: 传给构造函数的其他参数
+        :return: StateSpace
+        """
+        rate = n / tau
+        A = -rate * np.eye(n) + rate * np.eye(n, k=-1)
+        B = np.zeros(n)
+        B[0] = rate * k
+        C = np.zeros(n)
+        C[-1] = 1.0
+        return StateSpace(A, B, C, 0.0, theta, **kwargs)
+
+    @property
+    def dv(self):
+        """
+        :return: float. 扰动幅度(百分比), 保存在噪声模型中
+        """
+        return self.noise.dv
+
+    @dv.setter
+    def dv(self, dv):
+        self.noise.dv = dv
+
+    @property
+    def cache_key(self):
+        """
+        :return: tuple. 模型参数, 用于缓存由模型得到的预计算结果(比如QpMPC的Hessian)
+        """
+        return ('StateSpace',) + self._matrices_key + (self.theta,)
+
+    @property
+    def k(self):
+        """
+        :return: float. 稳态增益 D - C.dot(inv(A)).dot(B)
+        """
+        return self.D - self.C.dot(np.linalg.solve(self.A, self.B))
+
+    def discretize(self, dt):
+        """
+        零阶保持下的精确离散化: x[n+1] = Ad.dot(x[n]) + Bd * u[n], 由 expm([[A, B], [0, 0]] * dt) 得到.
+        结果保存在共享缓存中, 矩阵相同的模型共用同一份结果
+        :param dt: float. 采样周期
+        :return: (Ad, Bd)
+        """
+        return CACHE.get(('statespace.discretize', self._matrices_key, dt), lambda: self._discretize(dt))
+
+    def _discretize(self, dt):
+        if not dt > 0:
+            raise ValueError("采样周期需要大于0! dt = %s" % dt)
+        n = len(self.B)
+        block = np.zeros((n + 1, n + 1))
+        block[:n, :n] = self.A
+        block[:n, n] = self.B
+        phi = expm(block * dt)
+        return phi[:n, :n], phi[:n, n]
+
+    def _horizon(self, ph, dt):
+        """
+        预测区间上的矩阵, 按(ph, dt)保存在共享缓存中
+        :return: (G, O). G: 不含迟滞的动态矩阵, shape(ph, ph); O: 自由响应, O.dot(x)[i] = C.dot(Ad^(i+1)).dot(x)
+        """
+        return CACHE.get(('statespace.horizon', self._matrices_key, ph, dt), lambda: self._build_horizon(ph, dt))
+
+    def _build_horizon(self, ph, dt):
+        Ad, Bd = self.discretize(dt)
+        n = len(Bd)
+        O = np.empty((ph, n))
+        markov = np.empty(ph)
+        row = self.C
+        for i in range(ph):
+            # markov[i] = C.dot(Ad^i).dot(Bd), O[i] = C.dot(Ad^(i+1))
+            markov[i] = row.dot(Bd)
+            row = row.dot(Ad)
+            O[i] = row
+        markov[0] += self.D
+        return np.tril(toeplitz(markov)), O
+
+    def predict_horizon(self, cv0, uvs, dt):
+        """
+        计算整个预测区间上的cv轨迹: 从当前的内部状态出发的模型响应, 加上测量值和模型输出之差
+        :param cv0: float. 预测区间开始时的cv测量值
+        :param uvs: np.array. 每个控制周期内保持不变的uv, shape(ph,) 或 shape(n, ph)(一批候选uv序列)
+        :param dt: float. 控制周期
+        :return: np.array. 每个控制周期结束时的cv预测值, shape与uvs相同
+        """
+        uvs = self.uv_store.delayed_inputs(uvs)
+        G, O = self._horizon(uvs.shape[-1], dt)
+        return cv0 - self.y0 + O.dot(self.x) + uvs.dot(G.T)
+
+    def predict_horizon_transpose(self, weights, dt):
+        """
+        predict_horizon对uvs的灵敏度矩阵的转置与weights的乘积, 同Fopdt.predict_horizon_transpose
+        :param weights: np.array. 每个控制周期cv预测值的权重, shape(ph,)
+        :param dt: float. 控制周期
+        :return: np.array. shape(ph,)
+        """
+        weights = np.asarray(weights, dtype=float)
+        G, O = self._horizon(len(weights), dt)
+        return self.uv_store.delayed_inputs_transpose(G.T.dot(weights))
+
+    def dynamic_matrix(self, ph, dt):
+        """
+        预测区间上的动态矩阵G和cv0的系数phi,
+        满足 predict_horizon(cv0, uvs, dt) = phi * cv0 + G.dot(uvs) + history_response(ph, dt)
+        :param ph: int. 预测区间长度
+        :param dt: float. 控制周期
+        :return: (G, phi). G: np.array, shape(ph, ph), 包含迟滞; phi: np.array, shape(ph,), 偏置修正下全为1
+        """
+        G, O = self._horizon(ph, dt)
+        if self.theta:
+            G = G.dot(self.uv_store.shift_matrix(ph))
+        return G, np.ones(ph)
+
+    def history_response(self, ph, dt):
+        """
+        内部状态和已经写入的历史uv在预测区间上引起的响应(cv0 = 0, 之后写入的uv都为0)
+        :param ph: int. 预测区间长度
+        :param dt: float. 控制周期
+        :return: np.array. shape(ph,)
+        """
+        return self.predict_horizon(0, np.zeros(ph), dt)
+
+    def record_uv(self, uv, time=None):
+        """
+        记录写入过程的uv, 并用它推进内部状态一个时间步(不含噪声). 作为MPC的预测模型时由控制器调用
+        :param uv: float. 当前时刻写入的uv
+        :param time: float. 时间, None表示使用内部的时间步
+        :return: float. 下一个时间步的模型输出
+        """
+        self.uv_store.save_uv(self.t if time is None else time, uv)
+        uv = self.uv_store.pop_uv()
+        Ad, Bd = self.discretize(self.circle)
+        self.x = Ad.dot(self.x) + Bd * uv
+        self.y0 = float(self.C.dot(self.x) + self.D * uv)
+        self.t += 1
+        return self.y0
+
+    def next(self, uv):
+        """
+        计算下一个时间步(经过circle)的输出
+        :param uv: float. 当前时刻写入的uv, 经过theta个时间步的迟滞后作用于过程
+        :return: y. float. 下一个时间步的输出
+        """
+        return self.noise.apply(self.record_uv(uv))
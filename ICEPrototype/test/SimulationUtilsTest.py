@@ -21,6 +21,57 @@ class SimulationUtilsTest(unittest.TestCase):
         time_sp_array = SimulationUtils.create_sps(10, [2, 5], [3, 4, 2])
         SimulationUtils.plot_sps(time_sp_array)
 
+    def test_create_sps_values(self):
+        time_sp_array = SimulationUtils.create_sps(10, [2, 5], [3, 4, 2])
+        np.testing.assert_array_equal(time_sp_array[:, 0], np.arange(10))
+        np.testing.assert_array_equal(time_sp_array[:, 1], [3, 3, 4, 4, 4, 2, 2, 2, 2, 2])
+
+    def test_iter_sps(self):
+        """
+        分块生成的设定值和一次性生成的结果一致; 支持斜坡和周期
+        """
+        chunks = list(SimulationUtils.iter_sps([15, 40], [6, 10, 4], chunk_size=7, total=60))
+        self.assertEqual(len(chunks), 9)
+        np.testing.assert_array_equal(np.concatenate(chunks), SimulationUtils.create_sps(60, [15, 40], [6, 10, 4]))
+
+        chunk = next(SimulationUtils.iter_sps([3, 6], [0, 10, 4], chunk_size=12, ramps=[2, 0], period=10))
+        np.testing.assert_array_equal(chunk[:, 1], [0, 0, 0, 0, 5, 10, 4, 4, 4, 4, 0, 0])
+
+    def test_cv_bank(self):
+        simulation = SimulationUtils()
+        bank = simulation.set_cv_bank({"TI101": Fopdt(3, 5, 0, 0, 0), "TI102": Fopdt(2, 4, 0, 0, 1)})
+        cvs = simulation.get_next_cv_values({"TI101": 1.0, "TI102": 1.0})
+        self.assertEqual(cvs.shape, (2,))
+        self.assertAlmostEqual(cvs[0], 3 * (1 - np.exp(-1 / 5)))
+        self.assertEqual(cvs[1], 0)
+        self.assertAlmostEqual(bank.get("TI101"), cvs[0])
+
+    def test_run_closed_loop(self):
+        """
+        不绘图的闭环仿真, 数组形式和生成器形式的设定值结果一致
+        """
+        results = []
+        for sps in (SimulationUtils.create_sps(60, [15, 40], [6, 10, 4]),
+                    SimulationUtils.iter_sps([15, 40], [6, 10, 4], chunk_size=7)):
+            config = {
+                "model": Fopdt(3, 5, 20, 0, 2), "ph": 30, "ch": 8, "cv0": 20.0, "uv0": 2.0, "circle": 1,
+                "u_max_move": 0.5, "sps": 6.0, "sp_cv_wight": 20, "uv_step_weight": 2
+            }
+            result = SimulationUtils.run_closed_loop(Fopdt(3, 5, 20, 0, 2), config, sps, 60, "qp", -2, 6)
+            self.assertEqual(result.cv.shape, (61,))
+            self.assertEqual(result.predicted.shape, (60, 30))
+            self.assertTrue(result.success.all())
+            self.assertTrue(np.all(np.abs(np.diff(result.uv)) <= 0.5 + 1e-9))
+            self.assertAlmostEqual(result.cv[-1], 4, places=3)
+            results.append(result)
+        np.testing.assert_allclose(results[0].uv, results[1].uv)
+        np.testing.assert_array_equal(results[0].sp, results[1].sp)
+
+        # 预测模型同时作为过程模型时迟滞会被改变
+        config["model"] = model = Fopdt(3, 5, 20, 0, 2)
+        with self.assertRaises(ValueError):
+            SimulationUtils.run_closed_loop(model, config, 6.0, 10, "qp")
+
     def test_mpc_simulation(self):
 
         # -----------------全局变量配置-----------------
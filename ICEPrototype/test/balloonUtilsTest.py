@@ -0,0 +1,73 @@
+import unittest
+import numpy as np
+from scipy.integrate import odeint
+from balloonUtils import HotAirBalloon
+
+
+class BalloonUtilsTest(unittest.TestCase):
+
+    def setUp(self):
+        fuel = np.zeros(3000)
+        fuel[200:] = 25.0
+        vent = np.zeros(3000)
+        fuel[2000:] = 0.0
+        vent[2000:] = 5.0
+        self.u = HotAirBalloon.scale_inputs(fuel, vent)
+
+    def test_simulate_matches_step_integration(self):
+        """
+        分段积分和逐步重启odeint(旧的实现)的结果一致
+        """
+        t, x = HotAirBalloon(HotAirBalloon.X_NEUTRAL).simulate(self.u)
+
+        state = np.array(HotAirBalloon.X_NEUTRAL)
+        expected = [state]
+        for k in range(len(self.u)):
+            state = odeint(HotAirBalloon.derivative, state, [t[k], t[k + 1]], tuple(self.u[k]), tfirst=True)[-1]
+            if state[0] <= 0:
+                state[:2] = 0
+            expected.append(state)
+        expected = np.array(expected)
+
+        self.assertGreater(x[:, 0].max(), 1)
+        np.testing.assert_allclose(x[:, 0], expected[:, 0], atol=1e-3)
+        np.testing.assert_allclose(x[:, 2], expected[:, 2], atol=1e-3)
+
+    def test_ground_contact(self):
+        t, x = HotAirBalloon(HotAirBalloon.X_NEUTRAL).simulate(self.u)
+        self.assertTrue(np.all(x[:, 0] >= 0))
+        # 落地之后停在地面上
+        landed = np.flatnonzero(x[2000:, 0] == 0)
+        self.assertGreater(len(landed), 0)
+        np.testing.assert_array_equal(x[2000 + landed[0]:, :2], 0)
+
+        # 燃料阀关闭时不会离开地面
+        balloon = HotAirBalloon()
+        self.assertEqual(balloon.next(0), 0)
+
+    def test_landing_with_lift(self):
+        """
+        落地时浮力已经为正: 立即重新起飞, simulate和逐步next的结果一致
+        """
+        x0 = (0.005, -0.3, 1.35)
+        self.assertGreater(HotAirBalloon.lift(np.array([0.0, 0.0, 1.35])), 0)
+        u = np.tile([0.0, 0.0], (200, 1))
+        t, x = HotAirBalloon(x0).simulate(u)
+        balloon = HotAirBalloon(x0)
+        states = [balloon.x.copy()]
+        for _ in range(len(u)):
+            balloon.next((0.0, 0.0))
+            states.append(balloon.x.copy())
+        self.assertGreater(x[:, 0].max(), 1)
+        np.testing.assert_allclose(x, states, atol=1e-6)
+
+    def test_next(self):
+        t, x = HotAirBalloon(HotAirBalloon.X_NEUTRAL).simulate(self.u[:500])
+        balloon = HotAirBalloon(HotAirBalloon.X_NEUTRAL)
+        heights = [balloon.next(u) for u in self.u[:500]]
+        np.testing.assert_allclose(heights, x[1:, 0], atol=1e-6)
+        self.assertAlmostEqual(balloon.t, 500 * balloon.dt)
+
+
+if __name__ == '__main__':
+    unittest.main()
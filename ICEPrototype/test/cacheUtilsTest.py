@@ -0,0 +1,65 @@
+import unittest
+import numpy as np
+from cacheUtils import LruCache, CACHE
+from fopdtUtils import Fopdt, FopdtBank
+from mpcControl import QpMPC
+
+
+class CacheUtilsTest(unittest.TestCase):
+
+    def test_lru(self):
+        cache = LruCache(2)
+        calls = []
+
+        def factory(value):
+            return lambda: calls.append(value) or np.full(3, value)
+
+        a = cache.get(('a',), factory(1))
+        cache.get(('b',), factory(2))
+        self.assertIs(cache.get(('a',), factory(1)), a)
+        # 容量为2, 最久未使用的'b'被淘汰
+        cache.get(('c',), factory(3))
+        self.assertNotIn(('b',), cache)
+        self.assertIn(('a',), cache)
+        self.assertEqual(calls, [1, 2, 3])
+        self.assertEqual(cache.info(), {'hits': 1, 'misses': 3, 'evictions': 1, 'size': 2, 'maxsize': 2})
+        # 缓存的数组是只读的
+        with self.assertRaises(ValueError):
+            a[0] = 0
+
+        self.assertEqual(cache.invalidate('a'), 1)
+        self.assertEqual(len(cache), 1)
+        cache.clear()
+        self.assertEqual(cache.info()['misses'], 0)
+
+    def test_shared_between_models(self):
+        CACHE.clear()
+        first, second = Fopdt(3, 5, 0, 0, 2), Fopdt(3, 5, 1, 0, 2)
+        G, phi = first.dynamic_matrix(20, 1)
+        self.assertIs(second.dynamic_matrix(20, 1)[0], G)
+        self.assertEqual(CACHE.info()['hits'], 1)
+
+        # 修改一个模型的参数只影响它自己的结果
+        second.tau = 6
+        self.assertIsNot(second.dynamic_matrix(20, 1)[0], G)
+        self.assertIs(first.dynamic_matrix(20, 1)[0], G)
+        np.testing.assert_allclose(second.discretize(1), (np.exp(-1 / 6), (1 - np.exp(-1 / 6)) * 3))
+
+        bank = FopdtBank(['a', 'b', 'c'], [3, 3, 2], [5, 5, 4], 0)
+        np.testing.assert_allclose(bank.a, np.exp(-1 / np.array([5, 5, 4])))
+        np.testing.assert_allclose(bank.b, (1 - bank.a) * [3, 3, 2])
+
+    def test_qp_matrices_shared(self):
+        config = {"model": Fopdt(3, 5, 20, 0, 1), "ph": 20, "ch": 5, "cv0": 20.0, "uv0": 2.0, "circle": 1,
+                  "u_max_move": 2, "sps": 6.0, "sp_cv_wight": 20, "uv_step_weight": 20}
+        first = QpMPC(config)
+        second = QpMPC(dict(config, model=Fopdt(3, 5, 0, 0, 1)))
+        self.assertIs(first.H_factor, second.H_factor)
+        # 权重不同时不共用
+        third = QpMPC(dict(config, model=Fopdt(3, 5, 0, 0, 1), sp_cv_wight=10))
+        self.assertIsNot(first.H, third.H)
+        np.testing.assert_allclose(first.solve().x, second.solve().x)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,212 @@
+import asyncio
+import threading
+import time
+import unittest
+import numpy as np
+from fopdtUtils import Fopdt
+from mpcControl import MpcController
+from controlRuntime import ControlRuntime
+
+
+def make_controller(cv0=0.0):
+    config = {"model": Fopdt(3, 5, cv0, 0), "ph": 20, "ch": 5, "cv0": cv0, "uv0": 0.0, "circle": 1,
+              "u_max_move": 0.5, "sps": 1.0, "sp_cv_wight": 20, "uv_step_weight": 20}
+    return MpcController(config, mode=MpcController.QP)
+
+
+class FakeClock:
+    """
+    虚拟时钟: 所有回路都在sleep时才前进到最早的唤醒时刻, 计划时刻和jitter与真实耗时无关
+    """
+
+    def __init__(self, n_loops=1):
+        self.now = 0.0
+        self.n_loops = n_loops
+        self.waiting = []
+
+    def time(self):
+        return self.now
+
+    async def sleep(self, delay):
+        future = asyncio.get_running_loop().create_future()
+        self.waiting.append((self.now + delay, future))
+        if len(self.waiting) == self.n_loops:
+            self.now = min(target for target, _ in self.waiting)
+            for target, waiter in [w for w in self.waiting if w[0] <= self.now]:
+                self.waiting.remove((target, waiter))
+                waiter.set_result(None)
+        await future
+
+
+class BlockingController(MpcController):
+    """
+    第block次求解阻塞到release被设置的控制器, 记录apply是否和求解同时进行
+    """
+
+    def __init__(self, block):
+        super().__init__(make_controller().config, mode=MpcController.QP)
+        self.block, self.calls = block, 0
+        self.release = threading.Event()
+        self.solving = False
+        self.overlapped = False
+        self.blocked_time = None
+
+    def solve(self, cv0, sps=None):
+        self.calls += 1
+        self.solving = True
+        started = time.perf_counter()
+        try:
+            if self.calls == self.block:
+                self.release.wait()
+                self.blocked_time = time.perf_counter() - started
+            return super().solve(cv0, sps)
+        finally:
+            self.solving = False
+
+    def apply(self, solution, cv0=None, fallback=None):
+        self.overlapped = self.overlapped or self.solving
+        return super().apply(solution, cv0, fallback)
+
+
+class FailingController(MpcController):
+    """
+    第fail次求解抛出异常的控制器
+    """
+
+    def __init__(self, fail):
+        super().__init__(make_controller().config, mode=MpcController.QP)
+        self.fail, self.calls = fail, 0
+
+    def solve(self, cv0, sps=None):
+        self.calls += 1
+        if self.calls == self.fail:
+            raise RuntimeError("solver failed")
+        return super().solve(cv0, sps)
+
+
+def add_plant_loop(runtime, name, controller, cycle=1.0, read=None, **options):
+    plant = Fopdt(3, 5, 0, 0)
+    written = []
+
+    async def read_cv():
+        if read is not None:
+            await read(len(written))
+        return plant.y0
+
+    def write_uv(uv):
+        written.append(uv)
+        plant.next(uv)
+
+    runtime.add_loop(name, controller, read_cv, write_uv, cycle, **options)
+    return plant, written
+
+
+class ControlRuntimeTest(unittest.TestCase):
+
+    def test_concurrent_loops(self):
+        clock = FakeClock(n_loops=2)
+        runtime = ControlRuntime(clock=clock)
+        loops = {name: add_plant_loop(runtime, name, make_controller(), sps=sp)
+                 for name, sp in (('a', 1.0), ('b', -2.0))}
+        n_cycles = 40
+        stats = asyncio.run(runtime.run(n_cycles=n_cycles))
+        runtime.close()
+
+        # 计划时刻固定为 t0 + n * cycle: 最后一个周期在(n - 1) * cycle开始, 没有跳过的周期和jitter
+        self.assertEqual(clock.now, n_cycles - 1)
+        for name, sp in (('a', 1.0), ('b', -2.0)):
+            plant, written = loops[name]
+            self.assertEqual(stats[name]['cycles'], n_cycles)
+            self.assertEqual(stats[name]['skipped'], 0)
+            self.assertEqual(stats[name]['max_jitter'], 0.0)
+            self.assertEqual(len(written), n_cycles)
+            self.assertEqual(len(runtime.loops[name].controller.nits), n_cycles)
+            self.assertAlmostEqual(plant.y0, sp, delta=0.05)
+
+    def test_skip_late_cycles(self):
+        clock = FakeClock()
+        runtime = ControlRuntime(clock=clock)
+
+        async def read(n):
+            # 第5个周期阻塞了2.5个周期
+            if n == 5:
+                clock.now += 2.5
+
+        controller = make_controller()
+        _, written = add_plant_loop(runtime, 'late', controller, read=read, sps=1.0)
+        stats = asyncio.run(runtime.run(n_cycles=20))['late']
+        runtime.close()
+
+        # 第6个周期被跳过, 第7个周期在7.5 * cycle开始, 之后重新对齐
+        self.assertEqual(stats['skipped'], 1)
+        self.assertEqual(stats['cycles'] + stats['skipped'], 20)
+        self.assertEqual(len(written), stats['cycles'])
+        self.assertEqual(len(controller.nits), stats['cycles'])
+        self.assertEqual(runtime.loops['late'].stats.jitters[6], 0.5)
+        self.assertEqual(runtime.loops['late'].stats.jitters[7], 0.0)
+        # 第5个周期读取cv时已经超过截止时间
+        self.assertGreaterEqual(stats['missed'], 1)
+        self.assertEqual(controller.solve_times[5], 0.0)
+
+    def test_fallback_on_overrun(self):
+        clock = FakeClock()
+        runtime = ControlRuntime(clock=clock)
+        controller = BlockingController(block=6)
+        plans = []
+
+        async def read(n):
+            plans.append(controller.last_uvs)
+            if n == 5:
+                # 第5个周期的求解在截止时间之后才开始, 并且一直阻塞到第8个周期
+                clock.now += 0.6
+            elif n == 8:
+                controller.release.set()
+                while not runtime.loops['slow'].pending.done():
+                    await asyncio.sleep(0.001)
+
+        _, written = add_plant_loop(runtime, 'slow', controller, read=read, sps=1.0, deadline=0.5,
+                                    fallback=MpcController.SHIFT)
+        stats = asyncio.run(runtime.run(n_cycles=30))['slow']
+        runtime.close()
+
+        self.assertFalse(controller.overlapped)
+        self.assertEqual(stats['failed'], 0)
+        self.assertEqual(stats['skipped'], 0)
+        self.assertEqual(len(controller.nits), 30)
+        missed = [i for i, solve_time in enumerate(controller.solve_times) if solve_time == 0.0]
+        self.assertEqual(len(missed), stats['missed'])
+        self.assertEqual(missed, [5, 6, 7, 8])
+
+        # 超时的求解完成前控制器保持不变, 写入的uv依次取第5个周期开始时计划的后续uv
+        for j, i in enumerate(missed):
+            np.testing.assert_array_equal(plans[i], plans[5])
+            self.assertEqual(written[i], plans[5][min(j + 1, len(plans[5]) - 1)])
+        # 超时的求解按实际耗时计入统计, 每次求解一条
+        self.assertEqual(len(runtime.loops['slow'].stats.solve_times), controller.calls)
+        self.assertGreaterEqual(stats['max_solve_time'], controller.blocked_time)
+        # 求解完成后补上推迟的apply, 计划和写入的uv一致
+        np.testing.assert_array_equal(plans[9], np.append(plans[5][4:], [plans[5][-1]] * 4))
+
+    def test_failed_cycle(self):
+        clock = FakeClock(n_loops=2)
+        runtime = ControlRuntime(clock=clock)
+        failing = FailingController(fail=3)
+        _, failed_written = add_plant_loop(runtime, 'failing', failing, sps=1.0)
+        _, written = add_plant_loop(runtime, 'ok', make_controller(), sps=1.0)
+        with self.assertLogs('controlRuntime', 'ERROR'):
+            stats = asyncio.run(runtime.run(n_cycles=10))
+        runtime.close()
+
+        # 抛出异常的周期保持uv, 回路继续运行, 其他回路不受影响
+        self.assertEqual(stats['failing']['failed'], 1)
+        self.assertEqual(stats['failing']['missed'], 0)
+        self.assertEqual(stats['ok']['failed'], 0)
+        self.assertEqual(len(failed_written), 10)
+        self.assertEqual(len(written), 10)
+        self.assertEqual(failed_written[2], failed_written[1])
+        self.assertEqual(failing.solve_times[2], 0.0)
+        self.assertEqual(failing.calls, 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+from fopdtUtils import Fopdt
+from explicitMpc import ExplicitMPC
+
+
+class ExplicitMpcTest(unittest.TestCase):
+
+    def setUp(self):
+        config = {
+            "model": Fopdt(3, 5, 20, 0, 0),
+            "ph": 20,
+            "ch": 3,
+            "cv0": 20.0,
+            "uv0": 2.0,
+            "circle": 1,
+            "u_max_move": 0.5,
+            "sps": 6.0,
+            "sp_cv_wight": 20,
+            "uv_step_weight": 2
+        }
+        self.explicit = ExplicitMPC.build(config, (0, 30), (-2, 6), (0, 15), n_grid=7, uv_low=-1.5, uv_high=5)
+
+    def test_explicit_law_matches_online_solver(self):
+        """
+        显式控制律的结果应当和在线求解的结果一致
+        """
+        self.assertGreater(len(self.explicit.laws), 1)
+        rng = np.random.default_rng(1)
+        hits = 0
+        for _ in range(200):
+            theta = rng.uniform([0, -1.5, 0], [30, 5, 15])
+            solution = self.explicit.solve(*theta)
+            online = self.explicit.fallback.solve(*theta)
+            self.assertTrue(solution.success)
+            np.testing.assert_allclose(solution.x, online.x, atol=1e-8)
+            hits += solution.region >= 0
+        self.assertGreater(hits, 150)
+
+        # 参数空间以外退回到在线求解
+        self.assertEqual(self.explicit.solve(100, 2, 5).region, -1)
+
+    def test_save_and_load(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'explicit.npz')
+            self.explicit.save(path)
+            loaded = ExplicitMPC.load(path)
+
+        for theta in ([10, 1, 5], [25, 4, 2], [3, -1, 12]):
+            np.testing.assert_allclose(loaded.solve(*theta).x, self.explicit.solve(*theta).x)
+
+
+if __name__ == '__main__':
+    unittest.main()
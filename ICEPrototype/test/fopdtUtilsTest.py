@@ -1,5 +1,7 @@
+import copy
 import unittest
-from fopdtUtils import Fopdt
+from fopdtUtils import Fopdt, FopdtBank, _UVStore
+from noiseUtils import NoiseModel
 import matplotlib.pyplot as plt
 from scipy.interpolate import interp1d
 from matplotlib.pyplot import MultipleLocator
@@ -37,7 +39,7 @@ class FopdtUtilsTest(unittest.TestCase):
         for i in range(1, ns + 1):
             ts = [delta_t * (i - 1), delta_t * i]
             y1 = odeint(self.demo_fopdt, ym[i - 1], ts, args=(uv_function, Km, taum, thetam))
-            ym[i] = y1[-1]
+            ym[i] = y1[-1, 0]
         return ym
 
     def test_solve_fopdt(self):
@@ -62,6 +64,8 @@ class FopdtUtilsTest(unittest.TestCase):
         fopdt2 = Fopdt(k, tau, y0, dv, theta2)
         y1 = fopdt1.solve_sequence_fopdt(t, u, y0)
         y2 = fopdt2.solve_sequence_fopdt(t, u, y0)
+        # 迟滞相差theta1 - theta2个周期
+        np.testing.assert_allclose(y1[theta1 - theta2:], y2[:theta2 - theta1])
 
         # ---------------Demo的曲线-------------------
         theta3 = 4
@@ -101,6 +105,144 @@ class FopdtUtilsTest(unittest.TestCase):
         y = fopdt.solve_step_fopdt(1, 2, y0, 2)
         print("test_solve_step_fopdt finished y = %f" % y)
 
+    def test_analytic_matches_odeint(self):
+        """
+        解析解和odeint数值解应当一致
+        """
+        fopdt = Fopdt(3, 5, 1, 0, 0)
+        for uv in [-2, 0, 0.5, 4]:
+            y_analytic = fopdt.solve_step_fopdt(1, 2.5, 1, uv)
+            y_odeint = fopdt.solve_step_fopdt(1, 2.5, 1, uv, Fopdt.ODEINT)
+            self.assertAlmostEqual(y_analytic, y_odeint, places=6)
+
+        t = np.linspace(0, 30, 31)
+        u = np.zeros(31)
+        u[5:] = 1.0
+        y_analytic = Fopdt.solve_sequence_no_delay(fopdt, t, u, 0)
+        y_odeint = Fopdt.solve_sequence_no_delay(fopdt, t, u, 0, Fopdt.ODEINT)
+        np.testing.assert_allclose(y_analytic, y_odeint, atol=1e-6)
+        # theta = 0时实例方法的结果相同
+        y_instance = Fopdt(3, 5, 1, 0, 0).solve_sequence_fopdt(t, u, 0, Fopdt.ODEINT)
+        np.testing.assert_allclose(y_instance, y_odeint, atol=1e-6)
+
+    def test_predict_horizon(self):
+        """
+        predict_horizon应当和逐步求解的结果一致
+        """
+        fopdt = Fopdt(2.5, 3, 0, 0, 0)
+        uvs = np.array([1.0, 1.0, 2.0, -1.0, 0.0, 3.0])
+        expected = []
+        y = 4.0
+        for i, uv in enumerate(uvs):
+            y = fopdt.solve_step_fopdt(2 * i, 2 * (i + 1), y, uv)
+            expected.append(y)
+        np.testing.assert_allclose(fopdt.predict_horizon(4.0, uvs, 2), expected)
+
+        G, phi = fopdt.dynamic_matrix(len(uvs), 2)
+        np.testing.assert_allclose(phi * 4.0 + G.dot(uvs), expected)
+
+    def test_uv_store(self):
+        """
+        环形缓冲区: 整数迟滞、小数迟滞和theta = 0
+        """
+        store = _UVStore(3)
+        delayed = []
+        for i in range(1, 8):
+            store.save_uv(i, i)
+            delayed.append(store.pop_uv())
+        self.assertEqual(delayed, [0, 0, 0, 1, 2, 3, 4])
+        np.testing.assert_array_equal(store.history(4), [4, 5, 6, 7])
+
+        store = _UVStore(1.25)
+        for i in range(1, 5):
+            store.save_uv(i, i)
+        self.assertAlmostEqual(store.pop_uv(), 0.75 * 3 + 0.25 * 2)
+
+        store = _UVStore(0)
+        store.save_uv(0, 5)
+        self.assertEqual(store.pop_uv(), 5)
+
+    def test_predict_horizon_with_dead_time(self):
+        """
+        带(小数)迟滞时, predict_horizon应当和逐步调用next的结果一致, 并和动态矩阵、转置保持一致
+        """
+        fopdt = Fopdt(2, 4, 1, 0, 3.5)
+        for uv in [1, 2, 2, 3, 0, 1]:
+            fopdt.next(uv)
+        uvs = np.array([4.0, 4.0, 1.0, 2.0, 2.0, 5.0, 0.0, 1.0])
+
+        plant = copy.deepcopy(fopdt)
+        expected = [plant.next(uv) for uv in uvs]
+        np.testing.assert_allclose(fopdt.predict_horizon(fopdt.y0, uvs, 1), expected)
+
+        G, phi = fopdt.dynamic_matrix(len(uvs), 1)
+        np.testing.assert_allclose(phi * fopdt.y0 + G.dot(uvs) + fopdt.history_response(len(uvs), 1), expected)
+
+        weights = np.arange(len(uvs), dtype=float)
+        np.testing.assert_allclose(fopdt.predict_horizon_transpose(weights, 1), G.T.dot(weights))
+
+    def test_fopdt_bank(self):
+        """
+        FopdtBank向量化推进的结果应当和逐个调用Fopdt.next一致
+        """
+        fopdts = {"a": Fopdt(3, 5, 1, 0, 0), "b": Fopdt(2, 3, 0, 0, 2.5), "c": Fopdt(1, 7, 4, 0, 4)}
+        bank = FopdtBank.from_fopdts(fopdts)
+        rng = np.random.default_rng(0)
+        for _ in range(20):
+            uvs = rng.normal(size=3)
+            expected = [fopdt.next(uv) for fopdt, uv in zip(fopdts.values(), uvs)]
+            np.testing.assert_allclose(bank.next(uvs), expected)
+
+        # 按名字访问, 没有给出的回路保持上一次的uv
+        bank.next({"b": 1.0})
+        fopdts["a"].next(uvs[0])
+        self.assertAlmostEqual(bank.get("a"), fopdts["a"].y0)
+        self.assertEqual(bank.index("c"), 2)
+
+        bank.set_params("a", tau=10)
+        self.assertAlmostEqual(bank.a[0], np.exp(-1 / 10))
+
+        # 保存的uv是副本, 调用方之后修改数组不影响bank
+        uvs = np.ones(3)
+        bank.next(uvs)
+        uvs[:] = 5
+        np.testing.assert_array_equal(bank.last_uvs, 1)
+
+    def test_bank_from_running_fopdts(self):
+        """
+        由已经运行过的Fopdt创建的FopdtBank带上uv历史和噪声模型, 之后的输出和各Fopdt.next逐位相同
+        """
+        fopdts = {"a": Fopdt(3, 5, 1, 5, 0, seed=1), "b": Fopdt(2, 3, 0, 0, 2.5),
+                  "c": Fopdt(1, 7, 4, 0, 4, noise=NoiseModel(white=0.1, walk=0.05, seed=2))}
+        rng = np.random.default_rng(0)
+        for _ in range(7):
+            for fopdt, uv in zip(fopdts.values(), rng.normal(size=3)):
+                fopdt.next(uv)
+        bank = FopdtBank.from_fopdts(fopdts)
+        np.testing.assert_array_equal(bank.dv, [5, 0, 0])
+        for _ in range(20):
+            uvs = rng.normal(size=3)
+            measured = bank.next(uvs)
+            expected = [fopdt.next(uv) for fopdt, uv in zip(fopdts.values(), uvs)]
+            np.testing.assert_allclose(measured, expected, rtol=1e-12)
+
+        with self.assertRaises(ValueError):
+            FopdtBank.from_fopdts({"a": Fopdt(3, 5, 1, 0, method=Fopdt.ODEINT)})
+
+    def test_seeded_noise(self):
+        """
+        相同seed的过程仿真结果逐位相同
+        """
+        fopdt1 = Fopdt(3, 5, 1, 5, 2, seed=11)
+        fopdt2 = Fopdt(3, 5, 1, 5, 2, seed=11)
+        self.assertEqual([fopdt1.next(2) for _ in range(50)], [fopdt2.next(2) for _ in range(50)])
+
+        bank1 = FopdtBank.from_fopdts({"a": Fopdt(3, 5, 1, 5), "b": Fopdt(2, 4, 0, 1, 1.5)}, seed=11)
+        bank2 = FopdtBank.from_fopdts({"a": Fopdt(3, 5, 1, 5), "b": Fopdt(2, 4, 0, 1, 1.5)}, seed=11)
+        for _ in range(50):
+            np.testing.assert_array_equal(bank1.next([1, 2]), bank2.next([1, 2]))
+        np.testing.assert_array_equal(bank1.dv, [5, 1])
+
     def test_next(self):
         y0 = 1
         k = 3
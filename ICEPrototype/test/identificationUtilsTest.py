@@ -0,0 +1,124 @@
+import unittest
+import numpy as np
+from fopdtUtils import Fopdt
+from identificationUtils import FopdtIdentification, RecursiveFopdtEstimator
+from mpcControl import MpcController
+
+
+class IdentificationUtilsTest(unittest.TestCase):
+
+    def test_simulate_matches_fopdt(self):
+        """
+        辨识使用的仿真和Fopdt.next一致(包括小数迟滞)
+        """
+        uv = np.zeros(40)
+        uv[5:] = 1.0
+        uv[25:] = -0.5
+        fopdt = Fopdt(3, 5, 0, 0, 2.4)
+        expected = [0.0] + [fopdt.next(u) for u in uv[:-1]]
+        np.testing.assert_allclose(FopdtIdentification.simulate(uv, 3, 5, 2.4), expected, atol=1e-12)
+
+    def test_fit(self):
+        rng = np.random.default_rng(0)
+        uv = 10 + np.zeros(60)
+        uv[5:] = 12
+        cv = 50 + FopdtIdentification.simulate(uv - 10, 1.5, 8, 6.5, 0.5) + rng.normal(0, 0.01, 60)
+        result = FopdtIdentification.fit(uv, cv, dt=0.5)
+        self.assertTrue(result.success)
+        self.assertAlmostEqual(result.k, 1.5, delta=0.02)
+        self.assertAlmostEqual(result.tau, 8, delta=0.3)
+        self.assertAlmostEqual(result.theta, 6.5, delta=0.2)
+        self.assertGreater(result.r2, 0.99)
+        self.assertAlmostEqual(result.cv_bias, 50, delta=0.01)
+
+        # 返回的Fopdt以采样周期为时间单位
+        self.assertAlmostEqual(result.fopdt.tau, result.tau / 0.5)
+        self.assertAlmostEqual(result.fopdt.theta, result.theta / 0.5)
+
+    def test_fit_many(self):
+        uv = np.zeros(50)
+        uv[3:] = 1.0
+        tags = {
+            'TI-101': (uv, FopdtIdentification.simulate(uv, 2, 4, 3)),
+            'TI-102': (uv, FopdtIdentification.simulate(uv, -1, 10, 0)),
+            'TI-103': (np.zeros(50), np.zeros(50)),
+            # 不能转换为数组的数据: TypeError
+            'TI-104': ({}, {})
+        }
+        results = FopdtIdentification.fit_many(tags, processes=2)
+        self.assertEqual(list(results), list(tags))
+        np.testing.assert_allclose([results['TI-101'].k, results['TI-101'].tau, results['TI-101'].theta],
+                                   [2, 4, 3], atol=1e-4)
+        self.assertAlmostEqual(results['TI-102'].k, -1, places=4)
+        self.assertFalse(results['TI-103'].success)
+        self.assertFalse(results['TI-104'].success)
+        self.assertTrue(results['TI-104'].message.startswith('TypeError'))
+
+    def test_recursive_estimator(self):
+        """
+        递推估计收敛到过程的真实参数, 模型经过限速后分几次写回
+        """
+        rng = np.random.default_rng(1)
+        plant = Fopdt(3, 5, 10, 0, 2)
+        model = Fopdt(2, 8, 0, 0, 2)
+        updates = []
+        estimator = RecursiveFopdtEstimator(model, on_update=updates.append)
+
+        cv = plant.y0
+        uv = 0.0
+        pushes = 0
+        for n in range(600):
+            if n % 15 == 0:
+                uv = rng.choice([-1.0, 1.0])
+            pushes += estimator.update(uv, cv + rng.normal(0, 0.01))
+            cv = plant.next(uv)
+
+        self.assertAlmostEqual(estimator.k, 3, delta=0.05)
+        self.assertAlmostEqual(estimator.tau, 5, delta=0.2)
+        self.assertAlmostEqual(model.k, 3, delta=0.15)
+        self.assertAlmostEqual(model.tau, 5, delta=0.25)
+        # 限速: 从tau = 8到5至少需要几次写回, 之后参数稳定时不再写回
+        self.assertEqual(pushes, len(updates))
+        self.assertGreaterEqual(len(updates), 4)
+        self.assertLess(len(updates), 20)
+        self.assertTrue(all(m is model for m in updates))
+
+    def test_recursive_estimator_from_zero_gain(self):
+        """
+        从k = 0出发的模型也能收敛
+        """
+        rng = np.random.default_rng(2)
+        plant = Fopdt(3, 5, 0, 0, 1)
+        model = Fopdt(0, 5, 0, 0, 1)
+        estimator = RecursiveFopdtEstimator(model)
+        cv, uv = plant.y0, 0.0
+        for n in range(600):
+            if n % 15 == 0:
+                uv = rng.choice([-1.0, 1.0])
+            estimator.update(uv, cv)
+            cv = plant.next(uv)
+        self.assertAlmostEqual(model.k, 3, delta=0.15)
+
+    def test_estimator_rebuilds_controller(self):
+        config = {
+            "model": Fopdt(2, 8, 0, 0, 0), "ph": 20, "ch": 5, "circle": 1, "cv0": 0.0, "uv0": 0.0,
+            "u_max_move": 1, "sps": 0.0, "sp_cv_wight": 20, "uv_step_weight": 5
+        }
+        controller = MpcController(config, -5, 5, mode=MpcController.QP)
+        estimator = RecursiveFopdtEstimator.for_controller(controller, min_samples=10)
+        plant = Fopdt(3, 5, 0, 0, 0)
+        cv = 0.0
+        for n in range(200):
+            uv = controller.step(cv, 2.0 if n % 60 < 30 else -2.0)
+            estimator.update(uv, cv)
+            cv = plant.next(uv)
+
+        self.assertGreater(estimator.n_updates, 0)
+        # 控制器的动态矩阵和更新后的模型一致
+        G, phi = controller.config.model.dynamic_matrix(20, 1)
+        np.testing.assert_allclose(controller.qp.phi, phi)
+        self.assertAlmostEqual(controller.qp.model.k, estimator.fopdt.k)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+import json
+import os
+import pickle
+import tempfile
+import unittest
+from fopdtUtils import Fopdt
+from mpcControl import MPC, MpcController
+from metricsUtils import Metrics, Histogram
+
+
+def run_loop(mode, n_cycles=5):
+    config = {"model": Fopdt(3, 5, 0, 0), "ph": 20, "ch": 5, "cv0": 0.0, "uv0": 0.0, "circle": 1,
+              "u_max_move": 0.5, "sps": 1.0, "sp_cv_wight": 20, "uv_step_weight": 2}
+    controller = MpcController(config, mode=mode)
+    plant = Fopdt(3, 5, 0, 0)
+    cv = 0.0
+    for _ in range(n_cycles):
+        cv = plant.next(controller.step(cv))
+    return controller
+
+
+class MetricsUtilsTest(unittest.TestCase):
+
+    def test_cycle_records(self):
+        metrics = Metrics()
+        with metrics:
+            controller = run_loop(MpcController.SLSQP)
+        records = metrics.export()
+        self.assertEqual(len(records), 5)
+        for i, record in enumerate(records):
+            self.assertEqual(record['cycle'], i)
+            self.assertEqual(record['nit'], controller.nits[i])
+            self.assertGreater(record['cost_evals'], 0)
+            self.assertGreater(record['gradient_evals'], 0)
+            self.assertGreater(record['time_solve'], 0)
+            self.assertGreaterEqual(record['time_build'], 0)
+            self.assertTrue(record['success'])
+        self.assertEqual(records[-1]['fun'], controller.last_solution.fun)
+
+        summary = metrics.summary()
+        # 5个周期的cost计算都在记录中, 过程仿真的5个单步只计入总数
+        self.assertEqual(summary['counters']['cost_evals'], sum(r['cost_evals'] for r in records))
+        self.assertEqual(summary['counters']['model_steps'], 5)
+        self.assertEqual(summary['histograms']['time.solve']['n'], 5)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'metrics.jsonl')
+            metrics.export(path)
+            with open(path) as f:
+                self.assertEqual([json.loads(line) for line in f], json.loads(json.dumps(records)))
+
+    def test_disable_restores_methods(self):
+        function, solve = MPC.__dict__['batch_cost_function'], MpcController.solve
+        metrics = Metrics().enable()
+        self.assertIsNot(MPC.__dict__['batch_cost_function'], function)
+        metrics.disable()
+        self.assertIs(MPC.__dict__['batch_cost_function'], function)
+        self.assertIs(MpcController.solve, solve)
+
+        # 关闭时不收集
+        run_loop(MpcController.QP, 2)
+        self.assertEqual(metrics.summary()['counters'], {})
+
+    def test_single_active_collector(self):
+        function = MPC.__dict__['batch_cost_function']
+        first, second = Metrics(), Metrics()
+        with first:
+            with self.assertRaises(RuntimeError):
+                second.enable()
+            # 未开启的Metrics调用disable()不影响正在收集的Metrics
+            second.disable()
+            self.assertIsNot(MPC.__dict__['batch_cost_function'], function)
+        self.assertIs(MPC.__dict__['batch_cost_function'], function)
+        with second:
+            run_loop(MpcController.QP, 2)
+        self.assertEqual(len(second.records), 2)
+        self.assertEqual(len(first.records), 0)
+
+    def test_merge(self):
+        first, second = Metrics(), Metrics()
+        with first:
+            run_loop(MpcController.QP, 3)
+        with second:
+            run_loop(MpcController.QP, 4)
+        n_steps = first.counters['model_steps'] + second.counters['model_steps']
+        first.merge(second)
+        self.assertEqual(len(first.records), 7)
+        self.assertEqual(first.counters['model_steps'], n_steps)
+        self.assertEqual(first.histograms['time.post'].n, 7)
+
+        # 其他进程的结果经过pickle或JSON传递后合并
+        merged = Metrics()
+        merged.merge(pickle.loads(pickle.dumps(first)))
+        merged.merge(Metrics.from_dict(json.loads(json.dumps(second.to_dict()))))
+        self.assertEqual(merged.counters['model_steps'], n_steps + second.counters['model_steps'])
+        self.assertEqual(len(merged.records), 11)
+        self.assertEqual(merged.histograms['time.post'].n, 11)
+        self.assertEqual(merged.histograms['nit'].counts, [a + b for a, b in zip(
+            first.histograms['nit'].counts, second.histograms['nit'].counts)])
+        self.assertFalse(pickle.loads(pickle.dumps(merged)).enabled)
+
+        histogram = Histogram(Histogram.COUNT_EDGES)
+        for value in range(100):
+            histogram.add(value)
+        self.assertEqual(histogram.quantile(0.5), 64)
+        self.assertEqual(sum(histogram.counts), 100)
+        with self.assertRaises(ValueError):
+            histogram.merge(Histogram(Histogram.TIME_EDGES))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+import unittest
+import numpy as np
+from fopdtUtils import Fopdt
+from mimoControl import MimoMPC
+
+
+def make_matrix(params, uv0):
+    """
+    按参数表构造传递函数矩阵, 初始时处于uv0下的稳态
+    :param params: list. params[i][j]为(k, tau, theta)或None
+    """
+    matrix = []
+    for row in params:
+        matrix.append([])
+        for j, p in enumerate(row):
+            if p is None:
+                matrix[-1].append(None)
+                continue
+            model = Fopdt(p[0], p[1], p[0] * uv0[j], 0, p[2])
+            model.uv_store.values[:] = uv0[j]
+            matrix[-1].append(model)
+    return matrix
+
+
+class Plant:
+    """
+    用一组Fopdt逐个通道仿真的MIMO过程
+    """
+
+    def __init__(self, params, uv0):
+        self.matrix = make_matrix(params, uv0)
+
+    def next(self, uvs):
+        return np.array([sum(model.next(uvs[j]) for j, model in enumerate(row) if model is not None)
+                         for row in self.matrix])
+
+
+PARAMS = [[(2.0, 5.0, 1), None, (-0.5, 3.0, 0)],
+          [(0.4, 8.0, 2), (1.5, 4.0, 0), None]]
+
+
+class MimoMPCTest(unittest.TestCase):
+
+    def test_sparse_channels(self):
+        matrix = make_matrix(PARAMS, [0, 0, 0])
+        matrix[0][1] = 0
+        controller = MimoMPC(matrix, 20, 5, 1)
+        self.assertEqual(len(controller.channels), 4)
+        self.assertEqual([(i, j) for i, j, model in controller.channels], [(0, 0), (0, 2), (1, 0), (1, 1)])
+        with self.assertRaises(ValueError):
+            MimoMPC([[matrix[0][0], matrix[0][0]]], 20, 5, 1)
+        with self.assertRaises(ValueError):
+            MimoMPC(matrix, 20, 5, 1, cv_weights=[1, 2, 3])
+
+    def test_prediction_matches_plant(self):
+        uv0 = np.array([1.0, -0.5, 2.0])
+        plant = Plant(PARAMS, uv0)
+        controller = MimoMPC(make_matrix(PARAMS, uv0), 25, 25, 1, uv0=uv0)
+        cv0 = plant.next(uv0)
+        # 先运行几个周期, 让迟滞缓冲区和通道状态包含历史uv
+        for k in range(6):
+            controller.uv0 = uv0 + 0.3 * np.sin(k + np.arange(3))
+            uv = controller.uv0.copy()
+            for c, (i, j, model) in enumerate(controller.channels):
+                model.record_uv(uv[j], k)
+                a, b = model.discretize(1)
+                controller.states[c] = a * controller.states[c] + b * model.uv_store.pop_uv()
+            cv0 = plant.next(uv)
+        uvs = np.cos(np.arange(25)[None, :] / 4 + np.arange(3)[:, None])
+        np.testing.assert_allclose(controller.predict(cv0, uvs), np.array([plant.next(u) for u in uvs.T]).T)
+
+    def test_diagonal_matches_independent_loops(self):
+        """
+        对角矩阵的MIMO控制器和分别控制每个回路的结果一致
+        """
+        params = [[(2.0, 5.0, 1), None], [None, (1.5, 4.0, 0)]]
+        options = dict(cv_weights=[1.0, 3.0], move_weights=[0.5, 2.0], u_max_move=[0.2, 0.1], uv_low=-1, uv_high=1)
+        mimo = MimoMPC(make_matrix(params, [0, 0]), 20, 5, 1, **options)
+        loops = [MimoMPC([[model]], 20, 5, 1, cv_weights=options['cv_weights'][i],
+                         move_weights=options['move_weights'][i], u_max_move=options['u_max_move'][i],
+                         uv_low=-1, uv_high=1)
+                 for i, model in enumerate(model for row in make_matrix(params, [0, 0]) for model in row if model)]
+        cv0 = np.zeros(2)
+        plant = Plant(params, [0, 0])
+        for k in range(15):
+            uv = mimo.step(cv0, [1.0, -0.5])
+            np.testing.assert_allclose(uv, [loops[0].step(cv0[:1], 1.0)[0], loops[1].step(cv0[1:], -0.5)[0]],
+                                       atol=1e-8)
+            cv0 = plant.next(uv)
+
+    def test_closed_loop_coupled(self):
+        uv0 = np.zeros(3)
+        plant = Plant(PARAMS, uv0)
+        controller = MimoMPC(make_matrix(PARAMS, uv0), 30, 8, 1, cv_weights=[1.0, 2.0],
+                             move_weights=[0.1, 0.1, 0.5], u_max_move=0.5, uv_low=-3, uv_high=3)
+        sps = np.array([1.0, -1.0])
+        cv0 = np.zeros(2)
+        for k in range(60):
+            uv = controller.step(cv0, sps)
+            self.assertTrue(np.all(np.abs(uv) <= 3 + 1e-9))
+            cv0 = plant.next(uv)
+        np.testing.assert_allclose(cv0, sps, atol=1e-3)
+        self.assertTrue(controller.last_solution.success)
+
+
+if __name__ == '__main__':
+    unittest.main()
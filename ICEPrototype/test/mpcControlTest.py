@@ -1,7 +1,7 @@
 import unittest
-from mpcControl import MPC
+from mpcControl import MPC, QpMPC, MpcController, MpcConfig
 from fopdtUtils import Fopdt
-from scipy.optimize import minimize
+from scipy.optimize import minimize, approx_fprime
 import numpy as np
 import matplotlib.pyplot as plt
 
@@ -10,7 +10,7 @@ class MyTestCase(unittest.TestCase):
 
     def test_mpc_control(self):
         init_uvs = np.array([3, 4, 5])
-        set_points = np.array([5, 5, 5])
+        set_points = np.array([5, 5, 5, 5])
         cv_init = 1
         uv_init = 2
         k = 3
@@ -57,6 +57,281 @@ class MyTestCase(unittest.TestCase):
 
         print("init cost: %f, mini cost: %f" % (init_cost, mini_cost))
         print("init uvs: %s, mini uvs: %s" % (init_uvs, mini_uvs))
+        self.assertLessEqual(mini_cost, init_cost)
+
+    def test_cost_gradient(self):
+        """
+        解析梯度应当和有限差分梯度一致
+        """
+        config = {
+            "model": Fopdt(3, 5, 1, 0, 0),
+            "ph": 10,
+            "ch": 4,
+            "cv0": 1.0,
+            "uv0": 2.0,
+            "circle": 1.5,
+            "u_max_move": 2,
+            "sps": np.linspace(4, 6, 10),
+            "sp_cv_wight": 10,
+            "uv_step_weight": 20
+        }
+        rng = np.random.default_rng(0)
+        for _ in range(5):
+            uvs = rng.uniform(-3, 3, 10)
+            grad = MPC.cost_gradient(uvs, config)
+            numeric = approx_fprime(uvs, MPC.cost_function, 1e-6, config)
+            np.testing.assert_allclose(grad, numeric, rtol=1e-4, atol=1e-3)
+        # 控制区间以外的决策变量不影响cost
+        np.testing.assert_array_equal(grad[4:], 0)
+
+        # 带小数迟滞和历史uv的模型
+        config["model"] = Fopdt(3, 5, 1, 0, 2.5)
+        for uv in [1, 3, 2]:
+            config["model"].next(uv)
+        grad = MPC.cost_gradient(uvs, config)
+        numeric = approx_fprime(uvs, MPC.cost_function, 1e-6, config)
+        np.testing.assert_allclose(grad, numeric, rtol=1e-4, atol=1e-3)
+
+        # QpMPC使用同一个带迟滞的模型时, 和SLSQP的最优解一致
+        slsqp = MPC.optimize_solution(np.zeros(10), config)
+        qp = QpMPC(config).solve()
+        self.assertAlmostEqual(qp.fun, slsqp.fun, places=3)
+        self.assertAlmostEqual(qp.fun, MPC.cost_function(qp.x, config), places=6)
+
+    def test_cost_function_matches_step_loop(self):
+        """
+        向量化的cost_function应当和逐步调用solve_step_fopdt的结果一致
+        """
+        ph, ch, cv0, uv0, circle, sp = 8, 3, 1.0, 2.0, 2.0, 5.0
+        fopdt = Fopdt(3, 5, cv0, 0, 0)
+        config = {
+            "model": fopdt,
+            "ph": ph,
+            "ch": ch,
+            "cv0": cv0,
+            "uv0": uv0,
+            "circle": circle,
+            "u_max_move": 2,
+            "sps": sp,
+            "sp_cv_wight": 10,
+            "uv_step_weight": 20
+        }
+        uvs = np.array([3.0, 1.0, 4.0, 1.0, 5.0, 9.0, 2.0, 6.0])
+
+        expected = 0
+        before_cv, before_uv = cv0, uv0
+        for i in range(ph):
+            uv = uvs[min(i, ch - 1)]
+            cv = fopdt.solve_step_fopdt(i * circle, (i + 1) * circle, before_cv, uv)
+            expected += 10 * (sp - cv) ** 2 + 20 * (uv - before_uv) ** 2
+            before_cv, before_uv = cv, uv
+
+        self.assertAlmostEqual(MPC.cost_function(uvs, config), expected)
+
+        batch = np.vstack((uvs, uvs[::-1], np.full(ph, uv0)))
+        costs = MPC.batch_cost_function(batch, config)
+        self.assertEqual(costs.shape, (3,))
+        for i in range(3):
+            self.assertAlmostEqual(costs[i], MPC.cost_function(batch[i], config))
+
+    def test_qp_mpc(self):
+        """
+        QpMPC的解应当和SLSQP求得的最优解一致
+        """
+        ph = 20
+        config = {
+            "model": Fopdt(3, 5, 20, 0, 0),
+            "ph": ph,
+            "ch": 5,
+            "cv0": 20.0,
+            "uv0": 2.0,
+            "circle": 1,
+            "u_max_move": 2,
+            "sps": 6.0,
+            "sp_cv_wight": 20,
+            "uv_step_weight": 20
+        }
+        qp = QpMPC(config)
+        slsqp = MPC.optimize_solution(np.full(ph, 2.0), config)
+
+        solution = qp.solve()
+        self.assertTrue(solution.success)
+        self.assertEqual(solution.x.shape, (ph,))
+        np.testing.assert_allclose(solution.x, slsqp.x[np.minimum(np.arange(ph), 4)], atol=1e-4)
+        self.assertAlmostEqual(solution.fun, MPC.cost_function(solution.x, config), places=6)
+
+        # 只更新右端项
+        config["cv0"], config["sps"] = 10.0, np.linspace(8, 12, ph)
+        slsqp = MPC.optimize_solution(np.full(ph, 2.0), config)
+        solution = qp.solve(cv0=10.0, sps=config["sps"])
+        self.assertAlmostEqual(solution.fun, slsqp.fun, places=4)
+
+    def test_singular_hessian(self):
+        """
+        uv_step_weight = 0且迟滞后有uv影响不到预测区间时, 构造QpMPC给出ValueError
+        """
+        config = {
+            "model": Fopdt(3, 5, 20, 0, 4),
+            "ph": 6,
+            "ch": 4,
+            "cv0": 20.0,
+            "uv0": 2.0,
+            "circle": 1,
+            "u_max_move": 2,
+            "sps": 6.0,
+            "sp_cv_wight": 20,
+            "uv_step_weight": 0
+        }
+        with self.assertRaisesRegex(ValueError, "uv_step_weight = 0"):
+            QpMPC(config)
+        config["uv_step_weight"] = 1
+        self.assertTrue(QpMPC(config).solve().success)
+
+    def test_constraints(self):
+        """
+        u_max_move和uv上下限在优化过程中满足, QpMPC和SLSQP的解一致
+        """
+        ph, ch, uv0, u_max_move = 30, 8, 2.0, 0.5
+        config = {
+            "model": Fopdt(3, 5, 20, 0, 0),
+            "ph": ph,
+            "ch": ch,
+            "cv0": 20.0,
+            "uv0": uv0,
+            "circle": 1,
+            "u_max_move": u_max_move,
+            "sps": 6.0,
+            "sp_cv_wight": 20,
+            "uv_step_weight": 2
+        }
+        slsqp = MPC.optimize_solution(np.full(ph, uv0), config, uv_low=-1.5, uv_high=5)
+        qp = QpMPC(config, uv_low=-1.5, uv_high=5).solve()
+        for solution in (slsqp, qp):
+            self.assertTrue(solution.success)
+            uvs = solution.x[:ch]
+            self.assertTrue(np.all(np.abs(np.diff(uvs, prepend=uv0)) <= u_max_move + 1e-6))
+            self.assertTrue(np.all(uvs >= -1.5 - 1e-6))
+        self.assertTrue(qp.active_set)
+        self.assertAlmostEqual(qp.fun, slsqp.fun, places=3)
+
+    def test_anytime_solution(self):
+        """
+        有时间预算的求解: 预算充足时和optimize_solution一致, 预算用完时返回可行的后备计划或迭代中最好的可行解
+        """
+        ph, ch, uv0 = 30, 8, 2.0
+        config = {
+            "model": Fopdt(3, 5, 20, 0, 0), "ph": ph, "ch": ch, "cv0": 20.0, "uv0": uv0, "circle": 1,
+            "u_max_move": 0.5, "sps": 6.0, "sp_cv_wight": 20, "uv_step_weight": 2
+        }
+        init_uvs = np.full(ph, -3.0)
+        slsqp = MPC.optimize_solution(np.full(ph, uv0), config, uv_low=-1.5, uv_high=5)
+        solution = MPC.anytime_solution(init_uvs, config, 10.0, uv_low=-1.5, uv_high=5)
+        self.assertEqual(solution.status, MPC.CONVERGED)
+        self.assertTrue(solution.success and solution.feasible and not solution.fallback)
+        self.assertAlmostEqual(solution.fun, slsqp.fun, places=3)
+
+        # 预算为0: 投影后的初始猜测和保持uv0中cost较小的一个
+        solution = MPC.anytime_solution(init_uvs, config, 0.0, uv_low=-1.5, uv_high=5)
+        self.assertEqual(solution.status, MPC.TIME_LIMIT)
+        self.assertFalse(solution.success)
+        self.assertTrue(solution.feasible and solution.fallback)
+        np.testing.assert_allclose(solution.x, MPC.project_rate_limit(uv0, init_uvs, 0.5, -1.5, 5))
+
+        solution = MPC.anytime_solution(init_uvs, config, 10.0, max_iter=2, uv_low=-1.5, uv_high=5)
+        self.assertEqual(solution.status, MPC.ITERATION_LIMIT)
+        self.assertTrue(solution.feasible)
+        self.assertLessEqual(solution.fun, MPC.cost_function(solution.x, config) + 1e-9)
+
+        # QP: 有效集法的迭代点始终可行
+        qp = QpMPC(config, uv_low=-1.5, uv_high=5).solve(time_budget=0.0)
+        self.assertFalse(qp.success)
+        self.assertTrue(qp.feasible)
+        self.assertEqual(qp.message, 'Time budget exhausted')
+
+        controller = MpcController(config, uv_low=-1.5, uv_high=5, time_budget=0.0)
+        # 第一个周期只有保持uv0的后备计划, 之后的周期至少采用迭代中得到的可行解
+        self.assertEqual(controller.step(20.0), uv0)
+        self.assertEqual(controller.last_solution.status, MPC.TIME_LIMIT)
+        controller.time_budget = 10.0
+        self.assertLess(controller.step(20.0), uv0)
+
+    def test_project_rate_limit(self):
+        uvs = MPC.project_rate_limit(0, [3, 3, -2, 0.5, 10], 1, uv_high=1.5)
+        np.testing.assert_allclose(uvs, [1, 1, 0, 1, 1.5])
+        np.testing.assert_allclose(MPC.filter_uv_by_max_move(2, [2.5, 5, 5], 1), [2.5, 3.5, 3.5])
+        batch = MPC.project_rate_limit(0, np.array([[3, 3], [-3, -3]]), 1)
+        np.testing.assert_allclose(batch, [[1, 1], [-1, -1]])
+
+    def test_mpc_controller_warm_start(self):
+        """
+        滚动优化: 热启动后的迭代次数应当明显减少, 两种求解方式的闭环结果一致
+        """
+        results = {}
+        for mode in (MpcController.SLSQP, MpcController.QP):
+            config = {
+                "model": Fopdt(3, 5, 20, 0, 0),
+                "ph": 30,
+                "ch": 8,
+                "cv0": 20.0,
+                "uv0": 2.0,
+                "circle": 1,
+                "u_max_move": 0.5,
+                "sps": 6.0,
+                "sp_cv_wight": 20,
+                "uv_step_weight": 2
+            }
+            controller = MpcController(config, uv_low=-1.5, uv_high=5, mode=mode)
+            plant = Fopdt(3, 5, 20, 0, 0)
+            cv, uvs = 20.0, [2.0]
+            for i in range(40):
+                uvs.append(controller.step(cv, 6.0 if i < 20 else 12.0))
+                cv = plant.next(uvs[-1])
+            self.assertEqual(len(controller.nits), 40)
+            self.assertEqual(len(controller.solve_times), 40)
+            self.assertTrue(np.all(np.abs(np.diff(uvs)) <= 0.5 + 1e-6))
+            self.assertAlmostEqual(cv, 12.0, places=3)
+            results[mode] = np.array(uvs)
+
+        np.testing.assert_allclose(results[MpcController.SLSQP], results[MpcController.QP], atol=1e-3)
+        # QP模式下有效集不变的周期只需要一次迭代
+        self.assertLessEqual(np.median(controller.nits), 1)
+
+    def test_mpc_config(self):
+        """
+        配置按键名转换, 与键的顺序和别名无关; 错误的配置在构造时报错
+        """
+        fopdt = Fopdt(3, 5, 1, 0, 0)
+        config = {
+            "model": fopdt, "ph": 6, "ch": 3, "cv0": 1.0, "uv0": 2.0, "circle": 1,
+            "u_max_move": 2, "sps": 5.0, "sp_cv_wight": 10, "uv_step_weight": 20
+        }
+        legacy = {
+            "uv_step_weight": 20, "set_points": 5.0, "fopdt": fopdt, "control_horizon": 3,
+            "predict_horizon": 6, "uv_limit": 2, "circle": 1, "sp_y_wight": 10, "uv_init": 2.0, "cv_init": 1.0
+        }
+        compiled = MpcConfig(fopdt, 6, 3, 1, 10, 20, u_max_move=2, cv0=1.0, uv0=2.0, sps=5.0)
+        uvs = np.array([3.0, 1.0, 4.0, 1.0, 5.0, 9.0])
+        cost = MPC.cost_function(uvs, config)
+        self.assertAlmostEqual(MPC.cost_function(uvs, legacy), cost)
+        self.assertAlmostEqual(MPC.cost_function(uvs, compiled), cost)
+        np.testing.assert_array_equal(compiled.index, [0, 1, 2, 2, 2, 2])
+
+        # 逐步的权重向量
+        weighted = MpcConfig(fopdt, 6, 3, 1, np.full(6, 10.0), np.full(6, 20.0), cv0=1.0, uv0=2.0, sps=5.0)
+        self.assertAlmostEqual(MPC.cost_function(uvs, weighted), cost)
+
+        for kwargs in ({"ch": 7}, {"ch": 0}, {"ph": 2.5}, {"circle": 0}, {"u_max_move": -1},
+                       {"uv_low": 3, "uv_high": 1}, {"sps": np.ones(4)}, {"sp_cv_wight": -1},
+                       {"model": object()}):
+            arguments = dict(model=fopdt, ph=6, ch=3, circle=1, sp_cv_wight=10, uv_step_weight=20)
+            arguments.update(kwargs)
+            with self.assertRaises(ValueError):
+                MpcConfig(**arguments)
+        with self.assertRaises(ValueError):
+            MpcConfig.from_dict(dict(config, unknown=1))
+        with self.assertRaises(ValueError):
+            MpcConfig(Fopdt(3, 0, 1, 0, 0), 6, 3, 1, 10, 20)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,45 @@
+import unittest
+import numpy as np
+from balloonUtils import HotAirBalloon
+from nmpcControl import BalloonNMPC
+
+
+class NmpcControlTest(unittest.TestCase):
+
+    def test_linearize(self):
+        """
+        线性化的预测和非线性模型在小扰动下一致
+        """
+        controller = BalloonNMPC(ph=20, ch=4)
+        x0 = np.array([0.5, 0.0, 1.25])
+        plan = np.tile([0.005, 0.001], (controller.ch, 1))
+        states, G = controller.linearize(x0, plan)
+        np.testing.assert_allclose(states, controller.predict(x0, plan))
+
+        dz = np.random.default_rng(0).normal(size=G.shape[1]) * 1e-4
+        perturbed = controller.predict(x0, plan + dz.reshape(controller.ch, 2) * controller.scale)
+        np.testing.assert_allclose(perturbed[1:, 0] - states[1:, 0], G.dot(dz), atol=1e-5)
+
+    def test_closed_loop_tracking(self):
+        controller = BalloonNMPC(u_max_move=(2.0 / HotAirBalloon.FR, 1.0 / HotAirBalloon.PR))
+        controller.u0 = np.array([0.0041, 0.0])
+        plant = HotAirBalloon(HotAirBalloon.X_NEUTRAL, dt=controller.dt)
+        fuel = [controller.u0[0]]
+        for _ in range(60):
+            u = controller.step(plant.x, 1.0)
+            plant.next(u)
+            fuel.append(u[0])
+            self.assertTrue(controller.last_solution.success)
+            self.assertLessEqual(controller.last_solution.nit, controller.max_iter)
+
+        self.assertAlmostEqual(plant.x[0], 1.0, delta=0.02)
+        # 输入满足上下限和移动限制
+        fuel = np.array(fuel)
+        self.assertTrue(np.all(fuel >= 0) and np.all(fuel <= controller.u_high[0] + 1e-12))
+        self.assertLessEqual(np.abs(np.diff(fuel)).max(), controller.u_max_move[0] + 1e-12)
+        # 稳态下热启动只需要一次线性化
+        self.assertEqual(controller.nits[-1], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
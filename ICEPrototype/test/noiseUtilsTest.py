@@ -0,0 +1,85 @@
+import unittest
+import numpy as np
+from noiseUtils import NoiseModel
+
+
+class NoiseUtilsTest(unittest.TestCase):
+
+    def test_repeatable(self):
+        """
+        相同的seed得到逐位相同的序列, 和块的边界无关
+        """
+        config = dict(dv=5, white=0.1, walk=0.05, phi=0.9, steps=[(30, 1.0)], step_rate=0.05, step_size=0.5)
+        first = NoiseModel(seed=7, block=16, **config)
+        second = NoiseModel(seed=7, block=16, **config)
+        a = [first.apply(10.0) for _ in range(100)]
+        b = [second.apply(10.0) for _ in range(100)]
+        self.assertEqual(a, b)
+
+        first.reset()
+        self.assertEqual([first.apply(10.0) for _ in range(100)], a)
+        self.assertNotEqual(a, [NoiseModel(seed=8, block=16, **config).apply(10.0) for _ in range(100)])
+
+    def test_components_independent(self):
+        """
+        打开一种成分不改变其余成分的序列
+        """
+        white = NoiseModel(white=0.1, seed=3)
+        both = NoiseModel(white=0.1, walk=0.2, seed=3)
+        walk = NoiseModel(walk=0.2, seed=3)
+        for _ in range(50):
+            np.testing.assert_allclose(both.apply(0.0), white.apply(0.0) + walk.apply(0.0))
+
+    def test_step_and_walk(self):
+        noise = NoiseModel(2, steps=[(5, [1.0, -2.0])], block=4)
+        values = np.array([noise.apply(np.zeros(2)) for _ in range(10)])
+        np.testing.assert_allclose(values[:5], 0)
+        np.testing.assert_allclose(values[5:], [[1.0, -2.0]] * 5)
+
+        # 随机游走的方差随时间线性增长
+        noise = NoiseModel(2000, walk=1.0, seed=0, block=64)
+        values = np.array([noise.apply(np.zeros(2000)) for _ in range(100)])
+        self.assertAlmostEqual(values[-1].var() / 100, 1, delta=0.1)
+
+    def test_multiplicative(self):
+        noise = NoiseModel(dv=5, seed=0)
+        values = np.array([noise.apply(10.0) for _ in range(1000)])
+        self.assertTrue(np.all(np.abs(values - 10) <= 0.5))
+        noise.dv = 0
+        self.assertEqual(noise.apply(10.0), 10.0)
+
+    def test_per_channel_streams(self):
+        """
+        每个通道的序列和通道总数、块的长度无关; dv从0变为非0后的序列和一直非0时一致
+        """
+        config = dict(dv=5, white=0.1, walk=0.05, phi=0.9, step_rate=0.1, step_size=0.5, seed=7)
+        small = NoiseModel(3, block=16, **config)
+        large = NoiseModel(8, block=5, **config)
+        a = np.array([small.apply(np.full(3, 10.0)) for _ in range(40)])
+        b = np.array([large.apply(np.full(8, 10.0)) for _ in range(40)])
+        np.testing.assert_array_equal(a, b[:, :3])
+
+        always = NoiseModel(2, dv=5, seed=3, block=8)
+        switched = NoiseModel(2, dv=0, seed=3, block=8)
+        y = np.ones(2)
+        expected = [always.apply(y) for _ in range(30)]
+        values = [switched.apply(y) for _ in range(13)]
+        switched.dv = [0, 5]
+        values += [switched.apply(y) for _ in range(17)]
+        np.testing.assert_array_equal(np.array(values)[13:, 1], np.array(expected)[13:, 1])
+        np.testing.assert_array_equal(np.array(values)[:, 0], 1)
+
+    def test_no_noise_allocates_nothing(self):
+        noise = NoiseModel(5000)
+        self.assertLessEqual(noise.block * 5000 * 8, NoiseModel.MEMORY)
+        y = np.arange(5000.0)
+        value = noise.apply(y)
+        np.testing.assert_array_equal(value, y)
+        self.assertIsNot(value, y)
+        self.assertIsNone(noise._uniform)
+        self.assertIsNone(noise._additive_rows)
+        np.testing.assert_array_equal(noise.disturbance(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
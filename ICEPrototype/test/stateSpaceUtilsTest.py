@@ -0,0 +1,81 @@
+import unittest
+import numpy as np
+from scipy.integrate import odeint
+from fopdtUtils import Fopdt
+from stateSpaceUtils import StateSpace
+from mpcControl import MpcConfig, MpcController, MPC
+from simulationUtils import SimulationUtils
+
+
+class StateSpaceUtilsTest(unittest.TestCase):
+
+    def test_first_order_matches_fopdt(self):
+        """
+        一阶的状态空间模型和Fopdt的结果一致(包括小数迟滞)
+        """
+        model = StateSpace.lag_chain(1, 3, 5, theta=1.5, x0=[2.0])
+        fopdt = Fopdt(3, 5, 2.0, 0, 1.5)
+        uvs = np.sin(np.arange(30) / 3)
+        np.testing.assert_allclose([model.next(u) for u in uvs], [fopdt.next(u) for u in uvs])
+        self.assertAlmostEqual(model.k, 3)
+
+    def test_lag_chain_matches_odeint(self):
+        n, k, tau = 10, 3.0, 5.0
+        model = StateSpace.lag_chain(n, k, tau)
+
+        def process(y, t, u):
+            dydt = np.zeros(n)
+            dydt[0] = (-y[0] + k * u) / (tau / n)
+            dydt[1:] = (-y[1:] + y[:-1]) / (tau / n)
+            return dydt
+
+        uvs = np.zeros(30)
+        uvs[5:] = 1.0
+        y = np.zeros(n)
+        expected = []
+        for u in uvs:
+            y = odeint(process, y, [0, 1], args=(u,), rtol=1e-10, atol=1e-12)[-1]
+            expected.append(y[-1])
+        np.testing.assert_allclose([model.next(u) for u in uvs], expected, atol=1e-8)
+        # 离散化按采样周期缓存
+        self.assertIs(model.discretize(1), model.discretize(1))
+
+    def test_prediction_interface(self):
+        model = StateSpace.lag_chain(4, 2, 6, theta=2, x0=[0.5, 0.3, 0.2, 0.1])
+        for u in (1.0, 0.5, -0.2):
+            model.record_uv(u)
+        uvs = np.linspace(-1, 1, 15)
+        G, phi = model.dynamic_matrix(15, 1)
+        np.testing.assert_allclose(model.predict_horizon(0.7, uvs, 1),
+                                   phi * 0.7 + G.dot(uvs) + model.history_response(15, 1))
+        weights = np.linspace(1, 2, 15)
+        np.testing.assert_allclose(model.predict_horizon_transpose(weights, 1), G.T.dot(weights))
+
+        # 预测和之后的实际仿真一致(cv0 = 模型输出时偏置为0)
+        plant = StateSpace.lag_chain(4, 2, 6, theta=2, x0=model.x)
+        plant.uv_store.values[:] = model.uv_store.values
+        plant.uv_store.head = model.uv_store.head
+        np.testing.assert_allclose(model.predict_horizon(model.y0, uvs, 1), [plant.next(u) for u in uvs])
+
+    def test_closed_loop(self):
+        """
+        状态空间模型作为MPC的预测模型和仿真过程
+        """
+        plant = StateSpace.lag_chain(6, 3, 5, theta=1)
+        model = StateSpace.lag_chain(6, 3, 5, theta=1)
+        config = MpcConfig(model, 30, 5, 1, 20, 5, u_max_move=1, uv_low=-5, uv_high=5)
+        result = SimulationUtils.run_closed_loop(plant, config, 2.0, 60, MpcController.QP)
+        self.assertTrue(result.success.all())
+        self.assertAlmostEqual(result.cv[-1], 2.0, places=3)
+
+        # 梯度和有限差分一致
+        uvs = np.linspace(0, 1, 30)
+        grad = MPC.cost_gradient(uvs, config)
+        eps = 1e-6
+        numeric = [(MPC.cost_function(uvs + eps * e, config) - MPC.cost_function(uvs - eps * e, config)) / (2 * eps)
+                   for e in np.eye(30)]
+        np.testing.assert_allclose(grad, numeric, rtol=1e-5, atol=1e-5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+import tempfile
+import unittest
+import numpy as np
+from tuningUtils import TuningSweep, closed_loop_kpis
+from simulationUtils import ClosedLoopResult
+
+
+class TuningUtilsTest(unittest.TestCase):
+
+    def test_closed_loop_kpis(self):
+        result = ClosedLoopResult(6, 3, 1)
+        result.sp[:] = 2.0
+        result.cv[:] = [0, 1, 2.5, 2.05, 2.0, 2.0, 2.0]
+        result.uv[:] = [0, 1, 0.5, 0.5, 0.5, 0.5, 0.5]
+        kpis = closed_loop_kpis(result)
+        self.assertAlmostEqual(kpis['iae'], 1.55)
+        self.assertAlmostEqual(kpis['overshoot'], 25)
+        self.assertAlmostEqual(kpis['settling_time'], 2)
+        self.assertAlmostEqual(kpis['total_move'], 1.5)
+
+    def test_grid(self):
+        points = TuningSweep.grid(ph=[20, 30], ch=[3, 5, 8])
+        self.assertEqual(len(points), 6)
+        self.assertIn({'ph': 30, 'ch': 5}, points)
+        with self.assertRaises(ValueError):
+            TuningSweep().point_config({'unknown': 1})
+
+    def test_config_key(self):
+        """
+        取值相同而类型不同的配置使用同一个缓存键
+        """
+        sweep = TuningSweep()
+        key = TuningSweep.config_key(sweep.point_config({'ph': 20, 'sp_cv_wight': 5}))
+        for point in ({'ph': 20.0, 'sp_cv_wight': 5.0}, {'ph': np.int64(20), 'sp_cv_wight': np.float64(5)}):
+            self.assertEqual(TuningSweep.config_key(sweep.point_config(point)), key)
+        self.assertEqual(TuningSweep.config_key({'sps': (6, 10)}), TuningSweep.config_key({'sps': np.array([6.0, 10.0])}))
+        self.assertNotEqual(TuningSweep.config_key(sweep.point_config({'ph': 21})), key)
+
+    def test_sweep_cache(self):
+        with tempfile.TemporaryDirectory() as directory:
+            sweep = TuningSweep({'n_steps': 60}, cache_dir=directory, processes=2)
+            points = TuningSweep.grid(sp_cv_wight=[5, 20], plant_k_scale=[1.0, 1.3])
+            first = sweep.run(points)
+            self.assertEqual((sweep.cache_hits, sweep.computed), (0, 4))
+            for row in first:
+                self.assertTrue(np.isfinite(row['iae']))
+
+            second = sweep.run(points + [{'sp_cv_wight': 50, 'plant_k_scale': 1.0}])
+            self.assertEqual((sweep.cache_hits, sweep.computed), (4, 1))
+            for a, b in zip(first, second):
+                self.assertEqual(a['iae'], b['iae'])
+            # 模型失配时的表现应当不同
+            self.assertNotEqual(first[0]['iae'], first[1]['iae'])
+
+
+if __name__ == '__main__':
+    unittest.main()
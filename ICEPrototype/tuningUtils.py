@@ -0,0 +1,226 @@
+import hashlib
+import itertools
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from fopdtUtils import Fopdt
+from mpcControl import MpcConfig, MpcController
+from simulationUtils import SimulationUtils
+
+
+class TuningSweep:
+    """
+    MPC整定参数的批量扫描
+    1. 把整定参数(sp_cv_wight, uv_step_weight, ph, ch, circle等)和模型失配的组合分发到进程池中并行仿真；
+    2. 每次仿真只返回紧凑的KPI: IAE, 超调量, 调节时间, 总的uv移动量, 平均/最大求解耗时；
+    3. 结果按配置的哈希值缓存在磁盘上, 增加少量组合后重新扫描只计算新增的组合。
+    """
+
+    # 一次仿真的默认配置. plant_k_scale, plant_tau_scale, plant_theta描述过程与预测模型的失配
+    DEFAULTS = {
+        'k': 3.0,
+        'tau': 5.0,
+        'theta': 0,
+        'plant_k_scale': 1.0,
+        'plant_tau_scale': 1.0,
+        'plant_theta': None,
+        'ph': 30,
+        'ch': 8,
+        'circle': 1,
+        'sp_cv_wight': 20,
+        'uv_step_weight': 20,
+        'u_max_move': None,
+        'uv_low': None,
+        'uv_high': None,
+        'cv0': 0.0,
+        'uv0': 0.0,
+        'sp_times': [10, 60],
+        'sps': [0.0, 5.0, 2.0],
+        'n_steps': 100,
+        'mode': MpcController.QP,
+        'settle_band': 0.05
+    }
+
+    def __init__(self, base=None, cache_dir=None, processes=None):
+        """
+        构造函数
+        :param base: dict. 覆盖DEFAULTS的基础配置
+        :param cache_dir: str. 缓存目录, None表示不缓存
+        :param processes: int. 进程数, None表示使用cpu个数, 1表示在当前进程中顺序计算
+        """
+        unknown = set(base or {}) - set(TuningSweep.DEFAULTS)
+        if unknown:
+            raise ValueError("未知的整定配置项: %s" % ', '.join(sorted(unknown)))
+        self.base = dict(TuningSweep.DEFAULTS, **(base or {}))
+        self.cache_dir = cache_dir
+        self.processes = processes
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+        # 最近一次run中命中缓存和实际计算的组合个数
+        self.cache_hits = 0
+        self.computed = 0
+
+    @staticmethod
+    def grid(**axes):
+        """
+        生成参数网格(笛卡尔积)
+        :param axes: 参数名 -> 取值列表. 例如 grid(sp_cv_wight=[10, 20], ph=[20, 30])
+        :return: list. 每个元素是一个参数组合的dict
+        """
+        names = list(axes)
+        return [dict(zip(names, values)) for values in itertools.product(*(axes[name] for name in names))]
+
+    def point_config(self, point):
+        """
+        参数组合与基础配置合并后的完整配置
+        :param point: dict. 参数组合
+        :return: dict
+        """
+        unknown = set(point) - set(TuningSweep.DEFAULTS)
+        if unknown:
+            raise ValueError("未知的整定配置项: %s" % ', '.join(sorted(unknown)))
+        return dict(self.base, **point)
+
+    @staticmethod
+    def config_key(config):
+        """
+        :param config: dict. 完整配置
+        :return: str. 配置的哈希值, 作为缓存的键
+        """
+        text = json.dumps(_normalize(config), sort_keys=True)
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    def run(self, points):
+        """
+        扫描一组参数组合
+        :param points: list. 参数组合的列表, 比如grid的返回值
+        :return: list. 和points顺序一致, 每个元素为 dict(参数组合, **KPI)
+        """
+        configs = [self.point_config(point) for point in points]
+        keys = [TuningSweep.config_key(config) for config in configs]
+
+        kpis = {}
+        for key in dict.fromkeys(keys):
+            cached = self._load(key)
+            if cached is not None:
+                kpis[key] = cached
+        missing = [key for key in dict.fromkeys(keys) if key not in kpis]
+        self.cache_hits = len(kpis)
+        self.computed = len(missing)
+
+        missing_configs = [configs[keys.index(key)] for key in missing]
+        if self.processes == 1:
+            results = map(run_point, missing_configs)
+        else:
+            with ProcessPoolExecutor(max_workers=self.processes) as executor:
+                results = list(executor.map(run_point, missing_configs))
+        for key, config, result in zip(missing, missing_configs, results):
+            kpis[key] = result
+            self._save(key, config, result)
+
+        return [dict(point, **kpis[key]) for point, key in zip(points, keys)]
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + '.json')
+
+    def _load(self, key):
+        if self.cache_dir is None or not os.path.exists(self._path(key)):
+            return None
+        with open(self._path(key)) as f:
+            return json.load(f)['kpis']
+
+    def _save(self, key, config, kpis):
+        if self.cache_dir is None:
+            return
+        # 先写临时文件再重命名, 避免并发扫描读到写了一半的缓存
+        temp = self._path(key) + '.%i.tmp' % os.getpid()
+        with open(temp, 'w') as f:
+            json.dump({'config': config, 'kpis': kpis}, f, default=float)
+        os.replace(temp, self._path(key))
+
+
+def _normalize(value):
+    """
+    把配置中的数值统一转换为float, 序列统一转换为list, 使哈希值只取决于取值(20和20.0, np.int64(20)的键相同)
+    :param value: 配置或其中的一项
+    :return: 可以JSON序列化的对象
+    """
+    if isinstance(value, dict):
+        return {key: _normalize(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return [_normalize(item) for item in value]
+    if isinstance(value, (bool, np.bool_)):
+        return bool(value)
+    if isinstance(value, (int, float, np.number)):
+        return float(value)
+    return value
+
+
+def run_point(config):
+    """
+    按完整配置运行一次闭环仿真并计算KPI. 定义在模块级别, 以便在进程池中调用
+    :param config: dict. 完整配置, 见TuningSweep.DEFAULTS
+    :return: dict. KPI
+    """
+    model = Fopdt(config['k'], config['tau'], config['cv0'], 0, config['theta'])
+    plant_theta = config['theta'] if config['plant_theta'] is None else config['plant_theta']
+    plant = Fopdt(config['k'] * config['plant_k_scale'], config['tau'] * config['plant_tau_scale'],
+                  config['cv0'], 0, plant_theta)
+    mpc_config = MpcConfig(
+        model, config['ph'], config['ch'], config['circle'], config['sp_cv_wight'], config['uv_step_weight'],
+        config['u_max_move'], config['uv_low'], config['uv_high'], config['cv0'], config['uv0'], config['sps'][0]
+    )
+
+    n_steps = config['n_steps']
+    sps = SimulationUtils.create_sps(n_steps, config['sp_times'], config['sps'])
+    result = SimulationUtils.run_closed_loop(plant, mpc_config, sps, n_steps, config['mode'])
+    return closed_loop_kpis(result, config['settle_band'])
+
+
+def closed_loop_kpis(result, settle_band=0.05):
+    """
+    闭环仿真结果的KPI
+    :param result: ClosedLoopResult.
+    :param settle_band: float. 调节时间的误差带, 相对于设定值变化幅度
+    :return: dict = {
+        iae: float. 误差绝对值的积分
+        overshoot: float. 各次设定值变化中最大的超调量(%)
+        settling_time: float. 各次设定值变化中最长的调节时间, 没有进入误差带时为inf
+        total_move: float. uv变化量绝对值之和
+        mean_solve_time: float. 平均求解耗时(秒)
+        max_solve_time: float. 最大求解耗时(秒)
+    }
+    """
+    circle = result.t[1] - result.t[0]
+    # cv[i + 1]是第i个周期写入uv之后的测量值, 和sp[i]对应
+    cv, sp = result.cv[1:], result.sp
+    error = sp - cv
+
+    overshoot, settling_time = 0.0, 0.0
+    changes = np.flatnonzero(np.diff(sp, prepend=result.cv[0]) != 0)
+    for i, start in enumerate(changes):
+        end = changes[i + 1] if i + 1 < len(changes) else len(sp)
+        before = result.cv[0] if start == 0 else sp[start - 1]
+        step = sp[start] - before
+        segment = (cv[start:end] - sp[start]) * np.sign(step)
+        overshoot = max(overshoot, 100 * max(segment.max(initial=0), 0) / abs(step))
+
+        outside = np.flatnonzero(np.abs(segment) > settle_band * abs(step))
+        if len(outside) == 0:
+            settle = 0.0
+        elif outside[-1] == end - start - 1:
+            settle = float('inf')
+        else:
+            settle = (outside[-1] + 1) * circle
+        settling_time = max(settling_time, settle)
+
+    return {
+        'iae': float(np.sum(np.abs(error)) * circle),
+        'overshoot': float(overshoot),
+        'settling_time': float(settling_time),
+        'total_move': float(np.sum(np.abs(np.diff(result.uv)))),
+        'mean_solve_time': float(result.solve_time.mean()),
+        'max_solve_time': float(result.solve_time.max())
+    }